@@ -32,6 +32,8 @@ To specify a User-class you must do the following:
 	
 	User.find_all()		# returns all users
 	u = User.find_by_id('some_user') # finds the user with the ID 'some_user'
+	User.find_by_ids(['a', 'b'])	# returns { 'a': <User a>, 'b': None } with
+									# chunked OR-filters
 	u.telephoneNumber = '44444'
 	u.save()			# updates the user
 
@@ -48,6 +50,22 @@ To specify a User-class you must do the following:
 
 	User.find('(telephoneNumber=3333)')	# Returns all users with the 
 										# phone number 3333
+
+	for u in User.iter_find_all():	# Yields all users page by page with
+		print u.uid					# the paged-results control, so large
+									# trees are never held in memory
+
+Searches only request the declared attributes. With only=(...) just the given
+attributes and the dn_attribute are loaded. Such partial items raise a
+PartialInstanceError if attributes which weren't loaded should be saved:
+
+	u = User.find_by_id('some_user', only=('mail', ))
+	u.mail = 'new@example.com'
+	u.save()			# sends only the new mail
+
+Classes with lazy_attributes = True keep the raw search results and decode
+every attribute on its first access, which makes listings of large entries
+cheaper if only some attributes are shown.
 	
 == Relationships ==
 ActiveLdap allows you to define 2 kinds of relationships: has-many and
@@ -113,5 +131,71 @@ array to store all foreign IDs.
 In a one-to-many-Relationship no attribute is used as an array, which means 
 each Device.SwitchID-attribute contains only a single SwitchID.
 
+If an instance is deleted or its referenced attribute is renamed, every
+referring item is loaded, changed and saved, which sends its events. Relations
+with cascade_signals=False skip the events and send a single MOD_DELETE (and
+MOD_ADD) per referring entry instead, all of them pipelined:
+
+	devices = ManyToManyField(Device, my_attr='deviceID',
+							  other_attr='deviceID', cascade_signals=False)
+
+Relations of many items can be loaded at once in order to avoid one search per
+item:
+
+	users = User.find_all(prefetch=('devices', ))	# two searches in total
+	devices = Device.find('(SwitchID=sw1)', prefetch=('users', 'switch'))
+
+Relations which are loaded item by item can be detected with a
+NPlusOneDetector, which warns (or raises with fail=True) once a relation was
+searched more often than the threshold from the same line:
+
+	from detector import NPlusOneDetector
+
+	with NPlusOneDetector(threshold=10, fail=True):
+		for device in Device.find_all():
+			device.switch	# raises a NPlusOneError at the eleventh device
+
+== Identity Map ==
+Within an identity map every entry is loaded only once. Searches return the
+already loaded instances and find_by_id is answered from memory:
+
+	from active_ldap import IdentityMap
+
+	with IdentityMap():
+		user = User.find_by_id('some_user')
+		user.devices[0].users		# contains the same user instance
+		User.find_by_id('some_user')	# no search, returns user
+
+== Unit of Work ==
+A unit of work collects the writes of many instances and sends them together
+when the with-block is left. It is an identity map, too:
+
+	from active_ldap import UnitOfWork
+
+	with UnitOfWork() as unit_of_work:
+		for attrs in rows:
+			unit_of_work.save(User(attrs))
+		unit_of_work.delete(Device.find_by_id('old_device'))
+	unit_of_work.errors		# the instances which weren't written
+
+The changes of an entry are coalesced into one modification. The writes are
+pipelined in batches: renames, creations (parents first), modifications and
+deletions (children first). Cascades of relations join the unit of work. If
+the server advertises LDAP transactions (RFC 5805) everything is sent within
+one transaction, UnitOfWork(transactions=False) disables this.
+
+== Deferred Events ==
+Slow callbacks of after_* events can be delivered by a pool of worker threads.
+Events of the same entry are delivered in order, before_* events always stay
+synchronous. The callbacks get a copy of the item as it was when the event was
+sent:
+
+	from signals.deferred import DeferredDelivery
+
+	delivery = DeferredDelivery(workers=4, queue_size=1000)
+	User.events.register('after_save', audit_log, delivery)
+	...
+	delivery.drain()	# waits for the queued events, e.g. in tests
+
 """
 
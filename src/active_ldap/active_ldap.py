@@ -5,7 +5,22 @@ derived.
 import ldap
 import re
 import os
+import sys
+import copy
+from ldap.controls import SimplePagedResultsControl
 from signals.signals import Sendable, send_event
+from pool.pool import ConnectionPool, reserved
+from session import IdentityMap, current_identity_map, normalize_id
+from session import UnitOfWork, current_unit_of_work
+from cache.cache import ResultCache
+from instrumentation import Instrumentation, InstrumentedConnection
+from detector import relation_loaded
+
+class PartialInstanceError(RuntimeError):
+	"""
+	This exception is raised when an item which was loaded with only some of
+	its attributes should write attributes which weren't loaded.
+	"""
 
 class RelationField(object):
 	"""
@@ -16,8 +31,15 @@ class RelationField(object):
 	other_class -- The other class of the relationship.
 	my_attr -- the name of the local attribute.
 	other_attr -- The name of the attribute on the other class.
+	chunk_size -- the number of IDs per OR-filter when many objects are
+				  fetched, defaults to filter_chunk_size of the fetched class.
+	cascade_signals -- if False the foreign keys of renamed or deleted
+					   objects are changed with pipelined modifications
+					   instead of saving every referencing object, so no
+					   events are sent for them.
 	"""
-	def __init__(self, other_class, my_attr=None, other_attr=None):
+	def __init__(self, other_class, my_attr=None, other_attr=None,
+				 chunk_size=None, cascade_signals=True):
 		if other_attr is None:
 			other_attr = other_class.dn_attribute
 		if my_attr is None:
@@ -28,6 +50,8 @@ class RelationField(object):
 		self.my_class	 = None
 		self.my_attr     = my_attr
 		self.other_attr  = other_attr
+		self.chunk_size  = chunk_size
+		self.cascade_signals = cascade_signals
 	
 	def create_relation(self, foreign_name, cls):
 		"""
@@ -41,6 +65,79 @@ class RelationField(object):
 		"""
 		raise NotImplementedError("Not Implemented")
 
+	def _create_prefetch_other_objects(self, cache_name, many):
+		"""
+		Returns a function which loads the objects of the other class for a
+		list of instances of my_class with one search and fills their caches.
+
+		cache_name -- the name of the cache attribute, e.g. _device
+		many -- True if every instance references a list of objects
+		"""
+		foreign = self
+		def prefetch_other_objects(instances):
+			"""
+			Fetches the referenced objects of all given instances at once.
+			"""
+			ids = []
+			for instance in instances:
+				ids += instance._as_list(getattr(instance, foreign.my_attr))
+			others = {}
+			for other in foreign.other_class._find_by_values(
+				foreign.other_attr, ids, foreign.chunk_size
+			):
+				for i in other._as_list(getattr(other, foreign.other_attr)):
+					others.setdefault(i, other)
+			for instance in instances:
+				found = []
+				for i in instance._as_list(getattr(instance, foreign.my_attr)):
+					if i in others and others[i] not in found:
+						found.append(others[i])
+				if not many:
+					found = (found or [ None ])[0]
+				fill_relation_cache(instance, cache_name, found)
+		return prefetch_other_objects
+
+	def _create_prefetch_my_objects(self, cache_name):
+		"""
+		Returns a function which loads the referencing objects of my_class for
+		a list of instances of the other class with one search and fills their
+		caches.
+
+		cache_name -- the name of the cache attribute, e.g. _users
+		"""
+		foreign = self
+		def prefetch_my_objects(instances):
+			"""
+			Fetches the referencing objects of all given instances at once.
+			"""
+			ids = [ getattr(i, foreign.other_attr) for i in instances ]
+			mine = {}
+			for my_object in foreign.my_class._find_by_values(
+				foreign.my_attr, ids, foreign.chunk_size
+			):
+				my_ids = getattr(my_object, foreign.my_attr)
+				for i in set(my_object._as_list(my_ids)):
+					mine.setdefault(i, []).append(my_object)
+			for instance in instances:
+				fill_relation_cache(
+					instance,
+					cache_name,
+					mine.get(getattr(instance, foreign.other_attr), [])
+				)
+		return prefetch_my_objects
+
+def fill_relation_cache(instance, cache_name, value):
+	"""
+	Stores the prefetched value in the relation cache of the instance.
+
+	instance -- the instance whose cache should be filled
+	cache_name -- the name of the cache attribute, e.g. _device
+	value -- the related object or the list of related objects
+	"""
+	if cache_name not in instance.has_many_list:
+		instance.has_many_list.append(cache_name)
+	setattr(instance, cache_name, value)
+
 def referenced_object_deleted(self, obj):
 	"""
 	This method is called from the referenced class if an instance of it
@@ -48,9 +145,14 @@ def referenced_object_deleted(self, obj):
 	
 	obj -- the object which will be deleted
 	"""
-	name = "%ss" % self.my_class.__name__.lower()
 	deleted_id = getattr(obj, self.other_attr)
-	items = getattr(obj, name)
+	unit_of_work = cascading_unit_of_work(obj)
+	if not self.cascade_signals:
+		modify_referrers(self, deleted_id, None, unit_of_work)
+		return
+	items = self.my_class.find(
+		'(%s=%s)' % (self.my_attr, deleted_id), only=( self.my_attr, )
+	)
 	for item in items:
 		attr = getattr(item, self.my_attr)
 		if not isinstance(attr, list):
@@ -58,36 +160,182 @@ def referenced_object_deleted(self, obj):
 		# remove the id
 		attr.remove(deleted_id)
 		setattr(item, self.my_attr, attr)
-		item.save()
+		save_referrer(item, unit_of_work)
 
 def referenced_object_renamed(self, new_obj):
 	"""
 	This method is called from the referenced class if an instance of it was
-	updated. It checks if the object was renamed and if it was renamed it
-	updates the foreign keys in the other classes.
+	updated. It checks if the referenced attribute was changed, which is
+	known locally, and if so it updates the foreign keys of the referencing
+	items. They are found with a single search which only loads the foreign
+	keys, so saving them sends just the changed values.
 
 	new_obj -- the object which was updated
 	"""
-	old_dn = new_obj._value_from_full_dn()
-	if old_dn is None:
+	if not hasattr(new_obj, 'dn'):
 		return
-	old_obj = new_obj.__class__.find_by_id(old_dn)
-	old_attr = getattr(old_obj, self.other_attr)
+	old_attr = new_obj._original_value(self.other_attr)
 	new_attr = getattr(new_obj, self.other_attr)
 	if old_attr == new_attr:
 		return
+	unit_of_work = cascading_unit_of_work(new_obj)
+	if not self.cascade_signals:
+		modify_referrers(self, old_attr, new_attr, unit_of_work)
+		return
 
 	# Change the foreign keys
-	name = '%ss' % self.my_class.__name__.lower()
-	items = getattr(old_obj, name)
+	items = self.my_class.find(
+		'(%s=%s)' % (self.my_attr, old_attr), only=( self.my_attr, )
+	)
 	for item in items:
 		attr = getattr(item, self.my_attr)
-		if not isinstance(attr, list):
-			attr = [ attr ]
-		attr[attr.index(old_attr)] = new_attr
+		if isinstance(attr, list):
+			attr[attr.index(old_attr)] = new_attr
+		else:
+			attr = new_attr
 		setattr(item, self.my_attr, attr)
+		save_referrer(item, unit_of_work)
+
+def cascading_unit_of_work(obj):
+	"""
+	Returns the active unit of work if it plans the write of the given
+	referenced object, so the cascade is written together with it. Objects
+	which are written directly cascade directly, too, and None is returned.
+
+	obj -- the referenced object which is deleted or updated
+	"""
+	unit_of_work = current_unit_of_work()
+	if unit_of_work is not None and unit_of_work.is_planning(obj):
+		return unit_of_work
+	return None
+
+def save_referrer(item, unit_of_work=None):
+	"""
+	Saves a referencing item whose foreign key was changed.
+
+	item -- the referencing item
+	unit_of_work -- the UnitOfWork which should save the item together with
+					the other writes, None to save it right away
+	"""
+	if unit_of_work is not None:
+		unit_of_work.save(item)
+	else:
 		item.save()
-		
+
+def modify_referrers(self, old_value, new_value=None, unit_of_work=None):
+	"""
+	Removes the old value from the foreign keys of all referencing entries
+	and adds the new value. Every entry gets a single modification, which
+	are sent pipelined on one connection. Referencing instances within the
+	identity map are updated, but no events are sent. Failed modifications
+	are ignored like failed saves.
+
+	self -- the relation
+	old_value -- the value which should be removed
+	new_value -- the value which should be added, None to only remove
+	unit_of_work -- the UnitOfWork which should send the modifications
+					together with the other writes, None to send them
+					right away
+	"""
+	cls = self.my_class
+	changes = [ ( ldap.MOD_DELETE, self.my_attr, [ old_value ] ) ]
+	if new_value is not None:
+		changes.append( ( ldap.MOD_ADD, self.my_attr, [ new_value ] ) )
+	with reserved(cls.connection) as connection:
+		results = connection.search_s(
+			cls.prefix,
+			cls.scope,
+			'(&%s(%s=%s))' % (cls._classes_string(), self.my_attr, old_value),
+			[ cls.dn_attribute ]
+		)
+		if unit_of_work is not None:
+			for dn, attrs in results:
+				unit_of_work.modify(cls, dn, changes)
+		else:
+			msgids = [
+				connection.modify_ext(dn, changes) for dn, attrs in results
+			]
+			for msgid in msgids:
+				try:
+					connection.result3(msgid)
+				except ldap.LDAPError:
+					pass
+	if cls.result_cache is not None:
+		cls.result_cache.clear()
+	identity_map = current_identity_map()
+	if identity_map is None:
+		return
+	for dn, attrs in results:
+		instance = identity_map.get(cls, dn)
+		if instance is not None:
+			instance._replace_value(self.my_attr, old_value, new_value)
+
+def replaced_value(value, old_value, new_value):
+	"""
+	Returns the given attribute value with the old value replaced by the new
+	one. The old value is removed if the new one is None.
+
+	value -- a single value, a list of values or an empty string
+	old_value -- the value which should be replaced
+	new_value -- the new value or None
+	"""
+	if not isinstance(value, list):
+		if value != old_value:
+			return value
+		if new_value is None:
+			return ''
+		return new_value
+	value = [ i for i in value if i != old_value ]
+	if new_value is not None and new_value not in value:
+		value.append(new_value)
+	return value
+
+def instance_dn(event, instance):
+	"""
+	Returns the normalized DN of the instance which sent an event. This is
+	the default key of a DeferredDelivery for instances, so the events of an
+	entry are delivered in order.
+
+	event -- the name of the event
+	instance -- the instance which sent the event
+	"""
+	return instance._ordering_key()
+
+def identity_map_saved(event, instance):
+	"""
+	This method is called after an instance was saved. It (re-)registers the
+	instance in the active identity map, since it might be new or renamed.
+
+	event -- the name of the event
+	instance -- the saved instance
+	"""
+	identity_map = current_identity_map()
+	if identity_map is not None and hasattr(instance, 'dn'):
+		identity_map.add(instance)
+
+def identity_map_deleted(event, instance):
+	"""
+	This method is called after an instance was deleted. It removes the
+	instance from the active identity map.
+
+	event -- the name of the event
+	instance -- the deleted instance
+	"""
+	identity_map = current_identity_map()
+	if identity_map is not None:
+		identity_map.remove(instance)
+
+def result_cache_invalidated(event, instance):
+	"""
+	This method is called after an instance was written. It clears the result
+	cache of the class, so the own writes are never served stale.
+
+	event -- the name of the event
+	instance -- the written instance
+	"""
+	if instance.result_cache is not None:
+		instance.result_cache.clear()
+
 class ForeignKey(RelationField):
 	"""
 	This class is used to specify a has-many relationship.
@@ -103,6 +351,7 @@ class ForeignKey(RelationField):
 		"""
 		foreign = self
 		singular_name = "_%s" % foreign_name
+		relation = '%s.%s' % (self.my_class.__name__, foreign_name)
 		def fetch_object(self):
 			""" 
 			this method fetches the single other FSK-Object and caches in an
@@ -113,6 +362,7 @@ class ForeignKey(RelationField):
 			if not hasattr(self, singular_name) or \
 				getattr(self, singular_name) is None:
 
+				relation_loaded(relation, sys._getframe(1))
 				my_id = getattr(self, foreign.my_attr)
 				elements = None
 				try:
@@ -132,6 +382,7 @@ class ForeignKey(RelationField):
 		cls = self.my_class
 		plural_name = "_%ss" % cls.__name__.lower()
 		foreign = self
+		relation = '%s.%s' % (self.other_class.__name__, plural_name[1:])
 		def fetch_objects(self):
 			""" 
 			this method fetches multiple other FSK-Objects and caches them 
@@ -142,6 +393,7 @@ class ForeignKey(RelationField):
 			if not hasattr(self, plural_name) or \
 				getattr(self, plural_name) is None:
 
+				relation_loaded(relation, sys._getframe(1))
 				setattr(self, plural_name, cls.find(
 					"(%s=%s)" % (
 						foreign.my_attr, 
@@ -163,15 +415,21 @@ class ForeignKey(RelationField):
 			lambda event, instance: referenced_object_renamed(self, instance)
 		)
 		self.my_class = cls
+		plural_name = cls.__name__.lower() + 's'
 
 		setattr(cls, foreign_name,
 				property(self._create_fetch_single_object(foreign_name))
 		)
 		setattr(
 			self.other_class,
-			cls.__name__.lower() + 's',
+			plural_name,
 			property(self._create_fetch_multiple_objects())
 		)
+		cls.relations[foreign_name] = self._create_prefetch_other_objects(
+			'_%s' % foreign_name, False
+		)
+		self.other_class.relations[plural_name] = \
+			self._create_prefetch_my_objects('_%s' % plural_name)
 
 class ManyToManyField(RelationField):
 	"""
@@ -186,6 +444,7 @@ class ManyToManyField(RelationField):
 		cls = self.my_class
 		other_name = "_%ss" % cls.__name__.lower()
 		foreign = self
+		relation = '%s.%s' % (self.other_class.__name__, other_name[1:])
 		def fetch_my_objects(self):
 			"""
 			This method fetches all objects of the class which has defined the
@@ -196,6 +455,7 @@ class ManyToManyField(RelationField):
 			if not hasattr(self, other_name) or \
 				getattr(self, other_name) is None:
 				
+				relation_loaded(relation, sys._getframe(1))
 				setattr(self, other_name, cls.find(
 					"(%s=%s)" % (
 						foreign.my_attr,			# e.g. deviceID
@@ -211,6 +471,7 @@ class ManyToManyField(RelationField):
 		"""
 		my_name = "_%s" % foreign_name
 		foreign = self
+		relation = '%s.%s' % (self.my_class.__name__, foreign_name)
 		def fetch_other_objects(self):
 			"""
 			This method fetches all objects of the class which has _not_ 
@@ -223,19 +484,18 @@ class ManyToManyField(RelationField):
 			if not hasattr(self, my_name) or \
 				getattr(self, my_name) is None:
 				
+				relation_loaded(relation, sys._getframe(1))
 				# Fetch the list of IDs
 				ids = getattr(self, foreign.my_attr)
 				if not isinstance(ids, list):
 					ids = [ ids ]
 					
-				# construct the filter expression...
-				# e.g. (phoneID=phone1)(phoneID=phone2)...
-				ids = ''.join([ 
-					"(%s=%s)" % (foreign.other_attr, i) for i in ids 
-				])
-				
-				setattr(self, my_name, foreign.other_class.find(
-					"(|%s)" % ids
+				# search them in chunks of OR-filters, e.g.
+				# (|(phoneID=phone1)(phoneID=phone2)...)
+				setattr(self, my_name, foreign.other_class._find_by_values(
+					foreign.other_attr,
+					ids,
+					foreign.chunk_size
 				))
 			return getattr(self, my_name)
 		return fetch_other_objects
@@ -272,6 +532,13 @@ class ManyToManyField(RelationField):
 			self.my_class.__name__.lower() + 's',       # eg. users
 			property(self._create_fetch_my_objects())	# eg. property
 		)
+		# register the prefetch functions for both sides...
+		plural_name = self.my_class.__name__.lower() + 's'
+		cls.relations[foreign_name] = self._create_prefetch_other_objects(
+			'_%s' % foreign_name, True
+		)
+		self.other_class.relations[plural_name] = \
+			self._create_prefetch_my_objects('_%s' % plural_name)
 
 
 class NullConnection(object):
@@ -304,6 +571,159 @@ class NullConnection(object):
 		Modifies the DN of an entry in the directory
 		"""
 		return []
+	def search_ext(self, *args, **kwds):
+		"""
+		Starts an asynchronous search and returns its message id
+		"""
+		return 0
+	def add_ext(self, *args, **kwds):
+		"""
+		Starts an asynchronous addition and returns its message id
+		"""
+		return 0
+	def modify_ext(self, *args, **kwds):
+		"""
+		Starts an asynchronous modification and returns its message id
+		"""
+		return 0
+	def delete_ext(self, *args, **kwds):
+		"""
+		Starts an asynchronous deletion and returns its message id
+		"""
+		return 0
+	def rename(self, *args, **kwds):
+		"""
+		Starts an asynchronous modification of a DN and returns its message id
+		"""
+		return 0
+	def result3(self, msgid=ldap.RES_ANY, *args, **kwds):
+		"""
+		Returns the result of an asynchronous operation
+		"""
+		return ( ldap.RES_SEARCH_RESULT, [], msgid, [] )
+
+unloaded = object()
+"""
+Marks the values of a lazily loaded instance which weren't decoded yet.
+"""
+
+def decode_value(values):
+	"""
+	Returns the value of an attribute of a search result like it is stored on
+	an instance: single values are unpacked, multiple values are copied and
+	missing attributes are empty strings.
+
+	values -- the values of the search result or None
+	"""
+	if values is None:
+		return ''
+	if isinstance(values, list):
+		if len(values) == 1:
+			return values[0]
+		return list(values)
+	return values
+
+value_encoders = {
+	str: None,
+	unicode: lambda val: val.encode('utf-8'),
+	bool: lambda val: val and 'TRUE' or 'FALSE',
+	list: lambda val: [ encode_value(i) for i in val ],
+}
+"""
+Maps the classes of attribute values to the functions which encode them for
+LDAP. None means that values of the class are sent as they are.
+"""
+
+def encode_value(val):
+	"""
+	Encodes the given value for LDAP: unicode is encoded in utf-8, booleans
+	become 'TRUE' or 'FALSE' and the values of lists are encoded.
+
+	val -- the value which should be encoded
+	"""
+	try:
+		encoder = value_encoders[val.__class__]
+	except KeyError:
+		encoder = None
+		for cls, function in value_encoders.items():
+			if function is not None and isinstance(val, cls):
+				encoder = function
+	if encoder is None:
+		return val
+	return encoder(val)
+
+class Snapshot(dict):
+	"""
+	This dictionary contains the original values of a lazily loaded instance.
+	Values which weren't overwritten are decoded from the raw search result
+	on access, so the result doesn't have to be copied.
+	"""
+	__slots__ = ( 'raw', )
+
+	def __init__(self, raw):
+		"""
+		Constructor.
+
+		raw -- the attributes of the search result
+		"""
+		dict.__init__(self)
+		self.raw = raw
+
+	def __missing__(self, key):
+		return decode_value(self.raw.get(key))
+
+	def __getstate__(self):
+		return self.raw
+
+	def __setstate__(self, raw):
+		self.raw = raw
+
+class AttributeSlot(object):
+	"""
+	This descriptor stores the value of an attribute at a fixed index of the
+	_values list of an instance, so loaded entries don't need a dictionary
+	entry per attribute. Slots without an index hide attributes of a parent
+	class which the class doesn't declare.
+	"""
+	__slots__ = ( 'name', 'index' )
+
+	def __init__(self, name, index=None):
+		"""
+		Constructor.
+
+		name -- the LDAP-name of the attribute
+		index -- the index in the _values list, None if the class doesn't
+				 declare the attribute
+		"""
+		self.name = name
+		self.index = index
+
+	def __get__(self, instance, owner):
+		if instance is None:
+			return self
+		if self.index is None:
+			try:
+				return instance.__dict__[self.name]
+			except KeyError:
+				raise AttributeError(self.name)
+		value = instance._values[self.index]
+		if value is unloaded:
+			value = instance._values[self.index] = decode_value(
+				instance._raw.get(self.name)
+			)
+		return value
+
+	def __set__(self, instance, value):
+		if self.index is None:
+			instance.__dict__[self.name] = value
+		else:
+			instance._values[self.index] = value
+
+	def __delete__(self, instance):
+		if self.index is None:
+			del instance.__dict__[self.name]
+		else:
+			instance._values[self.index] = ''
 
 class LdapFetcher(Sendable):
 	"""
@@ -325,7 +745,19 @@ class LdapFetcher(Sendable):
 		if not hasattr(cls, 'connection'):
 			cls.connection = NullConnection()
 
+		# maps the relation names to the functions which prefetch them
+		cls.relations = dict(getattr(cls, 'relations', {}))
+		cls._create_attribute_slots()
+		cls._create_attribute_maps()
+		cls._create_hydrate()
+		cls._create_collect_attrs()
 		cls._create_has_many_list()
+		for event in ('after_save', 'after_update', 'after_create'):
+			cls.events.register(event, identity_map_saved)
+		cls.events.register('after_delete', identity_map_deleted)
+		for event in ('after_save', 'after_update', 'after_create',
+					  'after_delete'):
+			cls.events.register(event, result_cache_invalidated)
 		foreigns = filter(lambda key: isinstance(dct[key], RelationField), dct)
 		for foreign_name in foreigns:
 			dct[foreign_name].create_relation(
@@ -335,6 +767,123 @@ class LdapFetcher(Sendable):
 		if hasattr(cls, 'attributes') and isinstance(cls.attributes, dict):
 			cls._create_property_links()
 	
+	def _create_attribute_slots(cls):
+		"""
+		Creates an AttributeSlot for every declared attribute. The _slots
+		dictionary maps the interned attribute names to their indexes in the
+		_values list. Attributes whose names are already used on the class,
+		e.g. by a method, are stored in the __dict__ of the instances.
+		"""
+		slots = {}
+		unslotted = []
+		for name in cls._attrlist():
+			existing = getattr(cls, name, None)
+			if existing is not None and not isinstance(existing, AttributeSlot):
+				unslotted.append(name)
+				continue
+			name = intern(name)
+			slots[name] = len(slots)
+			setattr(cls, name, AttributeSlot(name, slots[name]))
+		for name in getattr(cls, '_slots', {}):
+			if name not in slots:
+				setattr(cls, name, AttributeSlot(name))
+		cls._slots = slots
+		cls._unslotted = tuple(unslotted)
+
+	def _create_attribute_maps(cls):
+		"""
+		Creates the maps of the class, which mustn't be changed afterwards:
+		_links maps the names of the property links to the LDAP-names,
+		_positions maps the names of slotted attributes and of their links to
+		the indexes in the _values list and _names contains every name which
+		may be passed to the constructor.
+		"""
+		links = {}
+		if isinstance(cls.attributes, dict):
+			links = dict([ ( j, i ) for i, j in cls.attributes.items() ])
+		positions = dict(cls._slots)
+		for link, key in links.items():
+			if key in cls._slots:
+				positions[link] = cls._slots[key]
+		cls._links = links
+		cls._positions = positions
+		cls._names = frozenset(list(cls.attributes) + links.keys())
+
+	def _create_hydrate(cls):
+		"""
+		Creates the _hydrate method, which assigns the attributes of a search
+		result or of the constructor to a new instance.
+		"""
+		positions = cls._positions
+		names = cls._names
+		unslotted = cls._unslotted
+		size = len(cls._slots)
+		def hydrate(self, attrs):
+			"""
+			Assigns the given attributes. Lists with a single value are
+			unpacked, unknown attributes are ignored.
+
+			attrs -- a dictionary of attributes
+			"""
+			values = self._values = [ '' ] * size
+			for key in unslotted:
+				setattr(self, key, '')
+			for key, val in attrs.iteritems():
+				if val.__class__ is list and len(val) == 1:
+					val = val[0]
+				index = positions.get(key)
+				if index is not None:
+					values[index] = val
+				elif key in names:
+					setattr(self, key, val)
+		cls._hydrate = hydrate
+
+	def _create_collect_attrs(cls):
+		"""
+		Creates the _collect_attrs and _remember_original methods, which read
+		the values by their indexes in the order of the attributes.
+		"""
+		keys = tuple([ ( i, cls._slots.get(i) ) for i in cls.attributes ])
+		def remember_original(self):
+			"""
+			Remembers the current values of all attributes in order to detect
+			changes on the next update.
+			"""
+			values = self._values
+			original = {}
+			for key, index in keys:
+				if index is None or values[index] is unloaded:
+					val = getattr(self, key)
+				else:
+					val = values[index]
+				if isinstance(val, list):
+					val = list(val)
+				original[key] = val
+			self._original = original
+		def collect_attrs(self):
+			"""
+			Returns the attributes in the form:
+			[ (ldap.MOD_REPLACE, key1, val1), (ldap.MOD_REPLACE, key2, val2),
+			... ]
+			"""
+			values = self._values
+			encode = self._encode_vals
+			attrs = []
+			for key, index in keys:
+				if index is None or values[index] is unloaded:
+					val = getattr(self, key)
+				else:
+					val = values[index]
+				attrs.append( ( ldap.MOD_REPLACE, key, encode(val) ) )
+			attrs.append( (
+				ldap.MOD_REPLACE,
+				'objectClass',
+				list(self.object_classes)
+			) )
+			return self.after_collect_attributes(attrs)
+		cls._collect_attrs = collect_attrs
+		cls._remember_original = remember_original
+
 	def _create_property_links(cls):
 		"""
 		Creates the property links for the given class
@@ -404,6 +953,23 @@ class Base(object):
 	"""
 	__metaclass__ = LdapFetcher
 
+	__slots__ = (
+		'__dict__', '__weakref__', '_values', '_raw', 'dn', '_original',
+		'_has_many_list',
+	)
+	"""
+	The values of the declared attributes are kept in the _values list, see
+	AttributeSlot. Everything else, e.g. the cached relations, is stored in
+	the __dict__ of the instance, which is only created when needed.
+	"""
+
+	lazy_attributes = False
+	"""
+	If true, loaded instances keep the raw search result and decode every
+	attribute on its first access, which is cheaper if only some attributes
+	of large entries are read. This can be overwritten by child-classes.
+	"""
+
 	object_classes = ('inetOrgUser', )
 	"""
 	Specifies the object-classes of the record type. This attribute should be
@@ -441,6 +1007,33 @@ class Base(object):
 	This should be overwritten by child-classes.
 	"""
 
+	page_size = 500
+	"""
+	Specifies how many entries iter_find and iter_find_all request per page
+	with the paged-results control. This can be overwritten by child-classes.
+	"""
+
+	filter_chunk_size = 100
+	"""
+	Specifies how many values are combined into one OR-filter when many
+	items are fetched by their values, e.g. by prefetch or ManyToManyFields.
+	Bigger lists are split into several searches. This can be overwritten by
+	child-classes.
+	"""
+
+	result_cache = None
+	"""
+	A ResultCache for the results of find, find_all and find_by_id. It is
+	cleared whenever an instance of the class is saved or deleted. None
+	disables the caching. This can be overwritten by child-classes.
+	"""
+
+	_loaded = None
+	"""
+	The names of the loaded attributes of a partially loaded item, None if
+	all attributes were loaded.
+	"""
+
 	def __init__(self, attrs=None, my_dn=None):
 		"""
 		Initializes the object with the global connection...
@@ -448,12 +1041,77 @@ class Base(object):
 		attrs = attrs or {}
 		if my_dn:
 			self.dn = my_dn
+			if self.lazy_attributes:
+				self._load_lazily(attrs)
+				return
+		self._hydrate(attrs)
+		if my_dn:
+			self._remember_original()
+
+	def __getstate__(self):
+		"""
+		Returns the state of the item for pickling: the __dict__ and the
+		slots which are set. Attributes which weren't decoded yet are decoded
+		first, since the unloaded marker doesn't survive pickling.
+		"""
+		slots = {}
+		for name in Base.__slots__:
+			if name not in ( '__dict__', '__weakref__' ) and \
+			   hasattr(self, name):
+				slots[name] = getattr(self, name)
+		if '_values' in slots:
+			values = slots['_values'] = list(self._values)
+			for name, index in self._slots.iteritems():
+				if values[index] is unloaded:
+					values[index] = decode_value(self._raw.get(name))
+		return ( self.__dict__, slots )
+
+	def __setstate__(self, state):
+		"""
+		Restores the state which was returned by __getstate__.
+
+		state -- a tuple of the __dict__ and the slots
+		"""
+		dct, slots = state
+		self.__dict__.update(dct)
+		for name, value in slots.iteritems():
+			setattr(self, name, value)
+
+	def _snapshot(self):
+		"""
+		Returns a copy of the item with its current DN and values. A
+		DeferredDelivery queues it instead of the item, which might be changed
+		before the event is delivered. Cached relations aren't copied.
+		"""
+		dct, slots = self.__getstate__()
+		dct = dict(dct)
 		for key in self.attributes:
-			setattr(self, key, '')
-		for key in attrs.keys():
-			val = self._get_val_from_dict(key, attrs)
-			self._set_key(key, val)
+			if key in dct:
+				dct[key] = copy.deepcopy(dct[key])
+		item = self.__class__.__new__(self.__class__)
+		item.__setstate__( ( dct, copy.deepcopy(slots) ) )
+		return item
+
+	def _ordering_key(self):
+		"""
+		Returns the normalized DN of the item, which orders its events in a
+		DeferredDelivery.
+		"""
+		return self._collect_dn().lower()
 	
+	def _load_lazily(self, attrs):
+		"""
+		Keeps the given search result, which is decoded on access and serves
+		as original values for detecting changes.
+
+		attrs -- the attributes of the search result
+		"""
+		self._values = [ unloaded ] * len(self._slots)
+		self._raw = attrs
+		for key in self._unslotted:
+			setattr(self, key, decode_value(attrs.get(key)))
+		self._original = Snapshot(attrs)
+
 	def _get_val_from_dict(self, key, dct):
 		"""
 		Returns the value of the key in the given dictionary
@@ -472,12 +1130,7 @@ class Base(object):
 		
 		key -- the name of the attribute.
 		"""
-		result = key in self.attributes
-		if result:
-			return result
-		if isinstance(self.attributes, dict):
-			return key in self.attributes.values()
-		return result
+		return key in self._names
 
 	def _set_key(self, key, val):
 		"""
@@ -502,6 +1155,16 @@ class Base(object):
 			* cert_path: the certificate for the server
 			* timeout: the amout of time which should be waited before raising
 					   an timeout-exception
+			* pool_size: if given, a ConnectionPool with up to pool_size bound
+						 connections is used instead of a single connection
+			* pool_idle_timeout: the number of seconds after which an unused
+								 pooled connection is closed
+			* pool_max_lifetime: the number of seconds after which a pooled
+								 connection is closed
+			* pool_timeout: the number of seconds to wait for a free pooled
+							connection
+			* instrumentation: an Instrumentation which receives every
+							   operation on the connection
 		"""
 		cls.config = config
 		try:
@@ -511,19 +1174,52 @@ class Base(object):
 					cls.config['timeout']
 				)
 			cls._init_ssl()
-			cls.connection = ldap.initialize(cls.config['uri'])
-
-			if 'bind_dn' in cls.config and 'bind_password' in cls.config:
-				cls.connection.simple_bind_s(
-					cls.config['bind_dn'],
-					cls.config['bind_password']
+			if 'pool_size' in cls.config:
+				connection = cls._init_pool()
+			else:
+				connection = cls._connect()
+			if cls.config.get('instrumentation') is not None:
+				connection = InstrumentedConnection(
+					connection,
+					cls.config['instrumentation']
 				)
+			cls.connection = connection
 			return cls.connection
 		except ldap.LDAPError, ldap.TIMEOUT:
 			import traceback
 			traceback.print_exc()
 			del cls.connection
 
+	@classmethod
+	def _connect(cls):
+		"""
+		Returns a new connection which is bound with the credentials of the
+		config.
+		"""
+		connection = ldap.initialize(cls.config['uri'])
+		if 'bind_dn' in cls.config and 'bind_password' in cls.config:
+			connection.simple_bind_s(
+				cls.config['bind_dn'],
+				cls.config['bind_password']
+			)
+		return connection
+
+	@classmethod
+	def _init_pool(cls):
+		"""
+		Returns a ConnectionPool for the config. One connection is opened
+		immediately, so a wrong config is reported right away.
+		"""
+		pool = ConnectionPool(
+			cls._connect,
+			size=cls.config['pool_size'],
+			idle_timeout=cls.config.get('pool_idle_timeout'),
+			max_lifetime=cls.config.get('pool_max_lifetime'),
+			checkout_timeout=cls.config.get('pool_timeout'),
+		)
+		pool.checkin(pool.checkout())
+		return pool
+
 	@classmethod
 	def _init_ssl(cls):
 		if not cls.config['uri'].startswith('ldaps'):
@@ -560,49 +1256,400 @@ class Base(object):
 			ldap.set_option(ldap.OPT_X_TLS_CACERTDIR, cert)
 
 	@classmethod
-	def find_by_id(cls, elem_id):
-		"""Finds the item by id"""
+	def find_by_id(cls, elem_id, only=None):
+		"""
+		Finds the item by id. Within an identity map an already loaded item
+		is returned without searching the directory.
+
+		elem_id -- the value of the dn_attribute
+		only -- the names of the attributes which should be loaded. If given
+				a partially loaded item is returned.
+		"""
+		attrlist = cls._attrlist(only)
+		identity_map = current_identity_map()
+		if identity_map is not None:
+			instance = identity_map.get_by_id(cls, elem_id)
+			if instance is not None and instance._is_loaded(attrlist):
+				return instance
+		results = cls._search_by_id(elem_id, attrlist)
+		if len(results) == 0:
+			return None
+		loaded = None if only is None else attrlist
+		return cls._from_result(results[0][0], results[0][1], loaded)
+
+	@classmethod
+	def find_by_ids(cls, ids):
+		"""
+		Finds the items with the given ids with a few chunked searches and
+		returns a dictionary which maps every id to its item, or to None if no
+		such item exists. Within an identity map already loaded items are
+		not searched again. Like the directory the ids are compared
+		case-insensitively, but the dictionary keeps the given ids as keys.
+
+		ids -- an iterable of values of the dn_attribute
+		"""
+		ids = list(ids)
+		found = dict.fromkeys(ids)
+		identity_map = current_identity_map()
+		if identity_map is not None:
+			for elem_id in ids:
+				found[elem_id] = identity_map.get_by_id(cls, elem_id)
+		missing = [ i for i in ids if found[i] is None ]
+		instances = {}
+		for instance in cls._find_by_values(cls.dn_attribute, missing):
+			elem_id = getattr(instance, cls.dn_attribute)
+			instances[normalize_id(elem_id)] = instance
+		for elem_id in missing:
+			found[elem_id] = instances.get(normalize_id(elem_id))
+		return found
+
+	@classmethod
+	def _load_by_id(cls, elem_id):
+		"""
+		Loads the item by id from the directory, bypassing the identity map.
+		"""
+		results = cls._search_by_id(elem_id)
+		if len(results) == 0:
+			return None
+		return cls(results[0][1], results[0][0])
+
+	@classmethod
+	def _search_by_id(cls, elem_id, attrlist=None):
+		"""
+		Searches the entries with the given id and returns the raw results.
+		"""
 		filter_expression = "(&%s(%s=%s))" % (
 			cls._classes_string(),
 			cls.dn_attribute,
 			elem_id
 		)
-		results = cls.connection.search_s(
-			cls.prefix,
-			cls.scope,
-			filter_expression
-		)
-		if len(results) == 0:
-			return None
-		return cls(results[0][1], results[0][0])
+		return cls._search(filter_expression, attrlist)
 
 	@classmethod
-	def find_all(cls):
+	def find_all(cls, prefetch=(), only=None):
 		"""
 		Finds all items
+
+		prefetch -- the names of relations which should be loaded for all
+					items at once, e.g. ('device', )
+		only -- the names of the attributes which should be loaded. If given
+				partially loaded items are returned.
 		"""
-		results = cls.connection.search_s(
-			cls.prefix,
-			cls.scope,
-			'(&%s)' % cls._classes_string()
-		)
-		return map(lambda (id, attrs): cls(attrs, id), results)
+		return cls.find('', prefetch, only)
 	
 	@classmethod
-	def find(cls, filter_expression):
-		"""Finds all which matches the given LDAP-filter"""
-		results = cls.connection.search_s(
-			cls.prefix,
-			cls.scope,
-			'(&%s%s)' % (cls._classes_string(), filter_expression)
+	def find(cls, filter_expression, prefetch=(), only=None):
+		"""
+		Finds all which matches the given LDAP-filter
+
+		filter_expression -- the LDAP-filter
+		prefetch -- the names of relations which should be loaded for all
+					items at once, e.g. ('device', )
+		only -- the names of the attributes which should be loaded. If given
+				partially loaded items are returned, e.g. ('uid', 'cn')
+		"""
+		attrlist = cls._attrlist(only)
+		loaded = None if only is None else attrlist
+		results = cls._search(
+			'(&%s%s)' % (cls._classes_string(), filter_expression),
+			attrlist
+		)
+		instances = map(
+			lambda (id, attrs): cls._from_result(id, attrs, loaded),
+			results
+		)
+		return cls.prefetch(instances, prefetch)
+
+	@classmethod
+	def prefetch(cls, instances, names):
+		"""
+		Loads the given relations of all instances with one search per
+		relation instead of one search per instance and returns the instances.
+
+		instances -- a list of instances of the class
+		names -- the names of the relations, e.g. ('device', 'users')
+		"""
+		for name in names:
+			if name not in cls.relations:
+				raise AttributeError(
+					"%s has no relation %s" % (cls.__name__, name)
+				)
+			if instances:
+				cls.relations[name](instances)
+		return instances
+
+	@classmethod
+	def _find_by_values(cls, attr, values, chunk_size=None):
+		"""
+		Finds all items whose attribute has one of the given values. The
+		values are split into chunks of OR-filters, which are searched at once
+		if the connection supports asynchronous searches. Items matching more
+		than one chunk are returned only once.
+
+		attr -- the name of the attribute
+		values -- a list of values
+		chunk_size -- the number of values per OR-filter, defaults to
+					  filter_chunk_size
+		"""
+		values = sorted(set(values) - set([ '' ]))
+		chunk_size = chunk_size or cls.filter_chunk_size
+		filter_expressions = [
+			'(&%s(|%s))' % (cls._classes_string(), ''.join([
+				'(%s=%s)' % (attr, i) for i in values[start:start + chunk_size]
+			]))
+			for start in range(0, len(values), chunk_size)
+		]
+		instances = []
+		found = set()
+		for results in cls._search_many(filter_expressions):
+			for dn, attrs in results:
+				if dn in found:
+					continue
+				found.add(dn)
+				instances.append(cls._from_result(dn, attrs))
+		return instances
+
+	@classmethod
+	def _search(cls, filter_expression, attrlist=None):
+		"""
+		Searches the directory below the prefix of the class and returns the
+		raw results. If the class has a result_cache the results are cached
+		by prefix, scope, filter and attribute list.
+
+		filter_expression -- the complete LDAP-filter
+		attrlist -- the attributes which should be returned, defaults to the
+					declared attributes of the class
+		"""
+		attrlist = attrlist or cls._attrlist()
+		cache = cls.result_cache
+		if cache is None:
+			return cls.connection.search_s(
+				cls.prefix,
+				cls.scope,
+				filter_expression,
+				attrlist
+			)
+		key = ( cls.prefix, cls.scope, filter_expression, tuple(attrlist) )
+		results = cache.get(key)
+		if results is None:
+			results = cls.connection.search_s(
+				cls.prefix,
+				cls.scope,
+				filter_expression,
+				attrlist
+			)
+			cache.put(key, results)
+		return cls._copy_results(results)
+
+	@classmethod
+	def _search_many(cls, filter_expressions, attrlist=None):
+		"""
+		Runs several searches below the prefix of the class and returns a list
+		with the raw results of every search. If the connection supports
+		asynchronous searches all searches are sent before the first result is
+		read, so the server can work on them concurrently. If a search fails
+		the results of the outstanding searches are collected before the error
+		is raised, so a pooled connection is not kept pinned.
+
+		filter_expressions -- a list of complete LDAP-filters
+		attrlist -- the attributes which should be returned, defaults to the
+					declared attributes of the class
+		"""
+		if len(filter_expressions) < 2 or \
+		   not hasattr(cls.connection, 'search_ext'):
+			return [ cls._search(i, attrlist) for i in filter_expressions ]
+		attrlist = attrlist or cls._attrlist()
+		cache = cls.result_cache
+		results = [ None ] * len(filter_expressions)
+		pending = []
+		with reserved(cls.connection) as connection:
+			try:
+				for index, filter_expression in enumerate(filter_expressions):
+					key = (
+						cls.prefix,
+						cls.scope,
+						filter_expression,
+						tuple(attrlist)
+					)
+					if cache is not None:
+						results[index] = cache.get(key)
+					if results[index] is None:
+						pending.append( ( index, key, connection.search_ext(
+							cls.prefix,
+							cls.scope,
+							filter_expression,
+							attrlist
+						) ) )
+				while pending:
+					index, key, msgid = pending.pop(0)
+					results[index] = connection.result3(msgid)[1]
+					if cache is not None:
+						cache.put(key, results[index])
+			finally:
+				for index, key, msgid in pending:
+					try:
+						connection.result3(msgid)
+					except ldap.LDAPError:
+						pass
+		if cache is None:
+			return results
+		return [ cls._copy_results(i) for i in results ]
+
+	@classmethod
+	def _copy_results(cls, results):
+		"""
+		Returns a copy of the given search results, so changes on the
+		instances don't alter cached results.
+
+		results -- a list of (dn, attrs) tuples
+		"""
+		return [
+			( dn, dict([ ( key, list(val) ) for key, val in attrs.items() ]) )
+			for dn, attrs in results
+		]
+
+	@classmethod
+	def _from_result(cls, dn, attrs, loaded=None):
+		"""
+		Returns the instance for the given search result. Within an identity
+		map the already loaded instance for the DN is returned. If it was
+		only partially loaded the missing attributes are added.
+
+		dn -- the distinguished name of the entry
+		attrs -- the attributes of the entry
+		loaded -- the names of the loaded attributes if the search didn't
+				  return all declared attributes
+		"""
+		identity_map = current_identity_map()
+		instance = None
+		if identity_map is not None:
+			instance = identity_map.get(cls, dn)
+		if instance is not None:
+			instance._complete(attrs, loaded)
+			return instance
+		instance = cls(attrs, dn)
+		if loaded is not None:
+			instance._loaded = frozenset(loaded)
+		if identity_map is not None:
+			identity_map.add(instance)
+		return instance
+
+	@classmethod
+	def _attrlist(cls, only=None):
+		"""
+		Returns the LDAP-names of the attributes which should be fetched:
+		either all declared attributes or only the given ones together with
+		the dn_attribute.
+
+		only -- a list of attribute names or names of property links, None
+				for all attributes
+		"""
+		if only is None:
+			if isinstance(cls.attributes, dict):
+				return sorted(cls.attributes)
+			return list(cls.attributes)
+		attrlist = [ cls.dn_attribute ]
+		for name in only:
+			name = cls._ldap_name(name)
+			if name not in attrlist:
+				attrlist.append(name)
+		return attrlist
+
+	@classmethod
+	def _ldap_name(cls, name):
+		"""
+		Returns the LDAP-name of the given attribute or property link.
+
+		name -- the name of the attribute or the property link
+		"""
+		if name in cls.attributes:
+			return name
+		if name in cls._links:
+			return cls._links[name]
+		raise AttributeError("%s has no attribute %s" % (cls.__name__, name))
+
+	@classmethod
+	def iter_find_all(cls, page_size=None, only=None):
+		"""
+		Finds all items page by page and yields them one after another.
+
+		page_size -- the number of entries per page, defaults to page_size
+		only -- the names of the attributes which should be loaded
+		"""
+		return cls.iter_find('', page_size, only)
+
+	@classmethod
+	def iter_find(cls, filter_expression, page_size=None, only=None):
+		"""
+		Finds all items which match the given LDAP-filter page by page and
+		yields them one after another.
+
+		filter_expression -- the LDAP-filter
+		page_size -- the number of entries per page, defaults to page_size
+		only -- the names of the attributes which should be loaded
+		"""
+		attrlist = cls._attrlist(only)
+		loaded = None if only is None else attrlist
+		for dn, attrs in cls._iter_search(
+			'(&%s%s)' % (cls._classes_string(), filter_expression),
+			page_size,
+			attrlist
+		):
+			yield cls._from_result(dn, attrs, loaded)
+
+	@classmethod
+	def _iter_search(cls, filter_expression, page_size=None, attrlist=None):
+		"""
+		Searches the directory with the simple paged results control
+		(RFC 2696) and yields the (dn, attrs) tuples of every page. Only one
+		page is held in memory at a time. A pooled connection stays reserved
+		until the last page was fetched, since the cookie is only valid on the
+		connection which returned it.
+
+		filter_expression -- the complete LDAP-filter
+		page_size -- the number of entries per page
+		attrlist -- the attributes which should be returned, defaults to the
+					declared attributes of the class
+		"""
+		control = SimplePagedResultsControl(
+			True,
+			size=page_size or cls.page_size,
+			cookie=''
 		)
-		return map(lambda (id, attrs): cls(attrs, id), results)
+		with reserved(cls.connection) as connection:
+			while True:
+				msgid = connection.search_ext(
+					cls.prefix,
+					cls.scope,
+					filter_expression,
+					attrlist or cls._attrlist(),
+					serverctrls=[ control ]
+				)
+				rtype, results, rmsgid, controls = connection.result3(msgid)
+				for result in results:
+					yield result
+				control.cookie = cls._paged_cookie(controls)
+				if not control.cookie:
+					return
+
+	@classmethod
+	def _paged_cookie(cls, controls):
+		"""
+		Returns the cookie of the paged results control in the given response
+		controls or an empty string if there are no more pages.
+
+		controls -- the response controls of a search operation
+		"""
+		for control in controls or []:
+			if control.controlType == SimplePagedResultsControl.controlType:
+				return control.cookie
+		return ''
 
 	def has_dn_changed(self):
 		"""
 		Returns true if the DN-attribute of the object has changed.
 		"""
-		if self.dn == None:
+		if getattr(self, 'dn', None) == None:
 			return True
 		return self._value_from_full_dn() != getattr(self, self.dn_attribute)
 
@@ -620,40 +1667,51 @@ class Base(object):
 	# ---- creation methods -----
 	@send_event
 	def save(self):
-		""" Saves (creates or updates) the item """
+		"""
+		Saves (creates or updates) the item. Items with a DN are updated, all
+		others are created. If the entry already exists in the directory it is
+		updated instead.
+		"""
 		try:
-			if hasattr(self, 'dn') or \
-			   self.find_by_id(getattr(self, self.dn_attribute)) != None:
-
+			if hasattr(self, 'dn'):
 				self.update()
 			else:
-				self.create()
+				self._create_or_update()
 		except ldap.LDAPError, error:
 			print error
 			return False
 		return True
+
+	def _create_or_update(self):
+		"""
+		Creates the item and falls back to an update if the entry already
+		exists. Afterwards the item has a DN, so it is updated when it is saved
+		again.
+		"""
+		try:
+			self.create()
+		except ldap.ALREADY_EXISTS:
+			self.dn = self._collect_dn()
+			self.update()
 	
 	@send_event
 	def update(self):
 		""" Updates the item in the directory """
-		# Modify the DN via modrdn!
-		if hasattr(self, 'dn'):
-			new_attr = getattr(self, self.dn_attribute)
-			self.connection.modrdn_s(self.dn, '%s=%s' % (
-				self.dn_attribute, new_attr
-			), True)
-			# Set the DN-Attribute to the new value!
-			self.dn = re.sub(r'^%s=.*?,' % self.dn_attribute, '%s=%s,' % (
-				self.dn_attribute, new_attr
-			), self.dn)
-		self.connection.modify_s(self._collect_dn(), self._collect_attrs())
+		# Modify the DN via modrdn, but only if the RDN has really changed
+		if hasattr(self, 'dn') and self.has_dn_changed():
+			self.connection.modrdn_s(self.dn, self._new_rdn(), True)
+			self._renamed()
+		attrs = self._collect_changed_attrs()
+		if attrs:
+			self.connection.modify_s(self._collect_dn(), attrs)
+		self._remember_original()
 
 	@send_event
 	def create(self):
 		""" Creates the item in the directory """
-		attrs = self._collect_attrs()
-		attrs = [ ( i[1], i[2] ) for i in attrs ]
-		self.connection.add_s(self._collect_dn(), attrs)
+		my_dn = self._collect_dn()
+		self.connection.add_s(my_dn, self._collect_new_attrs())
+		self._created(my_dn)
 
 	@send_event
 	def delete(self):
@@ -672,11 +1730,64 @@ class Base(object):
 		""" Deletes an entry by it's ID """
 		try:
 			cls.connection.delete_s(cls._construct_dn(my_dn))
+			if cls.result_cache is not None:
+				cls.result_cache.clear()
+			identity_map = current_identity_map()
+			if identity_map is not None:
+				identity_map.remove_by_id(cls, my_dn)
 			return True
 		except ldap.LDAPError:
 			return False
 
 	# ------ helper methods ------
+	def _new_rdn(self):
+		"""
+		Returns the RDN of the item built from the current value of the
+		dn_attribute.
+		"""
+		return '%s=%s' % (self.dn_attribute, getattr(self, self.dn_attribute))
+
+	def _renamed_dn(self):
+		"""
+		Returns the DN of the item after its RDN was changed to the current
+		value of the dn_attribute.
+		"""
+		return re.sub(
+			r'^%s=.*?,' % self.dn_attribute, '%s,' % self._new_rdn(), self.dn
+		)
+
+	def _renamed(self):
+		"""
+		Is called after the RDN of the item was changed in the directory.
+		"""
+		# Set the DN-Attribute to the new value!
+		self.dn = self._renamed_dn()
+		# modrdn already replaced the old value of the RDN-attribute
+		if hasattr(self, '_original'):
+			self._original[self.dn_attribute] = getattr(
+				self, self.dn_attribute
+			)
+
+	def _collect_new_attrs(self):
+		"""
+		Returns the attributes for creating the item. Raises a
+		PartialInstanceError if the item was only partially loaded.
+		"""
+		if self._loaded is not None:
+			raise PartialInstanceError(
+				"%s was only partially loaded and can't be created" % self
+			)
+		return [ ( i[1], i[2] ) for i in self._collect_attrs() ]
+
+	def _created(self, my_dn):
+		"""
+		Is called after the item was added to the directory.
+
+		my_dn -- the DN of the new entry
+		"""
+		self.dn = my_dn
+		self._remember_original()
+
 	@classmethod
 	def _classes_string(cls):
 		"""Returns the object_classes as string"""
@@ -705,14 +1816,19 @@ class Base(object):
 		
 		val -- the value which should be encoded
 		"""
-		if isinstance(val, unicode):
-			return val.encode('utf-8')
-		if isinstance(val, bool):
-			trans_table = { True: 'TRUE', False: 'FALSE' }
-			return trans_table[val]
+		return encode_value(val)
+
+	def _encode_vals(self, val):
+		"""
+		Encodes the value of an attribute for LDAP. The values of lists are
+		encoded one by one, so overwriting _encode_val also applies to
+		attributes with multiple values.
+
+		val -- a single value or a list of values
+		"""
 		if isinstance(val, list):
 			return [ self._encode_val(i) for i in val ]
-		return val
+		return self._encode_val(val)
 	
 	def _encoded_attr(self, key):
 		"""
@@ -721,27 +1837,144 @@ class Base(object):
 		key -- the key (the name) of the attribute which should be encoded
 		"""
 		attr = getattr(self, key)
-		return self._encode_val(attr)
+		return self._encode_vals(attr)
 
-	def _collect_attrs(self):
+	def _collect_changed_attrs(self):
 		"""
-		Returns the attributes in the form:
-		[ (ldap.MOD_REPLACE, key1, val1), (ldap.MOD_REPLACE, key2, val2), ... ]
+		Returns only the modifications of the attributes which were changed
+		since the item was loaded or saved. Single values are replaced,
+		multiple values are updated with MOD_DELETE and MOD_ADD. If the
+		original values are unknown all attributes are returned. Raises a
+		PartialInstanceError if an attribute was changed which wasn't loaded.
 		"""
+		if not hasattr(self, '_original'):
+			return self._collect_attrs()
 		attrs = []
 		for key in self.attributes:
-			attrs.append( (
-				ldap.MOD_REPLACE,
+			changes = self._collect_changes(
 				key,
-				self._encoded_attr(key)
-			) )
-		attrs.append( (
-			ldap.MOD_REPLACE,
-			'objectClass',
-			list(self.object_classes)
-		) )
+				self._original[key],
+				getattr(self, key)
+			)
+			if changes and not self._is_loaded([ key ]):
+				raise PartialInstanceError(
+					"%s wasn't loaded and can't be saved" % key
+				)
+			attrs += changes
 		return self.after_collect_attributes(attrs)
 
+	def _collect_changes(self, key, old, new):
+		"""
+		Returns the modifications which turn the old value of the given
+		attribute into the new one.
+
+		key -- the name of the attribute
+		old -- the original value
+		new -- the current value
+		"""
+		if old == new:
+			return []
+		if not isinstance(old, list) and not isinstance(new, list):
+			return [ ( ldap.MOD_REPLACE, key, self._encode_val(new) ) ]
+		old = self._encode_vals(self._as_list(old))
+		new = self._encode_vals(self._as_list(new))
+		old_values = set(old)
+		new_values = set(new)
+		changes = []
+		removed = [ i for i in old if i not in new_values ]
+		if removed:
+			changes.append( ( ldap.MOD_DELETE, key, removed ) )
+		added = [ i for i in new if i not in old_values ]
+		if added:
+			changes.append( ( ldap.MOD_ADD, key, added ) )
+		return changes
+
+	def _as_list(self, val):
+		"""
+		Returns the given attribute value as list of values.
+
+		val -- a single value, a list of values or an empty string
+		"""
+		if isinstance(val, list):
+			return val
+		if val == '' or val is None:
+			return []
+		return [ val ]
+
+	def _replace_value(self, key, old_value, new_value):
+		"""
+		Replaces a value of the given attribute which was already changed in
+		the directory, in the current and in the original values.
+
+		key -- the name of the attribute
+		old_value -- the value which was replaced
+		new_value -- the new value or None if it was removed
+		"""
+		setattr(self, key, replaced_value(
+			getattr(self, key), old_value, new_value
+		))
+		if hasattr(self, '_original'):
+			self._original[key] = replaced_value(
+				self._original[key], old_value, new_value
+			)
+
+	def _original_value(self, key):
+		"""
+		Returns the value of the given attribute when the item was loaded or
+		saved. The value of the dn_attribute is taken from the DN. Items
+		without original values are loaded from the directory.
+
+		key -- the name of the attribute
+		"""
+		if key == self.dn_attribute:
+			return self._value_from_full_dn()
+		if hasattr(self, '_original'):
+			return self._original[key]
+		return getattr(self._load_by_id(self._value_from_full_dn()), key)
+
+	def _is_loaded(self, attrlist):
+		"""
+		Returns true if all the given attributes were loaded.
+
+		attrlist -- a list of LDAP-names of attributes
+		"""
+		if self._loaded is None:
+			return True
+		return self._loaded.issuperset(attrlist)
+
+	def _complete(self, attrs, loaded=None):
+		"""
+		Adds the attributes of a later search result which weren't loaded
+		yet to a partially loaded item. Loaded attributes are kept, as they
+		might have been changed in the meantime.
+
+		attrs -- the attributes of the search result
+		loaded -- the names of the attributes in the search result, None if
+				  all attributes were fetched
+		"""
+		if self._loaded is None:
+			return
+		if loaded is None:
+			keys = self.attributes
+		else:
+			keys = loaded
+		for key in keys:
+			if key in self._loaded:
+				continue
+			if key in attrs:
+				val = self._get_val_from_dict(key, attrs)
+			else:
+				val = ''
+			setattr(self, key, val)
+			if isinstance(val, list):
+				self._original[key] = list(val)
+			else:
+				self._original[key] = val
+		if loaded is None:
+			self._loaded = None
+		else:
+			self._loaded = self._loaded.union(loaded)
+
 	def after_collect_attributes(self, attrs):
 		"""
 		Overwrite this method in order to manipulate the attributes after
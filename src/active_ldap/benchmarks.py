@@ -0,0 +1,435 @@
+"""
+This module benchmarks the hot paths of ActiveLdap against synthetic
+directories in the LdapStubber. Every benchmark records the number of
+operations per second and the peak memory. The results are written as JSON,
+so the numbers of two commits can be compared:
+
+	python benchmarks.py --sizes 1000,10000 --output new.json
+	python benchmarks.py --compare old.json new.json
+
+The peak memory of every benchmark is measured with tracemalloc. If it is
+not importable (or --no-memory is given) the peak memory is recorded as
+null, because the resident set size of the process only grows over all
+benchmarks and sizes and can't be attributed to a single one.
+"""
+import sys
+import json
+import time
+import random
+import optparse
+from timeit import default_timer
+from active_ldap import Base, ForeignKey, ManyToManyField
+from signals.signals import send_event
+from ldap_stubber.ldap_stubber import LdapStubber
+import ldap
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+default_sizes = ( 1000, 10000, 100000, 1000000 )
+"""
+The numbers of entries of the synthetic directories.
+"""
+
+sample_size = 1000
+"""
+The maximal number of single operations per benchmark, e.g. find_by_id
+calls.
+"""
+
+class BenchSwitch(Base):
+	object_classes = ( 'benchSwitch', )
+	attributes = (
+		'switchID',
+		'location',
+	)
+	dn_attribute = 'switchID'
+	prefix = 'ou=switches,o=bench'
+	scope = ldap.SCOPE_ONELEVEL
+
+	@send_event
+	def touch(self):
+		"""
+		Does nothing but sending the events before_touch and after_touch.
+		"""
+
+	def after_touch(self):
+		"""
+		Receives the event after_touch.
+		"""
+
+class BenchDevice(Base):
+	object_classes = ( 'benchDevice', )
+	attributes = (
+		'deviceID',
+		'switchID',
+		'mac',
+	)
+	dn_attribute = 'deviceID'
+	prefix = 'ou=devices,o=bench'
+	scope = ldap.SCOPE_ONELEVEL
+	switch = ForeignKey(BenchSwitch, my_attr='switchID', other_attr='switchID')
+
+class BenchUser(Base):
+	object_classes = ( 'benchUser', 'person' )
+	attributes = (
+		'userID',
+		'deviceID',
+		'name',
+		'mail',
+	)
+	dn_attribute = 'userID'
+	prefix = 'ou=users,o=bench'
+	scope = ldap.SCOPE_ONELEVEL
+	devices = ManyToManyField(
+		BenchDevice,
+		my_attr='deviceID',
+		other_attr='deviceID'
+	)
+
+	@send_event
+	def touch(self):
+		"""
+		Does nothing but sending the events before_touch and after_touch,
+		which nobody receives.
+		"""
+
+models = ( BenchSwitch, BenchDevice, BenchUser )
+
+indexes = ( 'objectClass', 'switchID', 'deviceID', 'userID' )
+"""
+The attributes which are indexed in the stubber, like a real directory
+would do it.
+"""
+
+def populate(size, indexed=True):
+	"""
+	Creates a stubber with a synthetic directory of the given number of
+	entries: a hundredth are switches, a third are devices and the rest are
+	users with two devices each. The models are connected to it.
+
+	size -- the number of entries
+	indexed -- False if the stubber shouldn't use attribute indexes
+	"""
+	stubber = LdapStubber(indexed and indexes or ())
+	switches = max(1, size // 100)
+	devices = max(1, size // 3)
+	users = max(1, size - switches - devices)
+	for i in xrange(switches):
+		stubber.add_s('switchID=sw%d,ou=switches,o=bench' % i, [
+			( 'objectClass', [ 'benchSwitch' ] ),
+			( 'switchID', [ 'sw%d' % i ] ),
+			( 'location', [ 'room %d' % i ] ),
+		])
+	for i in xrange(devices):
+		stubber.add_s('deviceID=dev%d,ou=devices,o=bench' % i, [
+			( 'objectClass', [ 'benchDevice' ] ),
+			( 'deviceID', [ 'dev%d' % i ] ),
+			( 'switchID', [ 'sw%d' % (i % switches) ] ),
+			( 'mac', [ '00:00:00:00:%02x:%02x' % (i >> 8 & 0xff, i & 0xff) ] ),
+		])
+	for i in xrange(users):
+		stubber.add_s('userID=user%d,ou=users,o=bench' % i, [
+			( 'objectClass', [ 'benchUser', 'person' ] ),
+			( 'userID', [ 'user%d' % i ] ),
+			( 'deviceID', [
+				'dev%d' % (i % devices), 'dev%d' % ((i + 1) % devices)
+			] ),
+			( 'name', [ 'User %d' % i ] ),
+			( 'mail', [ 'user%d@example.com' % i ] ),
+		])
+	for model in models:
+		model.connection = stubber
+	return dict(switches=switches, devices=devices, users=users)
+
+def sample(prefix, count):
+	"""
+	Returns up to sample_size random IDs with the given prefix.
+
+	prefix -- the prefix of the IDs, e.g. 'user'
+	count -- the number of existing IDs
+	"""
+	random.seed(count)
+	return [
+		'%s%d' % (prefix, random.randrange(count))
+		for i in xrange(min(sample_size, count))
+	]
+
+def bench_find_all(counts):
+	"""
+	Loads all users at once.
+	"""
+	BenchUser.find_all()
+	return 1
+
+def bench_find_by_id(counts):
+	"""
+	Loads single users by their IDs.
+	"""
+	ids = sample('user', counts['users'])
+	for i in ids:
+		BenchUser.find_by_id(i)
+	return len(ids)
+
+def bench_find_compound(counts):
+	"""
+	Searches the users with a filter which can't use an index.
+	"""
+	BenchUser.find('(&(name=User 1*)(!(mail=user1@example.com)))')
+	return 1
+
+def bench_foreign_key(counts):
+	"""
+	Follows the ForeignKey from devices to their switches.
+	"""
+	devices = [ BenchDevice.find_by_id(i) for i in sample(
+		'dev', counts['devices']
+	) ]
+	start = default_timer()
+	for device in devices:
+		device.switch
+	return len(devices), default_timer() - start
+
+def bench_reverse_foreign_key(counts):
+	"""
+	Follows the ForeignKey from switches back to their devices.
+	"""
+	switches = BenchSwitch.find_all()[:sample_size]
+	start = default_timer()
+	for switch in switches:
+		switch.benchdevices
+	return len(switches), default_timer() - start
+
+def bench_many_to_many(counts):
+	"""
+	Follows the ManyToManyField from users to their devices.
+	"""
+	users = [ BenchUser.find_by_id(i) for i in sample('user', counts['users']) ]
+	start = default_timer()
+	for user in users:
+		user.devices
+	return len(users), default_timer() - start
+
+def bench_create(counts):
+	"""
+	Creates new users with save().
+	"""
+	number = min(sample_size, counts['users'])
+	for i in xrange(number):
+		BenchUser({
+			'userID': 'new%d' % i,
+			'deviceID': [ 'dev0' ],
+			'name': 'New %d' % i,
+			'mail': 'new%d@example.com' % i,
+		}).save()
+	return number
+
+def bench_update(counts):
+	"""
+	Changes the mail of loaded users and saves them.
+	"""
+	users = [ BenchUser.find_by_id(i) for i in sample('user', counts['users']) ]
+	start = default_timer()
+	for user in users:
+		user.mail = 'changed-' + user.mail
+		user.save()
+	return len(users), default_timer() - start
+
+def bench_cascading_delete(counts):
+	"""
+	Deletes devices, which removes them from all their users.
+	"""
+	devices = BenchDevice.find('(switchID=sw0)')[:sample_size]
+	start = default_timer()
+	for device in devices:
+		device.delete()
+	return len(devices), default_timer() - start
+
+def bench_signals(counts):
+	"""
+	Sends the events of a decorated method without any receiver and with a
+	method receiving one of them.
+	"""
+	number = sample_size * 10
+	user = BenchUser({ 'userID': 'signals' })
+	switch = BenchSwitch({ 'switchID': 'signals' })
+	for i in xrange(number):
+		user.touch()
+		switch.touch()
+	return number * 2
+
+benchmarks = [
+	( 'find_all', bench_find_all ),
+	( 'find_by_id', bench_find_by_id ),
+	( 'find_compound', bench_find_compound ),
+	( 'foreign_key', bench_foreign_key ),
+	( 'reverse_foreign_key', bench_reverse_foreign_key ),
+	( 'many_to_many', bench_many_to_many ),
+	( 'save_create', bench_create ),
+	( 'save_update', bench_update ),
+	( 'cascading_delete', bench_cascading_delete ),
+	( 'signals', bench_signals ),
+]
+"""
+The benchmarks in the order of execution. Every function gets the numbers
+of generated entries and returns the number of operations. Benchmarks which
+need preparation return the number of operations and the measured seconds.
+"""
+
+def measure(function, counts, trace_memory=True):
+	"""
+	Runs the given benchmark and returns its result.
+
+	function -- the benchmark function
+	counts -- the numbers of generated entries
+	trace_memory -- False if tracemalloc shouldn't be used
+	"""
+	tracing = trace_memory and tracemalloc is not None
+	if tracing:
+		tracemalloc.start()
+	start = default_timer()
+	result = function(counts)
+	seconds = default_timer() - start
+	if isinstance(result, tuple):
+		result, seconds = result
+	peak = None
+	if tracing:
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+	return {
+		'ops': result,
+		'seconds': seconds,
+		'ops_per_sec': seconds and result / seconds or None,
+		'peak_memory_bytes': peak,
+	}
+
+def run(sizes=default_sizes, names=None, trace_memory=True, indexed=True,
+		report=None):
+	"""
+	Runs the benchmarks for all sizes and returns the results.
+
+	sizes -- the numbers of entries of the synthetic directories
+	names -- the names of the benchmarks which should run, None for all
+	trace_memory -- False if tracemalloc shouldn't be used
+	indexed -- False if the stubber shouldn't use attribute indexes
+	report -- a callable which is called with every single result
+	"""
+	results = []
+	for size in sizes:
+		start = default_timer()
+		counts = populate(size, indexed)
+		populate_seconds = default_timer() - start
+		for name, function in benchmarks:
+			if names is not None and name not in names:
+				continue
+			result = measure(function, counts, trace_memory)
+			result.update(size=size, benchmark=name)
+			result['populate_seconds'] = populate_seconds
+			results.append(result)
+			if report is not None:
+				report(result)
+	return {
+		'python': sys.version.split()[0],
+		'timestamp': time.time(),
+		'memory': tracemalloc and trace_memory and 'tracemalloc' or None,
+		'indexed': indexed,
+		'results': results,
+	}
+
+def compare(old, new):
+	"""
+	Returns the lines of a comparison of two benchmark runs. The ratio is
+	the new number of operations per second divided by the old one.
+
+	old -- the results of the old run
+	new -- the results of the new run
+	"""
+	previous = dict([
+		( ( i['size'], i['benchmark'] ), i ) for i in old['results']
+	])
+	lines = []
+	for result in new['results']:
+		key = ( result['size'], result['benchmark'] )
+		if key not in previous or not previous[key]['ops_per_sec']:
+			continue
+		lines.append('%8d %-20s %10.1f ops/s %6.2fx' % (
+			result['size'],
+			result['benchmark'],
+			result['ops_per_sec'] or 0,
+			(result['ops_per_sec'] or 0) / previous[key]['ops_per_sec']
+		))
+	return lines
+
+def print_result(result):
+	"""
+	Prints a single result.
+
+	result -- the result of a benchmark
+	"""
+	memory = result['peak_memory_bytes']
+	print '%8d %-20s %10.1f ops/s %12s bytes' % (
+		result['size'],
+		result['benchmark'],
+		result['ops_per_sec'] or 0,
+		memory is None and '-' or memory
+	)
+	sys.stdout.flush()
+
+def main(args=None):
+	"""
+	Runs the benchmarks or compares two results from the command line.
+
+	args -- the command line arguments, defaults to sys.argv
+	"""
+	parser = optparse.OptionParser(
+		usage='%prog [options]\n       %prog --compare OLD.json NEW.json'
+	)
+	parser.add_option(
+		'--sizes', default=','.join(map(str, default_sizes)),
+		help='comma separated numbers of entries [%default]'
+	)
+	parser.add_option(
+		'--benchmarks', default=None,
+		help='comma separated names of the benchmarks to run'
+	)
+	parser.add_option('--output', help='the file for the JSON results')
+	parser.add_option(
+		'--no-memory', action='store_true', default=False,
+		help="don't trace the memory with tracemalloc"
+	)
+	parser.add_option(
+		'--no-index', action='store_true', default=False,
+		help="don't use attribute indexes in the stubber"
+	)
+	parser.add_option(
+		'--compare', action='store_true', default=False,
+		help='compare two JSON results'
+	)
+	options, args = parser.parse_args(args)
+	if options.compare:
+		if len(args) != 2:
+			parser.error('--compare needs two JSON files')
+		old, new = [ json.load(open(i)) for i in args ]
+		print '\n'.join(compare(old, new))
+		return
+	names = None
+	if options.benchmarks:
+		names = options.benchmarks.split(',')
+	results = run(
+		[ int(i) for i in options.sizes.split(',') ],
+		names,
+		not options.no_memory,
+		not options.no_index,
+		print_result
+	)
+	if options.output:
+		output = open(options.output, 'w')
+		try:
+			json.dump(results, output, indent=2, sort_keys=True)
+		finally:
+			output.close()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,195 @@
+"""
+This module contains the BER encoding (X.690) of the elements which LDAP
+messages are made of and of the values of the LDAP transactions (RFC 5805).
+It is used by the UnitOfWork, which sends transactions, and by the
+LdapServer and the stubber, which answer them.
+"""
+import ldap
+
+CLASS_APPLICATION = 0x40
+CLASS_CONTEXT = 0x80
+CONSTRUCTED = 0x20
+
+BOOLEAN = 0x01
+INTEGER = 0x02
+OCTET_STRING = 0x04
+ENUMERATED = 0x0a
+SEQUENCE = 0x30
+SET = 0x31
+
+def encode(tag, content):
+	"""
+	Returns the BER encoding of the given tag and content.
+
+	tag -- the identifier octet
+	content -- the encoded content
+	"""
+	length = len(content)
+	if length < 0x80:
+		return chr(tag) + chr(length) + content
+	octets = ''
+	while length:
+		octets = chr(length & 0xff) + octets
+		length >>= 8
+	return chr(tag) + chr(0x80 | len(octets)) + octets + content
+
+def encode_integer(value, tag=INTEGER):
+	"""
+	Returns the BER encoding of an integer in two's complement.
+
+	value -- the integer
+	tag -- the identifier octet, e.g. ENUMERATED
+	"""
+	octets = ''
+	while True:
+		octets = chr(value & 0xff) + octets
+		value >>= 8
+		sign = ord(octets[0]) & 0x80
+		if (value == 0 and not sign) or (value == -1 and sign):
+			return encode(tag, octets)
+
+def encode_string(value, tag=OCTET_STRING):
+	"""
+	Returns the BER encoding of an octet string.
+
+	value -- the string, unicode is encoded as utf-8
+	tag -- the identifier octet
+	"""
+	if isinstance(value, unicode):
+		value = value.encode('utf-8')
+	return encode(tag, str(value))
+
+def encode_boolean(value):
+	"""
+	Returns the BER encoding of a boolean.
+
+	value -- the boolean
+	"""
+	return encode(BOOLEAN, value and '\xff' or '\x00')
+
+def encode_sequence(items, tag=SEQUENCE):
+	"""
+	Returns the BER encoding of a sequence of encoded items.
+
+	items -- the encoded items
+	tag -- the identifier octet, e.g. SET
+	"""
+	return encode(tag, ''.join(items))
+
+def decode(data, offset=0):
+	"""
+	Decodes the element at the given offset and returns the tuple
+	(tag, content, next_offset).
+
+	data -- the BER encoded data
+	offset -- the position of the element
+	"""
+	try:
+		tag = ord(data[offset])
+		length = ord(data[offset + 1])
+		offset += 2
+		if length & 0x80:
+			octets = length & 0x7f
+			length = 0
+			for i in data[offset:offset + octets]:
+				length = length << 8 | ord(i)
+			offset += octets
+	except IndexError:
+		raise ldap.PROTOCOL_ERROR({ 'desc': 'Truncated BER element' })
+	if offset + length > len(data):
+		raise ldap.PROTOCOL_ERROR({ 'desc': 'Truncated BER element' })
+	return ( tag, data[offset:offset + length], offset + length )
+
+def decode_all(data):
+	"""
+	Decodes all elements of the content of a sequence or set and returns
+	them as a list of (tag, content) tuples.
+
+	data -- the BER encoded content
+	"""
+	items = []
+	offset = 0
+	while offset < len(data):
+		tag, content, offset = decode(data, offset)
+		items.append( ( tag, content ) )
+	return items
+
+def decode_integer(content):
+	"""
+	Decodes the content of an integer or enumerated element.
+
+	content -- the content octets
+	"""
+	value = 0
+	for i in content:
+		value = value << 8 | ord(i)
+	if content and ord(content[0]) & 0x80:
+		value -= 1 << (8 * len(content))
+	return value
+
+def decode_boolean(content):
+	"""
+	Decodes the content of a boolean element.
+
+	content -- the content octets
+	"""
+	return content != '\x00'
+
+def read_element(stream):
+	"""
+	Reads one BER element from the given stream and returns its tag and
+	content or None at the end of the stream.
+
+	stream -- a file-like object
+	"""
+	header = stream.read(2)
+	if len(header) < 2:
+		return None
+	tag = ord(header[0])
+	length = ord(header[1])
+	if length & 0x80:
+		length = decode_integer('\x00' + stream.read(length & 0x7f))
+	content = stream.read(length)
+	if len(content) < length:
+		return None
+	return ( tag, content )
+
+###########################################################################
+# LDAP transactions (RFC 5805)
+###########################################################################
+TRANSACTION_START = '1.3.6.1.1.21.1'
+TRANSACTION_SPECIFICATION = '1.3.6.1.1.21.2'
+TRANSACTION_END = '1.3.6.1.1.21.3'
+"""
+The OIDs of the LDAP transactions.
+"""
+
+def encode_end_transaction(identifier, commit=True):
+	"""
+	Returns the BER encoded value of an end transaction request, which is
+	SEQUENCE { commit BOOLEAN DEFAULT TRUE, identifier OCTET STRING }.
+
+	identifier -- the identifier of the transaction
+	commit -- False if the transaction should be aborted
+	"""
+	items = []
+	if not commit:
+		items.append(encode_boolean(False))
+	items.append(encode_string(identifier))
+	return encode_sequence(items)
+
+def decode_end_transaction(value):
+	"""
+	Decodes the value of an end transaction request and returns the tuple
+	(commit, identifier).
+
+	value -- the BER encoded txnEndReq
+	"""
+	commit = True
+	identifier = None
+	for tag, content in decode_all(decode(value)[1]):
+		if tag == BOOLEAN:
+			commit = decode_boolean(content)
+		else:
+			identifier = content
+	return ( commit, identifier )
@@ -0,0 +1,3 @@
+"""
+This module implements a bounded cache for search results.
+"""
@@ -0,0 +1,110 @@
+"""
+This module includes the ResultCache which can be assigned to the result_cache
+attribute of a model class.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+class ResultCache(object):
+	"""
+	This class is a thread-safe cache with a maximum size and a time to live.
+	If the cache is full the least recently used entry is evicted. The numbers
+	of hits, misses, evictions and invalidations are counted.
+	"""
+
+	def __init__(self, max_size=1000, ttl=60, clock=time.time):
+		"""
+		Constructor.
+
+		max_size -- the maximum number of cached entries
+		ttl -- the number of seconds an entry is valid. None keeps the entries
+			   until they are evicted or invalidated.
+		clock -- a callable which returns the current time in seconds
+		"""
+		self.max_size = max_size
+		self.ttl = ttl
+		self.clock = clock
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self.entries)
+
+	def get(self, key):
+		"""
+		Returns the cached value for the given key or None if the key is not
+		cached or expired.
+
+		key -- the key of the entry
+		"""
+		self._lock.acquire()
+		try:
+			entry = self.entries.pop(key, None)
+			if entry is None or self._is_expired(entry):
+				self.misses += 1
+				return None
+			# re-inserting marks the entry as most recently used
+			self.entries[key] = entry
+			self.hits += 1
+			return entry[1]
+		finally:
+			self._lock.release()
+
+	def put(self, key, value):
+		"""
+		Caches the value for the given key. If the cache is full the least
+		recently used entry is evicted.
+
+		key -- the key of the entry
+		value -- the value which should be cached
+		"""
+		self._lock.acquire()
+		try:
+			self.entries.pop(key, None)
+			while self.entries and len(self.entries) >= self.max_size:
+				self.entries.popitem(last=False)
+				self.evictions += 1
+			self.entries[key] = ( self.clock(), value )
+		finally:
+			self._lock.release()
+
+	def clear(self):
+		"""
+		Removes all entries from the cache.
+		"""
+		self._lock.acquire()
+		try:
+			self.entries.clear()
+			self.invalidations += 1
+		finally:
+			self._lock.release()
+
+	def stats(self):
+		"""
+		Returns the counters of the cache as dictionary.
+		"""
+		return {
+			'size': len(self.entries),
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions,
+			'invalidations': self.invalidations,
+		}
+
+	###########################################################################
+	# Helper methods
+	###########################################################################
+	def _is_expired(self, entry):
+		"""
+		Returns true if the given entry is older than the time to live.
+
+		entry -- a tuple of the creation time and the value
+		"""
+		if self.ttl is None:
+			return False
+		return self.clock() - entry[0] > self.ttl
@@ -0,0 +1,78 @@
+import unittest
+from cache import ResultCache
+
+class Clock(object):
+	def __init__(self):
+		self.now = 0
+	def __call__(self):
+		return self.now
+
+class AnEmptyCache(unittest.TestCase):
+	def setUp(self):
+		self.cache = ResultCache()
+
+	def test_should_return_none(self):
+		self.assertEqual(self.cache.get('key'), None)
+
+	def test_should_count_a_miss(self):
+		self.cache.get('key')
+		self.assertEqual(self.cache.misses, 1)
+		self.assertEqual(self.cache.hits, 0)
+
+class ACacheWithAnEntry(unittest.TestCase):
+	def setUp(self):
+		self.clock = Clock()
+		self.cache = ResultCache(ttl=10, clock=self.clock)
+		self.cache.put('key', [ 'value' ])
+
+	def test_should_return_the_value(self):
+		self.assertEqual(self.cache.get('key'), [ 'value' ])
+
+	def test_should_count_a_hit(self):
+		self.cache.get('key')
+		self.assertEqual(self.cache.hits, 1)
+
+	def test_should_return_the_value_within_the_ttl(self):
+		self.clock.now = 10
+		self.assertEqual(self.cache.get('key'), [ 'value' ])
+
+	def test_should_expire_the_value_after_the_ttl(self):
+		self.clock.now = 11
+		self.assertEqual(self.cache.get('key'), None)
+		self.assertEqual(len(self.cache), 0)
+
+	def test_should_remove_all_entries_on_clear(self):
+		self.cache.clear()
+		self.assertEqual(self.cache.get('key'), None)
+		self.assertEqual(self.cache.invalidations, 1)
+
+class AFullCache(unittest.TestCase):
+	def setUp(self):
+		self.cache = ResultCache(max_size=2)
+		self.cache.put('key1', 1)
+		self.cache.put('key2', 2)
+
+	def test_should_evict_the_least_recently_used_entry(self):
+		self.cache.get('key1')
+		self.cache.put('key3', 3)
+		self.assertEqual(self.cache.get('key2'), None)
+		self.assertEqual(self.cache.get('key1'), 1)
+		self.assertEqual(self.cache.get('key3'), 3)
+
+	def test_should_count_the_evictions(self):
+		self.cache.put('key3', 3)
+		self.assertEqual(self.cache.stats(), {
+			'size': 2,
+			'hits': 0,
+			'misses': 0,
+			'evictions': 1,
+			'invalidations': 0,
+		})
+
+	def test_should_not_evict_when_replacing_an_entry(self):
+		self.cache.put('key1', 5)
+		self.assertEqual(self.cache.evictions, 0)
+		self.assertEqual(self.cache.get('key1'), 5)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,115 @@
+"""
+This module includes the detector of N+1 searches. Relations which are loaded
+one item after another, e.g. in a loop of a template, send a search per item:
+
+	with NPlusOneDetector(threshold=10):
+		for device in Device.find_all():
+			device.switch	# warns after the tenth search from this line
+
+The detector counts the searches per relation and calling site. If a count
+exceeds the threshold a NPlusOneWarning is issued for the calling site, or a
+NPlusOneError is raised if the detector should fail, e.g. within the tests of
+a CI. Such relations should be prefetched:
+
+	Device.find_all(prefetch=('switch', ))
+"""
+import threading
+import warnings
+
+_local = threading.local()
+
+def _detectors():
+	"""
+	Returns the stack of detectors of the current thread.
+	"""
+	if not hasattr(_local, 'detectors'):
+		_local.detectors = []
+	return _local.detectors
+
+def current_detector():
+	"""
+	Returns the innermost active detector of the current thread or None if no
+	detector is active.
+	"""
+	detectors = _detectors()
+	if detectors:
+		return detectors[-1]
+	return None
+
+def relation_loaded(relation, frame):
+	"""
+	Is called by the relation properties whenever they search their items.
+
+	relation -- the name of the relation, e.g. 'Device.switch'
+	frame -- the frame which accessed the relation
+	"""
+	detector = current_detector()
+	if detector is not None:
+		detector.record(relation, frame.f_code.co_filename, frame.f_lineno)
+
+class NPlusOneWarning(UserWarning):
+	"""
+	This warning is issued when a relation was loaded more often than the
+	threshold from the same calling site.
+	"""
+
+class NPlusOneError(RuntimeError):
+	"""
+	This exception is raised instead of the NPlusOneWarning if the detector
+	should fail.
+	"""
+
+class NPlusOneDetector(object):
+	"""
+	This class counts the searches of the relation properties within the
+	with-block. The detector is bound to the thread which entered it.
+	"""
+
+	def __init__(self, threshold=10, fail=False):
+		"""
+		Constructor.
+
+		threshold -- the number of searches per relation and calling site
+		which are tolerated
+		fail -- True if a NPlusOneError should be raised instead of a warning
+		"""
+		self.threshold = threshold
+		self.fail = fail
+		self.counts = {}
+
+	def __enter__(self):
+		_detectors().append(self)
+		return self
+
+	def __exit__(self, *exc_info):
+		_detectors().remove(self)
+		return False
+
+	def record(self, relation, filename, lineno):
+		"""
+		Counts a search of the given relation and reports it once the
+		threshold is exceeded.
+
+		relation -- the name of the relation, e.g. 'Device.switch'
+		filename -- the file of the calling site
+		lineno -- the line of the calling site
+		"""
+		key = ( relation, filename, lineno )
+		count = self.counts[key] = self.counts.get(key, 0) + 1
+		if count != self.threshold + 1:
+			return
+		message = '%s was loaded %d times from %s:%d, prefetch it ' \
+				  'instead' % ( relation, count, filename, lineno )
+		if self.fail:
+			raise NPlusOneError(message)
+		warnings.warn_explicit(message, NPlusOneWarning, filename, lineno)
+
+	def report(self):
+		"""
+		Returns the relations which exceeded the threshold as list of
+		(relation, filename, lineno, count) tuples, the most frequent first.
+		"""
+		return sorted([
+			key + ( count, ) for key, count in self.counts.items()
+			if count > self.threshold
+		], key=lambda i: -i[3])
@@ -0,0 +1,365 @@
+"""
+This module measures the operations which the models send to the directory.
+Wrap the connection with an InstrumentedConnection and every call is timed
+and reported to the listeners of the Instrumentation:
+
+	instrumentation = Instrumentation()
+	instrumentation.register('operation', lambda event, operation:
+		log.debug('%s %s took %.3fs', operation.model, operation.name,
+				  operation.seconds))
+	Base.establish_connection({
+		'uri': 'ldap://someip',
+		'instrumentation': instrumentation,
+	})
+	...
+	instrumentation.metrics.counters()	# calls, results, bytes and seconds
+										# per model and operation
+
+Asynchronous operations like search_ext are reported when their result is
+fetched with result3.
+"""
+import bisect
+import thread
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+from signals.signals import Sender
+from pool.pool import reserved
+
+class Operation(object):
+	"""
+	This class describes a single operation on a connection.
+	"""
+
+	def __init__(self, model, name, base, filter=None):
+		"""
+		Constructor.
+
+		model -- the model class which sent the operation or None
+		name -- the name of the operation, e.g. 'search_s'
+		base -- the base of a search or the DN of a write operation
+		filter -- the LDAP-filter of a search
+		"""
+		self.model = model
+		self.name = name
+		self.base = base
+		self.filter = filter
+		self.results = 0
+		self.bytes = 0
+		self.seconds = 0.0
+		self.error = None
+
+	def __repr__(self):
+		return '<Operation %s %s %s %.6fs>' % (
+			self.model and self.model.__name__, self.name, self.base,
+			self.seconds
+		)
+
+def payload_size(data):
+	"""
+	Returns the number of characters of all strings in the given data, which
+	approximates the number of bytes on the wire.
+
+	data -- a result or the attributes of an operation
+	"""
+	if isinstance(data, basestring):
+		return len(data)
+	if isinstance(data, dict):
+		return sum([ len(i) + payload_size(j) for i, j in data.items() ])
+	if isinstance(data, ( list, tuple )):
+		return sum([ payload_size(i) for i in data ])
+	return 0
+
+class Metrics(object):
+	"""
+	This class collects counters and latency histograms of the reported
+	operations per model and operation.
+	"""
+
+	buckets = (
+		0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0
+	)
+	"""
+	The upper bounds of the latency buckets in seconds. Slower operations are
+	counted in an additional bucket.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		"""
+		Forgets all collected data.
+		"""
+		with self.lock:
+			self._counters = {}
+			self._histograms = {}
+
+	def __call__(self, event, operation):
+		"""
+		Records the given operation. Metrics are registered as listener of
+		an Instrumentation.
+
+		event -- the name of the event
+		operation -- the Operation
+		"""
+		key = ( operation.model and operation.model.__name__, operation.name )
+		with self.lock:
+			counter = self._counters.get(key)
+			if counter is None:
+				counter = self._counters[key] = {
+					'calls': 0, 'errors': 0, 'results': 0, 'bytes': 0,
+					'seconds': 0.0,
+				}
+				self._histograms[key] = [ 0 ] * (len(self.buckets) + 1)
+			counter['calls'] += 1
+			counter['errors'] += operation.error is not None
+			counter['results'] += operation.results
+			counter['bytes'] += operation.bytes
+			counter['seconds'] += operation.seconds
+			bucket = bisect.bisect_left(self.buckets, operation.seconds)
+			self._histograms[key][bucket] += 1
+
+	def counters(self):
+		"""
+		Returns a copy of the counters in the form
+		{ (model_name, operation): { 'calls': ..., 'errors': ...,
+		'results': ..., 'bytes': ..., 'seconds': ... } }
+		"""
+		with self.lock:
+			return dict([
+				( key, dict(value) ) for key, value in self._counters.items()
+			])
+
+	def histogram(self, operation, model=None):
+		"""
+		Returns the latency histogram of the given operation as list of
+		(upper_bound, count) tuples. The last upper bound is None.
+
+		operation -- the name of the operation, e.g. 'search_s'
+		model -- the name of a model class, None for all models
+		"""
+		counts = [ 0 ] * (len(self.buckets) + 1)
+		with self.lock:
+			for key, histogram in self._histograms.items():
+				if key[1] != operation:
+					continue
+				if model is not None and key[0] != model:
+					continue
+				counts = [ i + j for i, j in zip(counts, histogram) ]
+		return zip(list(self.buckets) + [ None ], counts)
+
+class Instrumentation(Sender):
+	"""
+	This class reports every finished Operation with the event 'operation'
+	to its listeners. Its Metrics are registered by default.
+	"""
+
+	def __init__(self):
+		self.metrics = Metrics()
+		self.register('operation', self.metrics)
+
+class InstrumentedConnection(object):
+	"""
+	This class wraps a connection, a ConnectionPool or a stubber. As an
+	attribute of a model class it is a descriptor, which binds the wrapper
+	to the class accessing it, so every operation knows its model.
+	"""
+
+	synchronous = (
+		'search_s', 'add_s', 'modify_s', 'delete_s', 'modrdn_s', 'rename_s',
+		'extop_s',
+	)
+	"""
+	The operations which are timed when they are called.
+	"""
+
+	asynchronous = (
+		'search_ext', 'add_ext', 'modify_ext', 'delete_ext', 'rename',
+		'modrdn_ext', 'rename_ext', 'extop',
+	)
+	"""
+	The operations which are timed until their result was fetched.
+	"""
+
+	searches = ( 'search_s', 'search_ext' )
+
+	def __init__(self, connection, instrumentation):
+		"""
+		Constructor.
+
+		connection -- the connection which should be instrumented
+		instrumentation -- the Instrumentation which receives the operations
+		"""
+		self.connection = connection
+		self.instrumentation = instrumentation
+		self.lock = threading.Lock()
+		self.pending = {}
+
+	def __get__(self, instance, owner):
+		return BoundConnection(self, owner)
+
+	def __getattr__(self, name):
+		return getattr(BoundConnection(self, None), name)
+
+	def start(self, model, name, args, kwds):
+		"""
+		Returns a new Operation for the given call.
+
+		model -- the model class or None
+		name -- the name of the operation
+		args -- the positional arguments of the call
+		kwds -- the keyword arguments of the call
+		"""
+		base = args and args[0] or kwds.get('base')
+		filter = None
+		if name in self.searches:
+			filter = len(args) > 2 and args[2] or kwds.get('filterstr')
+		operation = Operation(model, name, base, filter)
+		if name not in self.searches:
+			operation.bytes = payload_size(args[1:])
+		return operation
+
+	def finish(self, operation, result, seconds, error=None):
+		"""
+		Completes the given operation and reports it.
+
+		operation -- the Operation
+		result -- the results of a search
+		seconds -- the elapsed time
+		error -- the exception if the operation failed
+		"""
+		operation.seconds = seconds
+		operation.error = error
+		if operation.name in self.searches and result:
+			operation.results = len(result)
+			operation.bytes = payload_size(result)
+		self.instrumentation.notify('operation', operation)
+
+	def started(self, msgid, operation, start):
+		"""
+		Remembers an asynchronous operation until its result is fetched.
+
+		msgid -- the message id of the operation
+		operation -- the Operation
+		start -- the time the operation was started
+		"""
+		with self.lock:
+			self.pending[( thread.get_ident(), msgid )] = ( operation, start )
+
+	def fetched(self, msgid):
+		"""
+		Returns and forgets the asynchronous operation with the given message
+		id, None if it is unknown.
+
+		msgid -- the message id of the operation
+		"""
+		with self.lock:
+			return self.pending.pop(( thread.get_ident(), msgid ), None)
+
+class BoundConnection(object):
+	"""
+	This class represents an InstrumentedConnection which is bound to a model
+	class. It times the operations and passes everything else through.
+	"""
+
+	def __init__(self, instrumented, model):
+		"""
+		Constructor.
+
+		instrumented -- the InstrumentedConnection
+		model -- the model class or None
+		"""
+		self.instrumented = instrumented
+		self.model = model
+
+	def __getattr__(self, name):
+		attr = getattr(self.instrumented.connection, name)
+		if name in InstrumentedConnection.synchronous:
+			return self._synchronous(name, attr)
+		if name in InstrumentedConnection.asynchronous:
+			return self._asynchronous(name, attr)
+		if name == 'result3':
+			return self._result3(attr)
+		return attr
+
+	@contextmanager
+	def reserve(self):
+		"""
+		Pins the connection of a wrapped pool to the current thread.
+		"""
+		with reserved(self.instrumented.connection):
+			yield self
+
+	def _synchronous(self, name, method):
+		"""
+		Returns a function which times the given synchronous operation.
+
+		name -- the name of the operation
+		method -- the operation of the wrapped connection
+		"""
+		instrumented = self.instrumented
+		model = self.model
+		def call(*args, **kwds):
+			operation = instrumented.start(model, name, args, kwds)
+			start = default_timer()
+			try:
+				result = method(*args, **kwds)
+			except Exception, e:
+				instrumented.finish(operation, None, default_timer() - start, e)
+				raise
+			instrumented.finish(operation, result, default_timer() - start)
+			return result
+		return call
+
+	def _asynchronous(self, name, method):
+		"""
+		Returns a function which starts timing the given asynchronous
+		operation.
+
+		name -- the name of the operation
+		method -- the operation of the wrapped connection
+		"""
+		instrumented = self.instrumented
+		model = self.model
+		def call(*args, **kwds):
+			operation = instrumented.start(model, name, args, kwds)
+			start = default_timer()
+			try:
+				msgid = method(*args, **kwds)
+			except Exception, e:
+				instrumented.finish(operation, None, default_timer() - start, e)
+				raise
+			instrumented.started(msgid, operation, start)
+			return msgid
+		return call
+
+	def _result3(self, method):
+		"""
+		Returns a function which fetches a result and reports the matching
+		asynchronous operation.
+
+		method -- the result3 method of the wrapped connection
+		"""
+		instrumented = self.instrumented
+		def call(*args, **kwds):
+			try:
+				result = method(*args, **kwds)
+			except Exception, e:
+				msgid = args and args[0] or kwds.get('msgid')
+				pending = instrumented.fetched(msgid)
+				if pending is not None:
+					operation, start = pending
+					instrumented.finish(
+						operation, None, default_timer() - start, e
+					)
+				raise
+			pending = instrumented.fetched(result[2])
+			if pending is not None:
+				operation, start = pending
+				instrumented.finish(
+					operation, result[1], default_timer() - start
+				)
+			return result
+		return call
@@ -0,0 +1,181 @@
+"""
+This module contains the tree of the directory information (DIT) of the
+stubber. Every node is keyed by its normalized RDN below its parent, so
+scoped searches only visit the relevant part of the tree and renames only
+re-link a single node.
+"""
+import ldap
+import re
+
+separator = re.compile(r'(?<!\\),')
+
+def split_dn(dn):
+	"""
+	Returns the RDNs of the given DN beginning with the top-most one.
+
+	dn -- the distinguished name, e.g. 'uid=a,ou=user,o=tree'
+	"""
+	if not dn:
+		return []
+	return [ i.strip() for i in reversed(separator.split(dn)) ]
+
+def normalize_rdn(rdn):
+	"""
+	Returns the given RDN in lower case without spaces around the '='.
+
+	rdn -- the relative distinguished name, e.g. 'uid=a'
+	"""
+	return '='.join([ i.strip() for i in rdn.lower().split('=', 1) ])
+
+class DitNode(object):
+	"""
+	This class represents a node of the tree. Nodes without an entry are
+	glue nodes which only connect the entries below them.
+	"""
+
+	def __init__(self, rdn=None, parent=None):
+		"""
+		Constructor.
+
+		rdn -- the RDN of the node, None for the root
+		parent -- the parent node, None for the root
+		"""
+		self.rdn = rdn
+		self.parent = parent
+		self.children = {}
+		self.position = None
+		self.size = 0
+
+	@property
+	def dn(self):
+		"""
+		The distinguished name of the node.
+		"""
+		rdns = []
+		node = self
+		while node.parent is not None:
+			rdns.append(node.rdn)
+			node = node.parent
+		return ','.join(rdns)
+
+	def find(self, dn):
+		"""
+		Returns the node with the given DN below this node or None.
+
+		dn -- the distinguished name
+		"""
+		node = self
+		for rdn in split_dn(dn):
+			node = node.children.get(normalize_rdn(rdn))
+			if node is None:
+				return None
+		return node
+
+	def find_or_create(self, dn):
+		"""
+		Returns the node with the given DN. Missing nodes on the way are
+		created as glue nodes.
+
+		dn -- the distinguished name
+		"""
+		node = self
+		for rdn in split_dn(dn):
+			key = normalize_rdn(rdn)
+			child = node.children.get(key)
+			if child is None:
+				child = node.children[key] = DitNode(rdn, node)
+			node = child
+		return node
+
+	def attach(self, parent, rdn):
+		"""
+		Links the node and its subtree below the given parent.
+
+		parent -- the new parent node
+		rdn -- the new RDN of the node
+		"""
+		self.rdn = rdn
+		self.parent = parent
+		parent.children[normalize_rdn(rdn)] = self
+		parent.resize(self.size)
+
+	def detach(self):
+		"""
+		Unlinks the node and its subtree from its parent and returns the
+		former parent.
+		"""
+		parent = self.parent
+		del parent.children[normalize_rdn(self.rdn)]
+		parent.resize(-self.size)
+		self.parent = None
+		return parent
+
+	def resize(self, difference):
+		"""
+		Adds the given difference to the number of entries of this node and
+		all its ancestors.
+
+		difference -- the number of added or removed entries
+		"""
+		node = self
+		while node is not None:
+			node.size += difference
+			node = node.parent
+
+	def prune(self):
+		"""
+		Removes this node and its ancestors as long as they are empty glue
+		nodes.
+		"""
+		node = self
+		while node.parent is not None and node.position is None and \
+			  not node.children:
+			del node.parent.children[normalize_rdn(node.rdn)]
+			node = node.parent
+
+	def is_below(self, other):
+		"""
+		Returns true if this node is the given node or one of its
+		descendants.
+
+		other -- the other node
+		"""
+		node = self
+		while node is not None:
+			if node is other:
+				return True
+			node = node.parent
+		return False
+
+	def in_scope(self, base, scope):
+		"""
+		Returns true if the node is within the scope of a search.
+
+		base -- the node of the search base
+		scope -- the scope of the search
+		"""
+		if scope == ldap.SCOPE_BASE:
+			return self is base
+		if scope == ldap.SCOPE_ONELEVEL:
+			return self.parent is base
+		return self.is_below(base)
+
+	def positions(self, scope):
+		"""
+		Returns the positions of the entries within the scope of a search
+		based on this node.
+
+		scope -- the scope of the search
+		"""
+		if scope == ldap.SCOPE_BASE:
+			nodes = [ self ]
+		elif scope == ldap.SCOPE_ONELEVEL:
+			nodes = self.children.values()
+		else:
+			nodes = []
+			pending = [ self ]
+			while pending:
+				node = pending.pop()
+				nodes.append(node)
+				pending.extend(node.children.values())
+		return [ i.position for i in nodes if i.position is not None ]
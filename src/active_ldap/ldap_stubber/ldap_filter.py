@@ -0,0 +1,328 @@
+"""
+This module compiles LDAP-filters as described in RFC 4515 into a tree of
+nodes which can be evaluated against many elements. Compiled filters are
+cached by their text, so every filter is parsed only once.
+"""
+import ldap
+import re
+
+class Node(object):
+	"""
+	This class represents a node of a compiled filter.
+	"""
+	def matches(self, element):
+		"""
+		Returns true if the given element matches the node.
+
+		element -- an object whose values(attr) method returns the list of
+				   values of an attribute
+		"""
+		raise NotImplementedError()
+
+class And(Node):
+	"""
+	This class represents (&(...)(...)). An empty conjunction is true.
+	"""
+	def __init__(self, children):
+		self.children = children
+
+	def matches(self, element):
+		for child in self.children:
+			if not child.matches(element):
+				return False
+		return True
+
+class Or(Node):
+	"""
+	This class represents (|(...)(...)). An empty disjunction is false.
+	"""
+	def __init__(self, children):
+		self.children = children
+
+	def matches(self, element):
+		for child in self.children:
+			if child.matches(element):
+				return True
+		return False
+
+class Not(Node):
+	"""
+	This class represents (!(...)).
+	"""
+	def __init__(self, child):
+		self.child = child
+
+	def matches(self, element):
+		return not self.child.matches(element)
+
+class Present(Node):
+	"""
+	This class represents (attr=*).
+	"""
+	def __init__(self, attr):
+		self.attr = attr
+
+	def matches(self, element):
+		return len(element.values(self.attr)) > 0
+
+class Equality(Node):
+	"""
+	This class represents (attr=value).
+	"""
+	def __init__(self, attr, value):
+		self.attr = attr
+		self.value = value
+
+	def matches(self, element):
+		return self.value in element.values(self.attr)
+
+class Substrings(Node):
+	"""
+	This class represents (attr=initial*any*final).
+	"""
+	def __init__(self, attr, initial, any, final):
+		self.attr = attr
+		self.initial = initial
+		self.any = any
+		self.final = final
+
+	def matches(self, element):
+		for value in element.values(self.attr):
+			if self._matches_value(value):
+				return True
+		return False
+
+	def _matches_value(self, value):
+		"""
+		Returns true if the single value matches the substrings.
+
+		value -- the value of the attribute
+		"""
+		start = len(self.initial)
+		end = len(value) - len(self.final)
+		if start > end:
+			return False
+		if not value.startswith(self.initial):
+			return False
+		if not value.endswith(self.final):
+			return False
+		for part in self.any:
+			position = value.find(part, start, end)
+			if position < 0:
+				return False
+			start = position + len(part)
+		return True
+
+class Ordering(Node):
+	"""
+	This class represents (attr>=value) and (attr<=value). Values which are
+	both integers are compared as numbers, all others as strings.
+	"""
+	def __init__(self, attr, value, greater):
+		self.attr = attr
+		self.value = value
+		self.greater = greater
+
+	def matches(self, element):
+		for value in element.values(self.attr):
+			if self._compare(value) * (self.greater and 1 or -1) >= 0:
+				return True
+		return False
+
+	def _compare(self, value):
+		"""
+		Compares the given value with the value of the filter.
+
+		value -- the value of the attribute
+		"""
+		try:
+			return cmp(int(value), int(self.value))
+		except ValueError:
+			return cmp(value, self.value)
+
+class Approx(Node):
+	"""
+	This class represents (attr~=value). Values match approximately if they
+	are equal without regard to case and whitespace.
+	"""
+	def __init__(self, attr, value):
+		self.attr = attr
+		self.value = self.normalize(value)
+
+	@staticmethod
+	def normalize(value):
+		"""
+		Returns the value in lower case without any whitespace.
+
+		value -- the value which should be normalized
+		"""
+		return ''.join(value.lower().split())
+
+	def matches(self, element):
+		for value in element.values(self.attr):
+			if self.normalize(value) == self.value:
+				return True
+		return False
+
+class FilterParser(object):
+	"""
+	This class parses the string representation of a filter.
+	"""
+
+	attribute = re.compile(r'[A-Za-z0-9][A-Za-z0-9\-;.]*')
+	hex_escape = re.compile(r'[0-9A-Fa-f]{2}$')
+
+	def __init__(self, text):
+		"""
+		Constructor.
+
+		text -- the LDAP-filter
+		"""
+		self.text = text
+		self.position = 0
+
+	def parse(self):
+		"""
+		Returns the root node of the filter. Raises ldap.FILTER_ERROR if the
+		filter is invalid.
+		"""
+		node = self._filter()
+		if self.position != len(self.text):
+			self._error('unexpected characters after the filter')
+		return node
+
+	def _filter(self):
+		"""
+		Parses '(' filtercomp ')'.
+		"""
+		self._expect('(')
+		char = self._peek()
+		if char == '&':
+			self.position += 1
+			node = And(self._filter_list())
+		elif char == '|':
+			self.position += 1
+			node = Or(self._filter_list())
+		elif char == '!':
+			self.position += 1
+			node = Not(self._filter())
+		else:
+			node = self._item()
+		self._expect(')')
+		return node
+
+	def _filter_list(self):
+		"""
+		Parses the filters of a conjunction or disjunction.
+		"""
+		children = []
+		while self._peek() == '(':
+			children.append(self._filter())
+		return children
+
+	def _item(self):
+		"""
+		Parses a simple, presence or substrings item.
+		"""
+		match = self.attribute.match(self.text, self.position)
+		if not match:
+			self._error('attribute description expected')
+		attr = match.group(0)
+		self.position = match.end()
+		operator = self.text[self.position:self.position + 2]
+		if operator in ( '~=', '>=', '<=' ):
+			self.position += 2
+			value = self._value()
+			if len(value) != 1:
+				self._error('wildcards are only allowed with =')
+			if operator == '~=':
+				return Approx(attr, value[0])
+			return Ordering(attr, value[0], operator == '>=')
+		if operator[:1] != '=':
+			self._error('filter type expected')
+		self.position += 1
+		value = self._value()
+		if len(value) == 1:
+			return Equality(attr, value[0])
+		if value == [ '', '' ]:
+			return Present(attr)
+		return Substrings(attr, value[0], filter(None, value[1:-1]), value[-1])
+
+	def _value(self):
+		"""
+		Parses an assertion value up to the closing parenthesis and returns
+		its parts split at the unescaped asterisks.
+		"""
+		parts = [ [] ]
+		while True:
+			char = self._peek()
+			if char is None:
+				self._error('unterminated value')
+			if char == ')':
+				break
+			if char == '(':
+				self._error('unescaped parenthesis in value')
+			if char == '*':
+				parts.append([])
+			elif char == '\\':
+				escaped = self.text[self.position + 1:self.position + 3]
+				if not self.hex_escape.match(escaped):
+					self._error('invalid escape sequence')
+				parts[-1].append(chr(int(escaped, 16)))
+				self.position += 2
+			else:
+				parts[-1].append(char)
+			self.position += 1
+		return [ ''.join(i) for i in parts ]
+
+	def _peek(self):
+		"""
+		Returns the current character or None at the end of the filter.
+		"""
+		if self.position < len(self.text):
+			return self.text[self.position]
+		return None
+
+	def _expect(self, char):
+		"""
+		Consumes the given character.
+
+		char -- the expected character
+		"""
+		if self._peek() != char:
+			self._error('%s expected' % char)
+		self.position += 1
+
+	def _error(self, message):
+		"""
+		Raises an ldap.FILTER_ERROR for the current position.
+
+		message -- the description of the error
+		"""
+		raise ldap.FILTER_ERROR({
+			'desc': 'Bad search filter',
+			'info': '%s at position %d of %s' % (
+				message, self.position, self.text
+			),
+		})
+
+cache_size = 1000
+"""
+The number of compiled filters which are kept in memory.
+"""
+
+_compiled = {}
+
+def compile_filter(text):
+	"""
+	Returns the compiled filter for the given LDAP-filter.
+
+	text -- the LDAP-filter, e.g. '(&(objectClass=user)(uid=a*))'
+	"""
+	node = _compiled.get(text)
+	if node is None:
+		node = FilterParser(text).parse()
+		if len(_compiled) >= cache_size:
+			_compiled.clear()
+		_compiled[text] = node
+	return node
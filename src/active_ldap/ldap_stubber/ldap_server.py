@@ -0,0 +1,524 @@
+"""
+This module contains a small LDAPv3 server (RFC 4511) which uses a
+LdapStubber as its directory. It speaks enough of the protocol for
+python-ldap clients: bind, search with the simple paged results control,
+add, modify, modrdn, delete, transactions (RFC 5805) and unbind. It is
+meant for tests and benchmarks which should run against a real network
+connection:
+
+	server = LdapServer(LdapStubber()).start()
+	Base.establish_connection({ 'uri': server.uri, ... })
+	...
+	server.stop()
+"""
+import ldap
+import threading
+import SocketServer
+from ldap.controls import SimplePagedResultsControl
+from ldap_stubber import LdapStubber
+from ber import CLASS_APPLICATION, CLASS_CONTEXT, CONSTRUCTED
+from ber import BOOLEAN, ENUMERATED, SET
+from ber import encode_integer, encode_string, encode_boolean, encode_sequence
+from ber import decode, decode_all, decode_integer, decode_boolean
+from ber import read_element, decode_end_transaction
+from ber import TRANSACTION_START, TRANSACTION_SPECIFICATION, TRANSACTION_END
+
+###########################################################################
+# LDAP protocol
+###########################################################################
+def application(number, constructed=True):
+	"""
+	Returns the tag of the given protocol operation.
+
+	number -- the number of the APPLICATION tag
+	constructed -- False for primitive operations like DelRequest
+	"""
+	return CLASS_APPLICATION | (constructed and CONSTRUCTED or 0) | number
+
+BIND_REQUEST = application(0)
+UNBIND_REQUEST = application(2, False)
+SEARCH_REQUEST = application(3)
+MODIFY_REQUEST = application(6)
+ADD_REQUEST = application(8)
+DEL_REQUEST = application(10, False)
+MODDN_REQUEST = application(12)
+ABANDON_REQUEST = application(16, False)
+EXTENDED_REQUEST = application(23)
+
+BIND_RESPONSE = application(1)
+SEARCH_RESULT_ENTRY = application(4)
+SEARCH_RESULT_DONE = application(5)
+MODIFY_RESPONSE = application(7)
+ADD_RESPONSE = application(9)
+DEL_RESPONSE = application(11)
+MODDN_RESPONSE = application(13)
+EXTENDED_RESPONSE = application(24)
+
+CONTROLS = CLASS_CONTEXT | CONSTRUCTED | 0
+
+SUCCESS = 0
+PROTOCOL_ERROR = 2
+SIZELIMIT_EXCEEDED = 4
+AUTH_METHOD_NOT_SUPPORTED = 7
+UNAVAILABLE_CRITICAL_EXTENSION = 12
+NO_SUCH_ATTRIBUTE = 16
+NO_SUCH_OBJECT = 32
+INVALID_CREDENTIALS = 49
+UNWILLING_TO_PERFORM = 53
+NOT_ALLOWED_ON_NONLEAF = 66
+ALREADY_EXISTS = 68
+OTHER = 80
+
+result_codes = [
+	( ldap.NO_SUCH_ATTRIBUTE, NO_SUCH_ATTRIBUTE ),
+	( ldap.NO_SUCH_OBJECT, NO_SUCH_OBJECT ),
+	( ldap.UNWILLING_TO_PERFORM, UNWILLING_TO_PERFORM ),
+	( ldap.NOT_ALLOWED_ON_NONLEAF, NOT_ALLOWED_ON_NONLEAF ),
+	( ldap.ALREADY_EXISTS, ALREADY_EXISTS ),
+	( ldap.FILTER_ERROR, PROTOCOL_ERROR ),
+	( ldap.PROTOCOL_ERROR, PROTOCOL_ERROR ),
+	# the stubber raises RuntimeErrors for unknown DNs
+	( RuntimeError, NO_SUCH_OBJECT ),
+]
+"""
+Maps the exceptions of the stubber to LDAP result codes.
+"""
+
+filter_operators = { 3: '=', 5: '>=', 6: '<=', 8: '~=' }
+
+def escape_value(value):
+	"""
+	Escapes the special characters of an assertion value (RFC 4515).
+
+	value -- the value
+	"""
+	return ''.join([
+		i in '\\*()\x00' and '\\%02x' % ord(i) or i for i in value
+	])
+
+def filter_to_string(tag, content):
+	"""
+	Converts a BER encoded filter into its string representation.
+
+	tag -- the tag of the filter choice
+	content -- the content of the filter
+	"""
+	choice = tag & 0x1f
+	if choice in ( 0, 1 ):
+		return '(%s%s)' % ('&|'[choice], ''.join([
+			filter_to_string(*i) for i in decode_all(content)
+		]))
+	if choice == 2:
+		return '(!%s)' % filter_to_string(*decode_all(content)[0])
+	if choice in filter_operators:
+		attr, value = [ i[1] for i in decode_all(content) ]
+		operator = filter_operators[choice]
+		return '(%s%s%s)' % (attr, operator, escape_value(value))
+	if choice == 4:
+		attr, substrings = decode_all(content)
+		parts = [ '', '' ]
+		for sub_tag, value in decode_all(substrings[1]):
+			if sub_tag & 0x1f == 2:
+				parts[-1] = escape_value(value)
+			elif sub_tag & 0x1f == 1:
+				parts.insert(-1, escape_value(value))
+			else:
+				parts[0] = escape_value(value)
+		return '(%s=%s)' % (attr[1], '*'.join(parts))
+	if choice == 7:
+		return '(%s=*)' % content
+	raise ldap.PROTOCOL_ERROR({ 'desc': 'Unsupported filter type %d' % choice })
+
+def encode_result(tag, code, message='', extra=''):
+	"""
+	Returns an encoded LDAPResult.
+
+	tag -- the tag of the response operation
+	code -- the result code
+	message -- the diagnostic message
+	extra -- additional encoded elements of the response
+	"""
+	return encode_sequence([
+		encode_integer(code, ENUMERATED),
+		encode_string(''),
+		encode_string(message),
+		extra,
+	], tag)
+
+def encode_message(msgid, operation, controls=()):
+	"""
+	Returns an encoded LDAPMessage.
+
+	msgid -- the message id
+	operation -- the encoded protocol operation
+	controls -- a list of encoded controls
+	"""
+	items = [ encode_integer(msgid), operation ]
+	if controls:
+		items.append(encode_sequence(controls, CONTROLS))
+	return encode_sequence(items)
+
+def encode_control(oid, value, criticality=False):
+	"""
+	Returns an encoded control.
+
+	oid -- the control type
+	value -- the encoded control value or None
+	criticality -- True if the control is critical
+	"""
+	items = [ encode_string(oid) ]
+	if criticality:
+		items.append(encode_boolean(True))
+	if value is not None:
+		items.append(encode_string(value))
+	return encode_sequence(items)
+
+def decode_controls(content):
+	"""
+	Decodes the controls of a message and returns them as a list of
+	(oid, criticality, value) tuples.
+
+	content -- the content of the controls element
+	"""
+	controls = []
+	for tag, control in decode_all(content):
+		parts = decode_all(control)
+		criticality = False
+		value = None
+		for part_tag, part in parts[1:]:
+			if part_tag == BOOLEAN:
+				criticality = decode_boolean(part)
+			else:
+				value = part
+		controls.append( ( parts[0][1], criticality, value ) )
+	return controls
+
+class LdapRequestHandler(SocketServer.StreamRequestHandler):
+	"""
+	This class handles the messages of one client connection.
+	"""
+
+	operations = {
+		BIND_REQUEST: 'bind',
+		SEARCH_REQUEST: 'search',
+		MODIFY_REQUEST: 'modify',
+		ADD_REQUEST: 'add',
+		DEL_REQUEST: 'delete',
+		MODDN_REQUEST: 'modrdn',
+		EXTENDED_REQUEST: 'extended',
+	}
+
+	def handle(self):
+		"""
+		Answers the messages of the client until it unbinds or disconnects.
+		"""
+		while True:
+			element = read_element(self.rfile)
+			if element is None:
+				return
+			items = decode_all(element[1])
+			msgid = decode_integer(items[0][1])
+			tag, content = items[1]
+			if tag == UNBIND_REQUEST:
+				return
+			if tag == ABANDON_REQUEST:
+				continue
+			controls = []
+			if len(items) > 2 and items[2][0] == CONTROLS:
+				controls = decode_controls(items[2][1])
+			operation = self.operations.get(tag)
+			if operation is None:
+				self.send(msgid, encode_result(
+					EXTENDED_RESPONSE, PROTOCOL_ERROR, 'Unknown operation'
+				))
+				return
+			getattr(self, operation)(msgid, content, controls)
+
+	def send(self, msgid, operation, controls=()):
+		"""
+		Sends a message to the client.
+
+		msgid -- the message id of the request
+		operation -- the encoded protocol operation
+		controls -- a list of encoded controls
+		"""
+		self.wfile.write(encode_message(msgid, operation, controls))
+
+	def call(self, msgid, response, controls, method, *args):
+		"""
+		Calls the given method of the stubber and sends the result. Updates
+		with the transaction specification control are added to their
+		transaction instead.
+
+		msgid -- the message id of the request
+		response -- the tag of the response operation
+		controls -- the decoded controls of the request
+		method -- the name of the method of the stubber
+		args -- the arguments of the method
+		"""
+		code = SUCCESS
+		message = ''
+		transaction = None
+		for oid, criticality, value in controls:
+			if oid == TRANSACTION_SPECIFICATION:
+				transaction = value
+		try:
+			with self.server.lock:
+				if transaction is None:
+					getattr(self.server.stubber, method)(*args)
+				else:
+					self.server.stubber.add_to_transaction(
+						transaction, method, *args
+					)
+		except Exception, e:
+			code, message = self.error_result(e)
+		self.send(msgid, encode_result(response, code, message))
+
+	def error_result(self, error):
+		"""
+		Returns the result code and the message for the given exception.
+
+		error -- an exception raised by the stubber
+		"""
+		for klass, code in result_codes:
+			if isinstance(error, klass):
+				return ( code, str(error) )
+		return ( OTHER, str(error) )
+
+	def critical_controls(self, controls, supported=()):
+		"""
+		Returns true if one of the given controls is critical and not
+		supported.
+
+		controls -- the decoded controls of the request
+		supported -- the oids of the supported controls
+		"""
+		for oid, criticality, value in controls:
+			if criticality and oid not in supported:
+				return True
+		return False
+
+	def bind(self, msgid, content, controls):
+		"""
+		Handles a BindRequest with simple authentication.
+		"""
+		version, name, authentication = decode_all(content)
+		code = SUCCESS
+		if authentication[0] != CLASS_CONTEXT | 0:
+			code = AUTH_METHOD_NOT_SUPPORTED
+		elif self.server.credentials is not None and name[1] and \
+			 self.server.credentials.get(name[1]) != authentication[1]:
+			code = INVALID_CREDENTIALS
+		self.send(msgid, encode_result(BIND_RESPONSE, code))
+
+	def search(self, msgid, content, controls):
+		"""
+		Handles a SearchRequest. The simple paged results control is passed
+		to the stubber.
+		"""
+		items = decode_all(content)
+		base = items[0][1]
+		scope = decode_integer(items[1][1])
+		sizelimit = decode_integer(items[3][1])
+		try:
+			expr = filter_to_string(*items[6])
+		except ldap.PROTOCOL_ERROR, e:
+			return self.send(msgid, encode_result(
+				SEARCH_RESULT_DONE, *self.error_result(e)
+			))
+		attrlist = [ i[1] for i in decode_all(items[7][1]) ] or None
+		paged = SimplePagedResultsControl.controlType
+		if self.critical_controls(controls, [ paged ]):
+			return self.send(msgid, encode_result(
+				SEARCH_RESULT_DONE, UNAVAILABLE_CRITICAL_EXTENSION
+			))
+		serverctrls = []
+		for oid, criticality, value in controls:
+			if oid == paged:
+				size, cookie = decode_all(decode(value)[1])
+				serverctrls.append(SimplePagedResultsControl(
+					criticality,
+					size=decode_integer(size[1]),
+					cookie=cookie[1]
+				))
+		try:
+			with self.server.lock:
+				if base == '' and scope == ldap.SCOPE_BASE:
+					results = [ ( '', self.server.root_dse() ) ]
+					response_controls = []
+				else:
+					results, response_controls = self.server.search(
+						base, scope, expr, attrlist, serverctrls
+					)
+		except Exception, e:
+			return self.send(msgid, encode_result(
+				SEARCH_RESULT_DONE, *self.error_result(e)
+			))
+		code = SUCCESS
+		if sizelimit and len(results) > sizelimit:
+			results = results[:sizelimit]
+			code = SIZELIMIT_EXCEEDED
+		for dn, attrs in results:
+			self.send(msgid, encode_sequence([
+				encode_string(dn),
+				encode_sequence([
+					encode_sequence([
+						encode_string(attr),
+						encode_sequence(map(encode_string, values), SET),
+					]) for attr, values in attrs.items()
+				]),
+			], SEARCH_RESULT_ENTRY))
+		self.send(msgid, encode_result(SEARCH_RESULT_DONE, code), [
+			encode_control(paged, encode_sequence([
+				encode_integer(i.size), encode_string(i.cookie)
+			]), i.criticality) for i in response_controls
+		])
+
+	def modify(self, msgid, content, controls):
+		"""
+		Handles a ModifyRequest.
+		"""
+		dn, changes = decode_all(content)
+		attrs = []
+		for tag, change in decode_all(changes[1]):
+			operation, modification = decode_all(change)
+			attr, values = decode_all(modification[1])
+			attrs.append( (
+				decode_integer(operation[1]),
+				attr[1],
+				[ i[1] for i in decode_all(values[1]) ]
+			) )
+		self.call(
+			msgid, MODIFY_RESPONSE, controls, 'modify_s', dn[1], attrs
+		)
+
+	def add(self, msgid, content, controls):
+		"""
+		Handles an AddRequest.
+		"""
+		dn, attributes = decode_all(content)
+		attrs = []
+		for tag, attribute in decode_all(attributes[1]):
+			attr, values = decode_all(attribute)
+			attrs.append( ( attr[1], [ i[1] for i in decode_all(values[1]) ] ) )
+		self.call(msgid, ADD_RESPONSE, controls, 'add_s', dn[1], attrs)
+
+	def delete(self, msgid, content, controls):
+		"""
+		Handles a DelRequest.
+		"""
+		self.call(msgid, DEL_RESPONSE, controls, 'delete_s', content)
+
+	def modrdn(self, msgid, content, controls):
+		"""
+		Handles a ModifyDNRequest.
+		"""
+		items = decode_all(content)
+		newsuperior = None
+		if len(items) > 3:
+			newsuperior = items[3][1]
+		self.call(
+			msgid, MODDN_RESPONSE, controls, 'rename_s',
+			items[0][1], items[1][1], newsuperior,
+			decode_boolean(items[2][1])
+		)
+
+	def extended(self, msgid, content, controls):
+		"""
+		Handles an ExtendedRequest. Only the start and the end of a
+		transaction are supported.
+		"""
+		items = decode_all(content)
+		name = items[0][1]
+		code = SUCCESS
+		message = ''
+		extra = ''
+		try:
+			with self.server.lock:
+				if name == TRANSACTION_START:
+					extra = encode_string(
+						self.server.stubber.start_transaction(),
+						CLASS_CONTEXT | 11
+					)
+				elif name == TRANSACTION_END:
+					commit, identifier = decode_end_transaction(items[1][1])
+					self.server.stubber.end_transaction(identifier, commit)
+				else:
+					code = PROTOCOL_ERROR
+					message = 'Unsupported extended operation'
+		except Exception, e:
+			code, message = self.error_result(e)
+		self.send(msgid, encode_result(EXTENDED_RESPONSE, code, message, extra))
+
+class LdapServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+	"""
+	This class represents the server. Every connection is handled in its own
+	thread, the operations on the stubber are serialized with a lock.
+	"""
+
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, stubber=None, host='127.0.0.1', port=0,
+				 credentials=None):
+		"""
+		Constructor.
+
+		stubber -- the LdapStubber which contains the directory
+		host -- the address the server listens on
+		port -- the port of the server, 0 for a free port
+		credentials -- a dictionary of bind DNs and their passwords. If None
+					   every bind is accepted.
+		"""
+		SocketServer.TCPServer.__init__(
+			self, ( host, port ), LdapRequestHandler
+		)
+		self.stubber = stubber or LdapStubber()
+		self.credentials = credentials
+		self.lock = threading.Lock()
+		self.thread = None
+		self.uri = 'ldap://%s:%d' % self.server_address
+
+	def start(self, poll_interval=0.05):
+		"""
+		Starts serving in a background thread and returns the server.
+
+		poll_interval -- the number of seconds after which stop is noticed
+		"""
+		self.thread = threading.Thread(
+			target=self.serve_forever, args=( poll_interval, )
+		)
+		self.thread.setDaemon(True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		"""
+		Stops the server and closes its socket.
+		"""
+		self.shutdown()
+		self.server_close()
+		self.thread.join()
+
+	def search(self, base, scope, expr, attrlist, serverctrls):
+		"""
+		Searches the stubber and returns the results and the response
+		controls.
+
+		base -- the base of the search
+		scope -- the scope of the search
+		expr -- the LDAP-filter
+		attrlist -- the names of the attributes which should be returned
+		serverctrls -- the request controls
+		"""
+		msgid = self.stubber.search_ext(
+			base, scope, expr, attrlist, serverctrls=serverctrls
+		)
+		rtype, results, msgid, controls = self.stubber.result3(msgid)
+		return ( results, controls )
+
+	def root_dse(self):
+		"""
+		Returns the attributes of the root DSE.
+		"""
+		return self.stubber.root_dse()
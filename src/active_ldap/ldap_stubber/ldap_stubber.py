@@ -1,31 +1,18 @@
 import ldap
+from ldap.controls import SimplePagedResultsControl
+from ldap_filter import compile_filter, And, Equality
+from ldap_dit import DitNode, split_dn, normalize_rdn
+from ber import decode_end_transaction, TRANSACTION_START, TRANSACTION_END
+from ber import TRANSACTION_SPECIFICATION
+from collections import OrderedDict
+import copy
 import re
 
-# Parses ()-expressions
-def parse_expression(string):
-	stack = 0
-	lists = []
-	start = -1
-	for i, elem in enumerate(string):
-		if elem == '(' and stack == 0:
-			start = i
-		if elem == ')' and stack == 1:
-			lists.append(string[start:i+1])
-		if elem == '(':
-			stack = stack + 1
-		if elem == ')':
-			stack = stack - 1
-	return lists
-
-
 class LdapElement(object):
 	"""
 	This class represents an element within the directory
 	"""
 
-	parenthesis = re.compile(r'\(([\||\&])?(.*)\)')
-	nodes = re.compile(r'(\(.*?\))')
-
 	def __init__(self, dn, attrs):
 		"""
 		Constructor.
@@ -33,6 +20,7 @@ class LdapElement(object):
 		dn -- the distinguished name for the element
 		attrs -- a list of tuples which contains the attribute and the value
 		"""
+		self.node = None
 		self.dn = dn
 		self.attributes = []
 		for attr, value in attrs:
@@ -44,6 +32,19 @@ class LdapElement(object):
 	def __repr__(self):
 		return '<LdapStubber %s>' % self.dn
 
+	def _get_dn(self):
+		if self.node is not None:
+			return self.node.dn
+		return self._dn
+
+	def _set_dn(self, dn):
+		self._dn = dn
+
+	dn = property(_get_dn, _set_dn, doc="""
+		The distinguished name of the element. Within a stubber it is taken
+		from the tree, so it follows renames of the parent entries.
+	""")
+
 	def modify(self, attrs):
 		"""
 		Modifies the element
@@ -65,24 +66,34 @@ class LdapElement(object):
 		attr, val = rdn.split('=')
 		if hasattr(self, attr):
 			setattr(self, attr, [ val ])
-		self.dn = re.sub(r'.*?,', "%s," % rdn, self.dn, 1)
+		if self.node is None:
+			self.dn = re.sub(r'.*?,', "%s," % rdn, self.dn, 1)
 
 	def matches(self, filter):
 		"""
-		Returns true if the element matches the given filter
+		Returns true if the element matches the given filter. Raises
+		ldap.FILTER_ERROR if the filter is invalid.
 		
 		filter -- a LDAP-Filter expression
 		"""
-		ops = [ '&', '|' ]
-		match = self.parenthesis.match(filter).groups()
-		op = '&'
-		if match[0]:
-			op = match[0]
-		match = match[1:]
-		rv = self._init_for_op(op)
-		for i in match:
-			rv = self._combine(op, rv, self._handle_element(op, i))
-		return rv
+		return compile_filter(filter).matches(self)
+
+	def values(self, attr):
+		"""
+		Returns the list of values of the given attribute. The name of the
+		attribute is case-insensitive.
+
+		attr -- the name of the attribute
+		"""
+		if attr not in self.attributes:
+			attr = attr.lower()
+			for name in self.attributes:
+				if name.lower() == attr:
+					attr = name
+					break
+			else:
+				return []
+		return getattr(self, attr)
 
 	def has_prefix(self, prefix, scope=ldap.SCOPE_SUBTREE):
 		"""
@@ -91,94 +102,43 @@ class LdapElement(object):
 		prefix -- the ldap-prefix of the object
 		scope -- the scope of the search operation
 		"""
-		if scope == ldap.SCOPE_SUBTREE:
-			return self.dn.endswith(prefix)
-		return re.sub(r'.*?,', '', self.dn, 1) == prefix
+		rdns = [ normalize_rdn(i) for i in split_dn(self.dn) ]
+		prefix = [ normalize_rdn(i) for i in split_dn(prefix) ]
+		if scope == ldap.SCOPE_BASE:
+			return rdns == prefix
+		if scope == ldap.SCOPE_ONELEVEL:
+			return rdns[:-1] == prefix
+		return rdns[:len(prefix)] == prefix
 
-	def to_result(self):
+	def to_result(self, attrlist=None):
 		"""
 		Converts the object back to a ldap-result
+
+		attrlist -- the names of the attributes which should be returned,
+					None or '*' for all
 		"""
-		return ( self.dn, self._result_dict() )
+		return ( self.dn, self._result_dict(attrlist) )
 	
 	###########################################################################
 	# Helper methods
 	###########################################################################
-	def _result_dict(self):
+	def _result_dict(self, attrlist=None):
 		"""
-		Returns all attributes as a dictionary.
+		Returns the attributes as a dictionary.
+
+		attrlist -- the names of the attributes which should be returned,
+					None or '*' for all
 		"""
+		if attrlist is not None and '*' not in attrlist:
+			wanted = set([ i.lower() for i in attrlist ])
+		else:
+			wanted = None
 		dict = {}
 		for attr in self.attributes:
-			dict[attr] = getattr(self, attr)
+			if wanted is None or attr.lower() in wanted:
+				dict[attr] = list(getattr(self, attr))
 		return dict
 
-	def _combine(self, op, val1, val2):
-		"""
-		Combines the given values with the given operator.
-
-		op -- either & or |
-		val1 -- the first boolean value
-		val2 -- the second boolean value
-		"""
-		if op == '&':
-			return val1 and val2
-		if op == '|':
-			return val1 or val2
-
-	def _init_for_op(self, op):
-		"""
-		Returns the initial combination-value for the given operator
-
-		op -- the operator 
-		"""
-		if op == '&': 
-			return True
-		return False
-
-	def _handle_nodes(self, op, match):
-		"""
-		Handles elements like '(attr1=b)(attr2=c)'. It splits those elements up
-		and calls for each filter-element recursively the matches-method.
-
-		op -- the operator
-		match -- the filter expression
-		"""
-		nodes = parse_expression(match)
-		rv = self._init_for_op(op)
-		for node in nodes:
-			rv = self._combine(op, rv, self.matches(node))
-		return rv
-	
-	def _handle_attribute(self, op, match):
-		"""
-		Handles regular filter expressions like attr1=value.
-
-		op -- the operator
-		match -- the filter expression
-		"""
-		try:
-			attr, val = match.split('=')
-			return val in getattr(self, attr)
-		except:
-			return False
-	
-	def _handle_element(self, op, match):
-		"""
-		Handles an filter-expression element like (attr1=value1)(attr2=value2)
-		or attr1=value1.
-		It returns either true or false if the elements are matching or not.
-
-		op -- is the operator which should be used for combining the elements
-		match -- is the filter sub-expression
-		"""
-		# an element like (attr1=b)(attr2=c) is given. Thus we are splitting
-		# those elements up and calling matches recursively
-		if '(' in match:
-			return self._handle_nodes(op, match)
-		# normal handling of elements
-		return self._handle_attribute(op, match)
-	
 	def _add(self, attr, val):
 		"""
 		Adds a new value to the list
@@ -193,6 +153,25 @@ class LdapElement(object):
 		list += val
 		setattr(self, attr, list)
 	
+	def _delete(self, attr, val):
+		"""
+		Deletes the given values from the attribute. If no values are given
+		all values are deleted.
+
+		attr -- the attribute which should be modified
+		val -- the values which should be deleted
+		"""
+		if val == [ None ] or val == []:
+			setattr(self, attr, [])
+			return
+		values = getattr(self, attr, [])
+		for i in val:
+			if i not in values:
+				raise ldap.NO_SUCH_ATTRIBUTE(
+					"No such value %s in attribute %s" % (i, attr)
+				)
+		setattr(self, attr, [ i for i in values if i not in val ])
+
 	def _replace(self, attr, val):
 		"""
 		Replaces the entire values of the given attribute with the new values
@@ -216,17 +195,66 @@ class LdapElement(object):
 	operation_mappings = {
 		ldap.MOD_REPLACE: _replace,
 		ldap.MOD_ADD: _add,
+		ldap.MOD_DELETE: _delete,
 	}
 			
 		
 				
+def transaction_of(serverctrls):
+	"""
+	Returns the identifier of the transaction specification control in the
+	given request controls or None.
+
+	serverctrls -- a list of request controls
+	"""
+	for control in serverctrls or []:
+		if control.controlType == TRANSACTION_SPECIFICATION:
+			return control.encodeControlValue()
+	return None
+
 class LdapStubber(object):
 	"""
-	This class is a helper for stubbing the ldap-object
+	This class is a helper for stubbing the ldap-object. The elements are
+	kept in insertion order and in a tree of their RDNs, which limits
+	searches to their scope. Equality terms on indexed attributes are
+	answered from an index instead of a scan.
 	"""
 
-	def __init__(self):
-		self.elements = []
+	def __init__(self, indexes=()):
+		"""
+		Constructor.
+
+		indexes -- the names of the attributes which should be indexed for
+				   equality filters, e.g. ('uid', 'objectClass')
+		"""
+		self.entries = OrderedDict()
+		self.root = DitNode()
+		self.indexes = {}
+		self.last_position = 0
+		self.pending = {}
+		self.last_msgid = 0
+		self.transactions = {}
+		self.last_transaction = 0
+		for attr in indexes:
+			self.add_index(attr)
+
+	@property
+	def elements(self):
+		"""
+		The list of all elements in insertion order.
+		"""
+		return self.entries.values()
+
+	def add_index(self, attr):
+		"""
+		Adds an equality index for the given attribute.
+
+		attr -- the name of the attribute
+		"""
+		attr = attr.lower()
+		self.indexes[attr] = {}
+		for position, element in self.entries.items():
+			self._index_attribute(attr, position, element)
 
 	def add_s(self, dn, attrs):
 		"""
@@ -235,7 +263,16 @@ class LdapStubber(object):
 		dn -- The DN for the element which should be added
 		attrs -- The attributes which should be added
 		"""
-		self.elements.append(LdapElement(dn, attrs))
+		node = self.root.find_or_create(dn)
+		if node.position is not None:
+			raise ldap.ALREADY_EXISTS("The element %s already exists" % dn)
+		self.last_position += 1
+		element = LdapElement(dn, attrs)
+		element.node = node
+		node.position = self.last_position
+		node.resize(1)
+		self.entries[self.last_position] = element
+		self._index(self.last_position, element)
 	
 	def modify_s(self, dn, attrs):
 		"""
@@ -244,8 +281,13 @@ class LdapStubber(object):
 		dn -- the DN of the object
 		attrs -- The new attributes
 		"""
-		element = self._find_element(dn)
-		element.modify(attrs)
+		position = self._find_position(dn)
+		element = self.entries[position]
+		self._unindex(position, element)
+		try:
+			element.modify(attrs)
+		finally:
+			self._index(position, element)
 	
 	def delete_s(self, dn):
 		"""
@@ -253,7 +295,17 @@ class LdapStubber(object):
 		
 		dn -- the distinguished name of the element which should be deleted
 		"""
-		self.elements.remove(self._find_element(dn))
+		position = self._find_position(dn)
+		element = self.entries[position]
+		if element.node.children:
+			raise ldap.NOT_ALLOWED_ON_NONLEAF(
+				"The element %s has children" % dn
+			)
+		self._unindex(position, self.entries.pop(position))
+		element.node.position = None
+		element.node.resize(-1)
+		element.node.prune()
+		element.node = None
 
 	def modrdn_s(self, dn, rdn, flag):
 		"""
@@ -263,26 +315,373 @@ class LdapStubber(object):
 		rdn -- the new RDN of the element
 		flag -- True if the old element should be destroyed
 		"""
-		if flag == False:
+		self.rename_s(dn, rdn, None, flag)
+
+	def rename_s(self, dn, newrdn, newsuperior=None, delold=1):
+		"""
+		Renames the element and moves it below a new parent. The subtree of
+		the element is moved along without touching its entries.
+
+		dn -- the full distinguished name of the element
+		newrdn -- the new RDN of the element
+		newsuperior -- the DN of the new parent, None to keep the parent
+		delold -- True if the old RDN value should be removed
+		"""
+		if delold == False:
 			raise RuntimeError("Operation not supported")
-		element = self._find_element(dn)
-		element.modrdn(rdn)
+		position = self._find_position(dn)
+		element = self.entries[position]
+		node = element.node
+		parent = node.parent
+		if newsuperior is not None:
+			parent = self.root.find(newsuperior)
+			if parent is None:
+				raise ldap.NO_SUCH_OBJECT(
+					"No such element with the dn: %s" % newsuperior
+				)
+			if parent.is_below(node):
+				raise ldap.UNWILLING_TO_PERFORM(
+					"%s can't be moved below itself" % dn
+				)
+		existing = parent.children.get(normalize_rdn(newrdn))
+		if existing is not None and existing is not node:
+			raise ldap.ALREADY_EXISTS(
+				"The element %s,%s already exists" % (newrdn, parent.dn)
+			)
+		self._unindex(position, element)
+		old_parent = node.detach()
+		node.attach(parent, newrdn)
+		old_parent.prune()
+		element.modrdn(newrdn)
+		self._index(position, element)
 	
-	def search_s(self, prefix, scope, expr):
-		result = filter(lambda i: i.has_prefix(prefix, scope), self.elements)
-		result = filter(lambda i: i.matches(expr), result)
-		return map(lambda i: i.to_result(), result)
+	def search_s(self, prefix, scope, expr, attrlist=None, attrsonly=0):
+		"""
+		Searches the directory. The filter is compiled only once for all
+		elements.
+
+		prefix -- the base of the search
+		scope -- the scope of the search
+		expr -- the LDAP-filter
+		attrlist -- the names of the attributes which should be returned
+		"""
+		if prefix == '' and scope == ldap.SCOPE_BASE:
+			return [ ( '', self.root_dse() ) ]
+		base = self.root.find(prefix)
+		if base is None:
+			return []
+		node = compile_filter(expr)
+		return [
+			i.to_result(attrlist) for i in self._candidates(node, base, scope)
+			if node.matches(i)
+		]
+
+	def search_ext(self, prefix, scope, expr, attrlist=None, attrsonly=0,
+				   serverctrls=None, clientctrls=None, timeout=-1,
+				   sizelimit=0):
+		"""
+		Starts an asynchronous search and returns the message id for result3.
+		If a simple paged results control is given only the requested page is
+		returned. The cookie of the response control is the offset of the
+		next page.
+
+		prefix -- the base of the search
+		scope -- the scope of the search
+		expr -- the LDAP-filter
+		attrlist -- the names of the attributes which should be returned
+		serverctrls -- a list of request controls
+		"""
+		results = self.search_s(prefix, scope, expr, attrlist)
+		controls = []
+		for control in serverctrls or []:
+			if control.controlType != SimplePagedResultsControl.controlType:
+				continue
+			offset = int(control.cookie or 0)
+			end = offset + control.size
+			cookie = ''
+			if end < len(results):
+				cookie = str(end)
+			results = results[offset:end]
+			controls.append(SimplePagedResultsControl(
+				control.criticality, size=len(results), cookie=cookie
+			))
+		return self._queue_result(ldap.RES_SEARCH_RESULT, results, controls)
+
+	def add_ext(self, dn, attrs, serverctrls=None, clientctrls=None):
+		"""
+		Starts an asynchronous addition and returns the message id for
+		result3, which raises the error of the addition if it failed.
+
+		dn -- the DN for the element which should be added
+		attrs -- the attributes which should be added
+		serverctrls -- a list of request controls
+		"""
+		return self._update(
+			ldap.RES_ADD, serverctrls, 'add_s', dn, attrs
+		)
+
+	def modify_ext(self, dn, attrs, serverctrls=None, clientctrls=None):
+		"""
+		Starts an asynchronous modification and returns the message id for
+		result3, which raises the error of the modification if it failed.
+
+		dn -- the DN of the object
+		attrs -- The new attributes
+		serverctrls -- a list of request controls
+		"""
+		return self._update(
+			ldap.RES_MODIFY, serverctrls, 'modify_s', dn, attrs
+		)
+
+	def delete_ext(self, dn, serverctrls=None, clientctrls=None):
+		"""
+		Starts an asynchronous deletion and returns the message id for
+		result3, which raises the error of the deletion if it failed.
+
+		dn -- the DN of the element which should be deleted
+		serverctrls -- a list of request controls
+		"""
+		return self._update(ldap.RES_DELETE, serverctrls, 'delete_s', dn)
+
+	def rename(self, dn, newrdn, newsuperior=None, delold=1,
+			   serverctrls=None, clientctrls=None):
+		"""
+		Starts an asynchronous rename and returns the message id for result3,
+		which raises the error of the rename if it failed.
+
+		dn -- the full distinguished name of the element
+		newrdn -- the new RDN of the element
+		newsuperior -- the DN of the new parent, None to keep the parent
+		delold -- True if the old RDN value should be removed
+		serverctrls -- a list of request controls
+		"""
+		return self._update(
+			ldap.RES_MODRDN, serverctrls, 'rename_s',
+			dn, newrdn, newsuperior, delold
+		)
+
+	def extop_s(self, extreq, serverctrls=None, clientctrls=None,
+				extop_resp_class=None):
+		"""
+		Runs an extended operation and returns the tuple (response_name,
+		response_value). Only the start and the end of a transaction are
+		supported.
+
+		extreq -- the ldap.extop.ExtendedRequest
+		"""
+		if extreq.requestName == TRANSACTION_START:
+			return ( None, self.start_transaction() )
+		if extreq.requestName == TRANSACTION_END:
+			commit, identifier = decode_end_transaction(
+				extreq.encodedRequestValue()
+			)
+			self.end_transaction(identifier, commit)
+			return ( None, None )
+		raise ldap.PROTOCOL_ERROR(
+			"Unsupported extended operation %s" % extreq.requestName
+		)
+
+	def start_transaction(self):
+		"""
+		Starts a transaction and returns its identifier. Updates with the
+		transaction specification control are collected until the
+		transaction is ended.
+		"""
+		self.last_transaction += 1
+		identifier = str(self.last_transaction)
+		self.transactions[identifier] = []
+		return identifier
+
+	def add_to_transaction(self, identifier, method, *args):
+		"""
+		Adds an update to the given transaction.
+
+		identifier -- the identifier of the transaction
+		method -- the name of the synchronous method, e.g. 'modify_s'
+		args -- the arguments of the method
+		"""
+		if identifier not in self.transactions:
+			raise ldap.UNWILLING_TO_PERFORM(
+				"No such transaction: %s" % identifier
+			)
+		self.transactions[identifier].append( ( method, args ) )
+
+	def end_transaction(self, identifier, commit=True):
+		"""
+		Ends the given transaction. Its updates are applied all together or,
+		if one of them fails, not at all and the error is raised.
+
+		identifier -- the identifier of the transaction
+		commit -- False if the updates should be discarded
+		"""
+		if identifier not in self.transactions:
+			raise ldap.UNWILLING_TO_PERFORM(
+				"No such transaction: %s" % identifier
+			)
+		updates = self.transactions.pop(identifier)
+		if not commit:
+			return
+		state = copy.deepcopy(
+			( self.entries, self.root, self.indexes, self.last_position )
+		)
+		try:
+			for method, args in updates:
+				getattr(self, method)(*args)
+		except Exception:
+			self.entries, self.root, self.indexes, self.last_position = state
+			raise
+
+	def root_dse(self):
+		"""
+		Returns the attributes of the root DSE.
+		"""
+		return {
+			'supportedLDAPVersion': [ '3' ],
+			'supportedControl': [
+				SimplePagedResultsControl.controlType,
+				TRANSACTION_SPECIFICATION,
+			],
+			'supportedExtension': [ TRANSACTION_START, TRANSACTION_END ],
+			'namingContexts': [ i.dn for i in self.root.children.values() ],
+		}
+
+	def result3(self, msgid=ldap.RES_ANY, all=1, timeout=None):
+		"""
+		Returns the result of an asynchronous operation in the form
+		(result_type, data, msgid, controls).
+
+		msgid -- the message id of the operation
+		"""
+		if msgid == ldap.RES_ANY and self.pending:
+			msgid = min(self.pending)
+		if msgid not in self.pending:
+			raise RuntimeError("No such message id: %s" % msgid)
+		rtype, data, controls = self.pending.pop(msgid)
+		if isinstance(data, ldap.LDAPError):
+			raise data
+		return ( rtype, data, msgid, controls )
 	###########################################################################
 	# Helper methods
 	###########################################################################
 	def _find_element(self, dn):
 		"""
 		Finds the element with the given DN and returns it. If no element was
-		found or more than one element was found an Exception is risen.
+		found an Exception is risen.
 		
 		dn -- the DN of the element
 		"""
-		results = filter(lambda i: i.dn == dn, self.elements)
-		if len(results) != 1:
+		return self.entries[self._find_position(dn)]
+
+	def _find_position(self, dn):
+		"""
+		Returns the position of the element with the given DN.
+
+		dn -- the DN of the element
+		"""
+		node = self.root.find(dn)
+		if node is None or node.position is None:
 			raise RuntimeError("No such element with the dn: %s" % dn)
-		return results[0]
+		return node.position
+
+	def _candidates(self, node, base, scope):
+		"""
+		Returns the elements within the scope of the search which might
+		match the given compiled filter in insertion order. If the filter is
+		an indexed equality term or a conjunction containing one and the
+		index entry is smaller than the searched subtree, only the elements
+		of the smallest index entry are checked.
+
+		node -- the compiled filter
+		base -- the node of the search base
+		scope -- the scope of the search
+		"""
+		terms = [ node ]
+		if isinstance(node, And):
+			terms = node.children
+		best = None
+		for term in terms:
+			if not isinstance(term, Equality):
+				continue
+			index = self.indexes.get(term.attr.lower())
+			if index is None:
+				continue
+			positions = index.get(term.value, ())
+			if best is None or len(positions) < len(best):
+				best = positions
+		if best is not None and len(best) < base.size:
+			elements = [ self.entries[i] for i in sorted(best) ]
+			return [ i for i in elements if i.node.in_scope(base, scope) ]
+		if scope == ldap.SCOPE_SUBTREE and base.size == len(self.entries):
+			return self.entries.values()
+		return [ self.entries[i] for i in sorted(base.positions(scope)) ]
+
+	def _index(self, position, element):
+		"""
+		Adds the element to all indexes.
+
+		position -- the position of the element
+		element -- the element
+		"""
+		for attr in self.indexes:
+			self._index_attribute(attr, position, element)
+
+	def _index_attribute(self, attr, position, element):
+		"""
+		Adds the values of the given attribute of the element to its index.
+
+		attr -- the lower-case name of the indexed attribute
+		position -- the position of the element
+		element -- the element
+		"""
+		index = self.indexes[attr]
+		for value in element.values(attr):
+			index.setdefault(value, set()).add(position)
+
+	def _unindex(self, position, element):
+		"""
+		Removes the element from all indexes.
+
+		position -- the position of the element
+		element -- the element
+		"""
+		for attr, index in self.indexes.items():
+			for value in element.values(attr):
+				positions = index.get(value)
+				if positions is None:
+					continue
+				positions.discard(position)
+				if not positions:
+					del index[value]
+
+	def _update(self, rtype, serverctrls, method, *args):
+		"""
+		Runs the given update, or adds it to the transaction of the request
+		controls, and queues its result.
+
+		rtype -- the result type, e.g. ldap.RES_MODIFY
+		serverctrls -- a list of request controls
+		method -- the name of the synchronous method, e.g. 'modify_s'
+		args -- the arguments of the method
+		"""
+		identifier = transaction_of(serverctrls)
+		try:
+			if identifier is None:
+				getattr(self, method)(*args)
+			else:
+				self.add_to_transaction(identifier, method, *args)
+		except ldap.LDAPError, error:
+			return self._queue_result(rtype, error)
+		return self._queue_result(rtype, [])
+
+	def _queue_result(self, rtype, data, controls=None):
+		"""
+		Stores the result of an asynchronous operation and returns its new
+		message id.
+
+		rtype -- the result type, e.g. ldap.RES_SEARCH_RESULT
+		data -- the result data
+		controls -- the response controls
+		"""
+		self.last_msgid += 1
+		self.pending[self.last_msgid] = ( rtype, data, controls or [] )
+		return self.last_msgid
@@ -1,5 +1,7 @@
 from test_ldap_element import *
 from test_ldap_stubber import *
+from test_ldap_filter import *
+from test_ldap_server import *
 import unittest
 
 if __name__ == '__main__':
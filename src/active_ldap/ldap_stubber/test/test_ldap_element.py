@@ -4,6 +4,7 @@ import sys
 import os
 dir = os.path.abspath(os.path.dirname(__file__)) + '/..'
 sys.path.insert(0, dir)
+sys.path.insert(1, dir + '/..')
 
 from ldap_stubber import LdapElement
 import ldap
@@ -58,6 +59,21 @@ class LdapElementModification(unittest.TestCase):
 	def test_should_add_elements_to_attr2(self):
 		self.assertEqual(self.element.attr2, [ 'val2', 'val7' ])
 
+class LdapElementDeletion(unittest.TestCase):
+	def setUp(self):
+		self.element = new_ldap_element(attrs={ 'attr1': ['val1', 'val2'] })
+
+	def test_should_delete_the_given_values(self):
+		self.element.modify([ ( ldap.MOD_DELETE, 'attr1', [ 'val1' ] ) ])
+		self.assertEqual(self.element.attr1, [ 'val2' ])
+	def test_should_delete_all_values_without_values(self):
+		self.element.modify([ ( ldap.MOD_DELETE, 'attr1', None ) ])
+		self.assertEqual(self.element.attr1, [])
+	def test_should_raise_on_missing_values(self):
+		self.assertRaises(ldap.NO_SUCH_ATTRIBUTE, self.element.modify, [
+			( ldap.MOD_DELETE, 'attr1', [ 'val3' ] )
+		])
+
 class LdapElementRename(unittest.TestCase):
 	def setUp(self):
 		self.element = new_ldap_element()
@@ -75,11 +91,11 @@ class LdapElementPrefixCheck(unittest.TestCase):
 		)
 		self.wrong_subtree = self.element.has_prefix('wrong=base')
 		self.lestwo_subtree = self.element.has_prefix('o=lestwo')
-		self.schule_lestwo_base = self.element.has_prefix(
-			'ou=schule,o=lestwo', ldap.SCOPE_BASE
+		self.schule_lestwo_onelevel = self.element.has_prefix(
+			'ou=schule,o=lestwo', ldap.SCOPE_ONELEVEL
 		)
-		self.lestwo_base = self.element.has_prefix(
-			'o=lestwo', ldap.SCOPE_BASE
+		self.lestwo_onelevel = self.element.has_prefix(
+			'o=lestwo', ldap.SCOPE_ONELEVEL
 		)
 
 	def test_should_return_true_on_right_subtree(self):
@@ -87,10 +103,21 @@ class LdapElementPrefixCheck(unittest.TestCase):
 		self.assertEqual(self.lestwo_subtree, True)
 	def test_should_return_false_on_wrong_subtree(self):
 		self.assertEqual(self.wrong_subtree, False)
-	def test_should_return_true_on_right_base(self):
-		self.assertEqual(self.schule_lestwo_base, True)
-	def test_should_return_false_on_wrong_base(self):
-		self.assertEqual(self.lestwo_base, False)
+	def test_should_return_true_on_right_onelevel(self):
+		self.assertEqual(self.schule_lestwo_onelevel, True)
+	def test_should_return_false_on_wrong_onelevel(self):
+		self.assertEqual(self.lestwo_onelevel, False)
+	def test_should_only_compare_whole_rdns(self):
+		self.assertFalse(self.element.has_prefix('ou=oberschule,o=lestwo'))
+	def test_should_ignore_case_and_spaces(self):
+		self.assertTrue(self.element.has_prefix('OU=Schule, o=lestwo'))
+	def test_should_match_the_own_dn_with_base_scope(self):
+		self.assertTrue(self.element.has_prefix(
+			'cn=item,ou=schule,o=lestwo', ldap.SCOPE_BASE
+		))
+		self.assertFalse(self.element.has_prefix(
+			'ou=schule,o=lestwo', ldap.SCOPE_BASE
+		))
 
 class ConversionToResult(unittest.TestCase):
 	def setUp(self):
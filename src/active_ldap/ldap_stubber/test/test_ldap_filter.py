@@ -0,0 +1,92 @@
+import unittest
+
+import sys
+import os
+dir = os.path.abspath(os.path.dirname(__file__)) + '/..'
+sys.path.insert(0, dir)
+sys.path.insert(1, dir + '/..')
+
+from ldap_filter import compile_filter
+from test_ldap_element import new_ldap_element
+import ldap
+
+class NegationFilter(unittest.TestCase):
+	def setUp(self):
+		self.element = new_ldap_element()
+	def test_should_match_if_the_filter_doesnt_match(self):
+		self.assertTrue(self.element.matches('(!(attr1=val2))'))
+	def test_should_not_match_if_the_filter_matches(self):
+		self.assertFalse(self.element.matches('(!(attr1=val1))'))
+	def test_should_be_combinable(self):
+		self.assertTrue(self.element.matches('(&(cn=item)(!(|(a=b)(c=d))))'))
+
+class PresenceFilter(unittest.TestCase):
+	def setUp(self):
+		self.element = new_ldap_element()
+	def test_should_match_existing_attributes(self):
+		self.assertTrue(self.element.matches('(attr1=*)'))
+	def test_should_not_match_missing_attributes(self):
+		self.assertFalse(self.element.matches('(attr9=*)'))
+	def test_should_ignore_the_case_of_the_attribute(self):
+		self.assertTrue(self.element.matches('(ATTR1=*)'))
+
+class SubstringsFilter(unittest.TestCase):
+	def setUp(self):
+		self.element = new_ldap_element(attrs={ 'cn': 'john smith' })
+	def test_should_match_the_initial_part(self):
+		self.assertTrue(self.element.matches('(cn=john*)'))
+		self.assertFalse(self.element.matches('(cn=smith*)'))
+	def test_should_match_the_final_part(self):
+		self.assertTrue(self.element.matches('(cn=*smith)'))
+		self.assertFalse(self.element.matches('(cn=*john)'))
+	def test_should_match_parts_in_order(self):
+		self.assertTrue(self.element.matches('(cn=j*n*s*h)'))
+		self.assertFalse(self.element.matches('(cn=*smith*john*)'))
+	def test_should_not_overlap_initial_and_final_part(self):
+		self.assertFalse(self.element.matches('(cn=john s*n smith)'))
+
+class OrderingFilter(unittest.TestCase):
+	def setUp(self):
+		self.element = new_ldap_element(attrs={ 'uidNumber': '150' })
+	def test_should_compare_numbers(self):
+		self.assertTrue(self.element.matches('(uidNumber>=99)'))
+		self.assertFalse(self.element.matches('(uidNumber<=99)'))
+	def test_should_include_equal_values(self):
+		self.assertTrue(self.element.matches('(uidNumber<=150)'))
+	def test_should_compare_strings(self):
+		self.assertTrue(self.element.matches('(attr1>=val0)'))
+		self.assertFalse(self.element.matches('(attr1>=val2)'))
+
+class ApproximateFilter(unittest.TestCase):
+	def setUp(self):
+		self.element = new_ldap_element(attrs={ 'cn': 'John Smith' })
+	def test_should_ignore_case_and_whitespace(self):
+		self.assertTrue(self.element.matches('(cn~=johnsmith)'))
+	def test_should_not_match_other_values(self):
+		self.assertFalse(self.element.matches('(cn~=jane smith)'))
+
+class EscapedValues(unittest.TestCase):
+	def setUp(self):
+		self.element = new_ldap_element(attrs={ 'cn': 'a*(b)\\c' })
+	def test_should_match_the_unescaped_value(self):
+		self.assertTrue(self.element.matches('(cn=a\\2a\\28b\\29\\5cc)'))
+	def test_should_use_escaped_asterisks_in_substrings(self):
+		self.assertTrue(self.element.matches('(cn=a\\2a*)'))
+		self.assertFalse(self.element.matches('(cn=a\\2ab*)'))
+
+class InvalidFilters(unittest.TestCase):
+	def test_should_raise_a_filter_error(self):
+		for text in [ 'attr1=val1', '(attr1=val1', '(attr1)', '(&(a=b)',
+					  '(a=b))', '(a=\\4)', '(a=\\zz)', '(a=(b)', '(a>=b*)' ]:
+			self.assertRaises(ldap.FILTER_ERROR, compile_filter, text)
+
+class CompiledFilters(unittest.TestCase):
+	def test_should_be_cached_by_their_text(self):
+		text = '(&(attr1=val1)(attr2=val2))'
+		self.assertTrue(compile_filter(text) is compile_filter(text))
+
+	def test_should_treat_an_empty_and_as_true(self):
+		self.assertTrue(new_ldap_element().matches('(&)'))
+
+if __name__ == '__main__':
+	unittest.main()
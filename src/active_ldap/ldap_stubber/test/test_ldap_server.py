@@ -0,0 +1,344 @@
+import unittest
+
+import sys
+import os
+dir = os.path.abspath(os.path.dirname(__file__)) + '/..'
+sys.path.insert(0, dir)
+sys.path.insert(1, dir + '/..')
+
+import socket
+from ldap_server import LdapServer, encode_message, encode_control
+from ldap_server import decode_controls, filter_to_string
+from ldap_server import BIND_REQUEST, UNBIND_REQUEST, SEARCH_REQUEST
+from ldap_server import SEARCH_RESULT_ENTRY, MODIFY_REQUEST, ADD_REQUEST
+from ldap_server import DEL_REQUEST, MODDN_REQUEST, EXTENDED_REQUEST
+from ldap_server import SUCCESS, NO_SUCH_OBJECT, ALREADY_EXISTS
+from ldap_server import INVALID_CREDENTIALS, UNAVAILABLE_CRITICAL_EXTENSION
+from ber import CLASS_CONTEXT, CONSTRUCTED, ENUMERATED, SET
+from ber import encode_integer, encode_string, encode_boolean, encode_sequence
+from ber import decode, decode_all, decode_integer, read_element
+from ber import TRANSACTION_START, TRANSACTION_SPECIFICATION, TRANSACTION_END
+from ldap_stubber import LdapStubber
+from test_ldap_stubber import new_element
+from ldap.controls import SimplePagedResultsControl
+import ldap
+
+try:
+	import _ldap
+	python_ldap = True
+except ImportError:
+	python_ldap = False
+
+def equality_filter(attr, value):
+	return encode_sequence([
+		encode_string(attr), encode_string(value)
+	], CLASS_CONTEXT | CONSTRUCTED | 3)
+
+def present_filter(attr):
+	return encode_string(attr, CLASS_CONTEXT | 7)
+
+def search_request(base, scope, filter, attrs=()):
+	return encode_sequence([
+		encode_string(base),
+		encode_integer(scope, ENUMERATED),
+		encode_integer(0, ENUMERATED),
+		encode_integer(0),
+		encode_integer(0),
+		encode_boolean(False),
+		filter,
+		encode_sequence(map(encode_string, attrs)),
+	], SEARCH_REQUEST)
+
+def paged_control(size, cookie=''):
+	return encode_control(
+		SimplePagedResultsControl.controlType,
+		encode_sequence([ encode_integer(size), encode_string(cookie) ]),
+		True
+	)
+
+class RawClient(object):
+	"""
+	This class sends encoded requests to the server and decodes the
+	responses.
+	"""
+	def __init__(self, server):
+		self.socket = socket.create_connection(server.server_address)
+		self.stream = self.socket.makefile('rb')
+		self.msgid = 0
+
+	def request(self, operation, controls=()):
+		self.msgid += 1
+		self.socket.sendall(encode_message(self.msgid, operation, controls))
+		responses = []
+		while True:
+			tag, content = read_element(self.stream)
+			items = decode_all(content)
+			self.last_msgid = decode_integer(items[0][1])
+			responses.append(items)
+			if items[1][0] != SEARCH_RESULT_ENTRY:
+				return responses
+
+	def result_code(self, operation, controls=()):
+		response = self.request(operation, controls)[-1]
+		return decode_integer(decode_all(response[1][1])[0][1])
+
+	def search(self, *args, **kwds):
+		responses = self.request(search_request(*args), kwds.get('controls'))
+		entries = []
+		for items in responses[:-1]:
+			dn, attributes = decode_all(items[1][1])
+			attrs = {}
+			for tag, attribute in decode_all(attributes[1]):
+				attr, values = decode_all(attribute)
+				attrs[attr[1]] = [ i[1] for i in decode_all(values[1]) ]
+			entries.append( ( dn[1], attrs ) )
+		return entries, responses[-1]
+
+	def close(self):
+		self.socket.sendall(encode_message(
+			self.msgid + 1, encode_string('', UNBIND_REQUEST)
+		))
+		self.stream.close()
+		self.socket.close()
+
+class BerEncoding(unittest.TestCase):
+	def test_should_encode_integers_in_twos_complement(self):
+		self.assertEqual(encode_integer(0), '\x02\x01\x00')
+		self.assertEqual(encode_integer(128), '\x02\x02\x00\x80')
+		self.assertEqual(encode_integer(-1), '\x02\x01\xff')
+	def test_should_decode_the_encoded_integers(self):
+		for i in [ 0, 1, 127, 128, 255, 256, 65535, -1, -128, -129 ]:
+			self.assertEqual(decode_integer(decode(encode_integer(i))[1]), i)
+	def test_should_use_the_long_form_for_long_contents(self):
+		data = encode_string('a' * 300)
+		self.assertEqual(data[:4], '\x04\x82\x01\x2c')
+		self.assertEqual(decode(data)[1], 'a' * 300)
+	def test_should_raise_on_truncated_elements(self):
+		self.assertRaises(ldap.PROTOCOL_ERROR, decode, '\x04\x05abc')
+
+class FilterConversion(unittest.TestCase):
+	def convert(self, data):
+		tag, content, offset = decode(data)
+		return filter_to_string(tag, content)
+
+	def test_should_convert_and_or_not(self):
+		self.assertEqual(self.convert(encode_sequence([
+			equality_filter('a', 'b'),
+			encode_sequence([ present_filter('c') ], CLASS_CONTEXT | 0x22),
+		], CLASS_CONTEXT | CONSTRUCTED | 0)), '(&(a=b)(!(c=*)))')
+
+	def test_should_escape_values(self):
+		self.assertEqual(
+			self.convert(equality_filter('cn', 'a*(b)')), '(cn=a\\2a\\28b\\29)'
+		)
+
+	def test_should_convert_substrings(self):
+		self.assertEqual(self.convert(encode_sequence([
+			encode_string('cn'),
+			encode_sequence([
+				encode_string('jo', CLASS_CONTEXT | 0),
+				encode_string('h', CLASS_CONTEXT | 1),
+				encode_string('th', CLASS_CONTEXT | 2),
+			]),
+		], CLASS_CONTEXT | CONSTRUCTED | 4)), '(cn=jo*h*th)')
+
+class AServerWithAStubber(unittest.TestCase):
+	def setUp(self):
+		self.stubber = LdapStubber()
+		for i in range(5):
+			self.stubber.add_s('cn=item%d,o=lestwo' % i, new_element({
+				'cn': 'item%d' % i
+			}))
+		self.server = LdapServer(
+			self.stubber, credentials={ 'cn=admin': 'secret' }
+		).start()
+		self.client = RawClient(self.server)
+
+	def tearDown(self):
+		self.client.close()
+		self.server.stop()
+
+	def bind(self, dn, password):
+		return self.client.result_code(encode_sequence([
+			encode_integer(3),
+			encode_string(dn),
+			encode_string(password, CLASS_CONTEXT | 0),
+		], BIND_REQUEST))
+
+	def test_should_accept_valid_credentials(self):
+		self.assertEqual(self.bind('cn=admin', 'secret'), SUCCESS)
+	def test_should_refuse_invalid_credentials(self):
+		self.assertEqual(self.bind('cn=admin', 'wrong'), INVALID_CREDENTIALS)
+
+	def test_should_return_the_matching_entries(self):
+		entries, done = self.client.search(
+			'o=lestwo', ldap.SCOPE_SUBTREE,
+			equality_filter('cn', 'item2'), [ 'cn' ]
+		)
+		self.assertEqual(entries, [ ( 'cn=item2,o=lestwo', {
+			'cn': [ 'item2' ]
+		}) ])
+		self.assertEqual(self.client.last_msgid, self.client.msgid)
+
+	def test_should_return_pages_with_the_paged_results_control(self):
+		cookie = ''
+		pages = []
+		while True:
+			entries, done = self.client.search(
+				'o=lestwo', ldap.SCOPE_SUBTREE, present_filter('cn'),
+				controls=[ paged_control(2, cookie) ]
+			)
+			pages.append(len(entries))
+			control = decode_controls(done[2][1])[0]
+			size, cookie = decode_all(decode(control[2])[1])
+			cookie = cookie[1]
+			if not cookie:
+				break
+		self.assertEqual(pages, [ 2, 2, 1 ])
+
+	def test_should_answer_the_root_dse(self):
+		entries, done = self.client.search(
+			'', ldap.SCOPE_BASE, present_filter('objectClass')
+		)
+		self.assertEqual(entries[0][1]['namingContexts'], [ 'o=lestwo' ])
+
+	def test_should_add_modify_rename_and_delete_entries(self):
+		self.assertEqual(self.client.result_code(encode_sequence([
+			encode_string('cn=new,o=lestwo'),
+			encode_sequence([ encode_sequence([
+				encode_string('cn'),
+				encode_sequence([ encode_string('new') ], SET),
+			]) ]),
+		], ADD_REQUEST)), SUCCESS)
+		self.assertEqual(self.client.result_code(encode_sequence([
+			encode_string('cn=new,o=lestwo'),
+			encode_sequence([ encode_sequence([
+				encode_integer(ldap.MOD_REPLACE, ENUMERATED),
+				encode_sequence([
+					encode_string('mail'),
+					encode_sequence([ encode_string('a@example.com') ], SET),
+				]),
+			]) ]),
+		], MODIFY_REQUEST)), SUCCESS)
+		self.assertEqual(self.client.result_code(encode_sequence([
+			encode_string('cn=new,o=lestwo'),
+			encode_string('cn=newer'),
+			encode_boolean(True),
+		], MODDN_REQUEST)), SUCCESS)
+		self.assertEqual(
+			self.stubber._find_element('cn=newer,o=lestwo').mail,
+			[ 'a@example.com' ]
+		)
+		self.assertEqual(self.client.result_code(
+			encode_string('cn=newer,o=lestwo', DEL_REQUEST)
+		), SUCCESS)
+		self.assertEqual(len(self.stubber.elements), 5)
+
+	def test_should_apply_the_updates_of_a_transaction_on_commit(self):
+		response = self.client.request(encode_sequence([
+			encode_string(TRANSACTION_START, CLASS_CONTEXT | 0),
+		], EXTENDED_REQUEST))[-1]
+		identifier = decode_all(response[1][1])[3][1]
+		self.assertEqual(self.client.result_code(
+			encode_string('cn=item1,o=lestwo', DEL_REQUEST),
+			[ encode_control(TRANSACTION_SPECIFICATION, identifier, True) ]
+		), SUCCESS)
+		self.assertEqual(len(self.stubber.elements), 5)
+		self.assertEqual(self.client.result_code(encode_sequence([
+			encode_string(TRANSACTION_END, CLASS_CONTEXT | 0),
+			encode_string(
+				encode_sequence([ encode_string(identifier) ]),
+				CLASS_CONTEXT | 1
+			),
+		], EXTENDED_REQUEST)), SUCCESS)
+		self.assertEqual(len(self.stubber.elements), 4)
+
+	def test_should_map_errors_to_result_codes(self):
+		self.assertEqual(self.client.result_code(
+			encode_string('cn=unknown,o=lestwo', DEL_REQUEST)
+		), NO_SUCH_OBJECT)
+		self.assertEqual(self.client.result_code(encode_sequence([
+			encode_string('cn=item1,o=lestwo'),
+			encode_sequence([]),
+		], ADD_REQUEST)), ALREADY_EXISTS)
+
+	def test_should_refuse_unknown_critical_controls(self):
+		entries, done = self.client.search(
+			'o=lestwo', ldap.SCOPE_SUBTREE, present_filter('cn'),
+			controls=[ encode_control('1.2.3.4', None, True) ]
+		)
+		self.assertEqual(
+			decode_integer(decode_all(done[1][1])[0][1]),
+			UNAVAILABLE_CRITICAL_EXTENSION
+		)
+
+@unittest.skipUnless(python_ldap, 'python-ldap is not installed')
+class AServerWithAPythonLdapClient(unittest.TestCase):
+	def setUp(self):
+		self.stubber = LdapStubber()
+		for i in range(5):
+			self.stubber.add_s('cn=item%d,o=lestwo' % i, new_element({
+				'cn': 'item%d' % i
+			}))
+		self.server = LdapServer(
+			self.stubber, credentials={ 'cn=admin': 'secret' }
+		).start()
+		self.connection = ldap.initialize(self.server.uri)
+		self.connection.simple_bind_s('cn=admin', 'secret')
+
+	def tearDown(self):
+		self.connection.unbind_s()
+		self.server.stop()
+
+	def test_should_refuse_invalid_credentials(self):
+		connection = ldap.initialize(self.server.uri)
+		self.assertRaises(
+			ldap.INVALID_CREDENTIALS,
+			connection.simple_bind_s, 'cn=admin', 'wrong'
+		)
+
+	def test_should_return_pages_with_the_paged_results_control(self):
+		control = SimplePagedResultsControl(True, size=2, cookie='')
+		pages = []
+		while True:
+			msgid = self.connection.search_ext(
+				'o=lestwo', ldap.SCOPE_SUBTREE, '(cn=*)', [ 'cn' ],
+				serverctrls=[ control ]
+			)
+			rtype, results, rmsgid, controls = self.connection.result3(msgid)
+			pages.append([ dn for dn, attrs in results ])
+			control.cookie = [
+				i for i in controls
+				if i.controlType == SimplePagedResultsControl.controlType
+			][0].cookie
+			if not control.cookie:
+				break
+		self.assertEqual([ len(i) for i in pages ], [ 2, 2, 1 ])
+		self.assertEqual(
+			sorted(sum(pages, [])),
+			[ 'cn=item%d,o=lestwo' % i for i in range(5) ]
+		)
+
+	def test_should_add_modify_rename_and_delete_entries(self):
+		self.connection.add_s('cn=new,o=lestwo', new_element({ 'cn': 'new' }))
+		self.connection.modify_s('cn=new,o=lestwo', [
+			( ldap.MOD_REPLACE, 'attr1', [ 'changed' ] )
+		])
+		self.connection.modrdn_s('cn=new,o=lestwo', 'cn=renamed', True)
+		self.assertEqual(
+			self.connection.search_s(
+				'o=lestwo', ldap.SCOPE_SUBTREE, '(cn=renamed)', [ 'attr1' ]
+			),
+			[ ( 'cn=renamed,o=lestwo', { 'attr1': [ 'changed' ] } ) ]
+		)
+		self.connection.delete_s('cn=renamed,o=lestwo')
+		self.assertEqual(len(self.stubber.elements), 5)
+
+	def test_should_raise_the_errors_of_the_stubber(self):
+		self.assertRaises(
+			ldap.NO_SUCH_OBJECT,
+			self.connection.delete_s, 'cn=unknown,o=lestwo'
+		)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -4,9 +4,14 @@ import sys
 import os
 dir = os.path.abspath(os.path.dirname(__file__)) + '/..'
 sys.path.insert(0, dir)
+sys.path.insert(1, dir + '/..')
 
 from ldap_stubber import LdapStubber
+from ber import encode_end_transaction, TRANSACTION_SPECIFICATION
+from ber import TRANSACTION_START, TRANSACTION_END
 from test_ldap_element import convert_dict
+from ldap.controls import SimplePagedResultsControl, RequestControl
+from ldap.extop import ExtendedRequest
 import ldap
 
 def new_ldap_stubber():
@@ -36,6 +41,11 @@ class AddingElements(unittest.TestCase):
 		self.assertEqual(self.stubber.elements[0].attr1, [ 'val1' ])
 	def test_should_have_a_dn(self):
 		self.assertEqual(self.stubber.elements[0].dn, 'ou=schule,o=lestwo')
+	def test_should_raise_if_the_element_already_exists(self):
+		self.assertRaises(
+			ldap.ALREADY_EXISTS,
+			self.stubber.add_s, 'ou=schule,o=lestwo', new_element()
+		)
 
 class ModifyingAnExistingElement(unittest.TestCase):
 	def setUp(self):
@@ -67,6 +77,94 @@ class ModifyingAnNonExistingElement(unittest.TestCase):
 	def test_should_raise_error(self):
 		self.assertRaises(RuntimeError, self.cmd)
 
+class SendingUpdatesInATransaction(unittest.TestCase):
+	def setUp(self):
+		self.stubber = new_ldap_stubber()
+		self.stubber.add_s('ou=schule,o=lestwo', new_element())
+		oid, self.identifier = self.stubber.extop_s(
+			ExtendedRequest(TRANSACTION_START, None)
+		)
+		self.controls = [
+			RequestControl(TRANSACTION_SPECIFICATION, True, self.identifier)
+		]
+		msgids = [
+			self.stubber.add_ext(
+				'cn=new,o=lestwo', new_element(), self.controls
+			),
+			self.stubber.modify_ext('ou=schule,o=lestwo', [
+				( ldap.MOD_REPLACE, 'attr1', [ 'val9' ] ),
+			], self.controls),
+		]
+		for msgid in msgids:
+			self.stubber.result3(msgid)
+
+	def end(self, commit=True):
+		self.stubber.extop_s(ExtendedRequest(
+			TRANSACTION_END, encode_end_transaction(self.identifier, commit)
+		))
+
+	def test_should_advertise_transactions_in_the_root_dse(self):
+		dn, attrs = self.stubber.search_s(
+			'', ldap.SCOPE_BASE, '(objectClass=*)'
+		)[0]
+		self.assertEqual(
+			attrs['supportedExtension'], [ TRANSACTION_START, TRANSACTION_END ]
+		)
+
+	def test_should_not_apply_the_updates_before_the_end(self):
+		self.assertEqual(len(self.stubber.elements), 1)
+		self.assertEqual(self.stubber.elements[0].attr1, [ 'val1' ])
+
+	def test_should_apply_the_updates_on_commit(self):
+		self.end()
+		self.assertEqual(len(self.stubber.elements), 2)
+		self.assertEqual(self.stubber.elements[0].attr1, [ 'val9' ])
+
+	def test_should_discard_the_updates_on_abort(self):
+		self.end(False)
+		self.assertEqual(len(self.stubber.elements), 1)
+		self.assertEqual(self.stubber.transactions, {})
+
+	def test_should_apply_nothing_if_an_update_fails(self):
+		self.stubber.result3(self.stubber.add_ext(
+			'ou=schule,o=lestwo', new_element(), self.controls
+		))
+		self.assertRaises(ldap.ALREADY_EXISTS, self.end)
+		self.assertEqual(len(self.stubber.elements), 1)
+		self.assertEqual(self.stubber.elements[0].attr1, [ 'val1' ])
+		self.assertEqual(self.stubber.search_s(
+			'o=lestwo', ldap.SCOPE_SUBTREE, '(cn=item)'
+		)[0][0], 'ou=schule,o=lestwo')
+
+	def test_should_refuse_unknown_transactions(self):
+		self.end()
+		self.assertRaises(ldap.UNWILLING_TO_PERFORM, self.end)
+
+class ModifyingAnElementAsynchronously(unittest.TestCase):
+	def setUp(self):
+		self.stubber = new_ldap_stubber()
+		self.dn = 'ou=schule,o=lestwo'
+		self.stubber.add_s(self.dn, new_element())
+
+	def test_should_modify_the_element(self):
+		msgid = self.stubber.modify_ext(self.dn, [
+			( ldap.MOD_DELETE, 'attr1', [ 'val1' ] ),
+			( ldap.MOD_ADD, 'attr1', [ 'val9' ] ),
+		])
+		self.assertEqual(self.stubber.result3(msgid)[:3], (
+			ldap.RES_MODIFY, [], msgid
+		))
+		self.assertEqual(self.stubber.elements[0].attr1, [ 'val9' ])
+
+	def test_should_raise_the_error_on_result3(self):
+		msgid = self.stubber.modify_ext(self.dn, [
+			( ldap.MOD_DELETE, 'attr1', [ 'unknown' ] ),
+		])
+		self.assertRaises(
+			ldap.NO_SUCH_ATTRIBUTE, self.stubber.result3, msgid
+		)
+		self.assertEqual(self.stubber.pending, {})
+
 class DeletingAnExistingElement(unittest.TestCase):
 	def setUp(self):
 		self.stubber = new_ldap_stubber()
@@ -136,8 +234,194 @@ class SearchingNonExistingElements(unittest.TestCase):
 
 	def test_should_return_the_correct_result(self):
 		self.assertEqual(self.results, [ ])
-	
-		
+
+class SearchingWithThePagedResultsControl(unittest.TestCase):
+	def setUp(self):
+		self.stubber = new_ldap_stubber()
+		for i in range(5):
+			self.stubber.add_s('cn=item%d,o=lestwo' % i, new_element())
+		self.control = SimplePagedResultsControl(True, size=2, cookie='')
+		self.pages = []
+		while True:
+			msgid = self.stubber.search_ext(
+				'o=lestwo',
+				ldap.SCOPE_SUBTREE,
+				'(attr1=val1)',
+				serverctrls=[ self.control ]
+			)
+			rtype, data, rmsgid, controls = self.stubber.result3(msgid)
+			self.pages.append([ dn for dn, attrs in data ])
+			self.control.cookie = controls[0].cookie
+			if not self.control.cookie:
+				break
+
+	def test_should_return_three_pages(self):
+		self.assertEqual([ len(i) for i in self.pages ], [ 2, 2, 1 ])
+	def test_should_return_every_element_once(self):
+		self.assertEqual(sum(self.pages, []), [
+			'cn=item%d,o=lestwo' % i for i in range(5)
+		])
+	def test_should_not_keep_pending_results(self):
+		self.assertEqual(self.stubber.pending, {})
+
+
+class FindingElementsByDn(unittest.TestCase):
+	def setUp(self):
+		self.stubber = new_ldap_stubber()
+		self.stubber.add_s('ou=schule,o=lestwo', new_element())
+
+	def test_should_ignore_case_and_spaces(self):
+		self.stubber.delete_s('OU=Schule, o=lestwo')
+		self.assertEqual(self.stubber.elements, [])
+	def test_should_find_renamed_elements_by_their_new_dn(self):
+		self.stubber.modrdn_s('ou=schule,o=lestwo', 'ou=new', True)
+		self.stubber.delete_s('ou=new,o=lestwo')
+		self.assertRaises(
+			RuntimeError, self.stubber.delete_s, 'ou=schule,o=lestwo'
+		)
+
+class SearchingWithAnIndex(unittest.TestCase):
+	def setUp(self):
+		self.stubber = LdapStubber(indexes=('attr1', ))
+		for i in range(5):
+			self.stubber.add_s('cn=item%d,o=lestwo' % i, new_element({
+				'attr1': 'val%d' % (i % 2),
+			}))
+		self.scanned = []
+		self.stubber._candidates = self.record_candidates(
+			self.stubber._candidates
+		)
+
+	def record_candidates(self, candidates):
+		def recording(*args):
+			result = candidates(*args)
+			self.scanned.append(len(result))
+			return result
+		return recording
+
+	def search(self, expr):
+		return [ dn for dn, attrs in self.stubber.search_s(
+			'o=lestwo', ldap.SCOPE_SUBTREE, expr
+		) ]
+
+	def test_should_only_check_the_indexed_elements(self):
+		self.assertEqual(self.search('(&(cn=item)(attr1=val1))'), [
+			'cn=item1,o=lestwo', 'cn=item3,o=lestwo'
+		])
+		self.assertEqual(self.scanned, [ 2 ])
+	def test_should_scan_all_elements_without_indexed_terms(self):
+		self.assertEqual(len(self.search('(|(attr1=val1)(cn=item))')), 5)
+		self.assertEqual(self.scanned, [ 5 ])
+	def test_should_update_the_index_on_modifications(self):
+		self.stubber.modify_s('cn=item0,o=lestwo', [
+			( ldap.MOD_REPLACE, 'attr1', 'val1' )
+		])
+		self.assertEqual(len(self.search('(attr1=val1)')), 3)
+		self.assertEqual(len(self.search('(attr1=val0)')), 2)
+	def test_should_update_the_index_on_renames(self):
+		self.stubber.add_index('cn')
+		self.stubber.modrdn_s('cn=item0,o=lestwo', 'cn=other', True)
+		self.assertEqual(self.search('(cn=other)'), [ 'cn=other,o=lestwo' ])
+	def test_should_remove_deleted_elements_from_the_index(self):
+		self.stubber.delete_s('cn=item1,o=lestwo')
+		self.assertEqual(self.search('(attr1=val1)'), [ 'cn=item3,o=lestwo' ])
+	def test_should_check_the_scope_of_indexed_elements(self):
+		self.stubber.add_s('cn=item9,ou=sub,o=lestwo', new_element())
+		self.assertEqual(self.search('(attr1=val1)'), [
+			'cn=item1,o=lestwo',
+			'cn=item3,o=lestwo',
+			'cn=item9,ou=sub,o=lestwo',
+		])
+
+class SearchingATree(unittest.TestCase):
+	def setUp(self):
+		self.stubber = new_ldap_stubber()
+		for dn in [ 'o=lestwo', 'ou=user,o=lestwo', 'cn=a,ou=user,o=lestwo',
+					'cn=b,ou=user,o=lestwo', 'cn=c,ou=superuser,o=lestwo' ]:
+			self.stubber.add_s(dn, new_element())
+
+	def search(self, prefix, scope):
+		return [ dn for dn, attrs in self.stubber.search_s(
+			prefix, scope, '(attr1=val1)'
+		) ]
+
+	def test_should_find_the_base_with_base_scope(self):
+		self.assertEqual(
+			self.search('ou=user,o=lestwo', ldap.SCOPE_BASE),
+			[ 'ou=user,o=lestwo' ]
+		)
+	def test_should_find_the_children_with_onelevel_scope(self):
+		self.assertEqual(
+			self.search('ou=user,o=lestwo', ldap.SCOPE_ONELEVEL),
+			[ 'cn=a,ou=user,o=lestwo', 'cn=b,ou=user,o=lestwo' ]
+		)
+	def test_should_find_the_whole_subtree_in_insertion_order(self):
+		self.assertEqual(
+			self.search('o=lestwo', ldap.SCOPE_SUBTREE),
+			[ 'o=lestwo', 'ou=user,o=lestwo', 'cn=a,ou=user,o=lestwo',
+			  'cn=b,ou=user,o=lestwo', 'cn=c,ou=superuser,o=lestwo' ]
+		)
+	def test_should_not_mix_up_similar_rdns(self):
+		self.assertEqual(
+			self.search('ou=user,o=lestwo', ldap.SCOPE_SUBTREE),
+			[ 'ou=user,o=lestwo', 'cn=a,ou=user,o=lestwo',
+			  'cn=b,ou=user,o=lestwo' ]
+		)
+	def test_should_search_below_glue_nodes(self):
+		self.assertEqual(
+			self.search('ou=superuser,o=lestwo', ldap.SCOPE_ONELEVEL),
+			[ 'cn=c,ou=superuser,o=lestwo' ]
+		)
+		self.assertEqual(
+			self.search('ou=superuser,o=lestwo', ldap.SCOPE_BASE), []
+		)
+	def test_should_return_nothing_for_unknown_bases(self):
+		self.assertEqual(
+			self.search('ou=none,o=lestwo', ldap.SCOPE_SUBTREE), []
+		)
+	def test_should_refuse_to_delete_elements_with_children(self):
+		self.assertRaises(
+			ldap.NOT_ALLOWED_ON_NONLEAF,
+			self.stubber.delete_s, 'ou=user,o=lestwo'
+		)
+	def test_should_remove_empty_glue_nodes(self):
+		self.stubber.delete_s('cn=c,ou=superuser,o=lestwo')
+		self.assertEqual(
+			self.stubber.root.find('ou=superuser,o=lestwo'), None
+		)
+
+class RenamingASubtree(unittest.TestCase):
+	def setUp(self):
+		self.stubber = new_ldap_stubber()
+		for dn in [ 'ou=user,o=lestwo', 'cn=a,ou=user,o=lestwo',
+					'ou=other,o=lestwo' ]:
+			self.stubber.add_s(dn, new_element())
+
+	def test_should_move_the_children_along(self):
+		self.stubber.modrdn_s('ou=user,o=lestwo', 'ou=people', True)
+		self.assertEqual(self.stubber.elements[1].dn, 'cn=a,ou=people,o=lestwo')
+		self.stubber.delete_s('cn=a,ou=people,o=lestwo')
+
+	def test_should_move_the_subtree_below_a_new_parent(self):
+		self.stubber.rename_s(
+			'ou=user,o=lestwo', 'ou=user', 'ou=other,o=lestwo'
+		)
+		results = self.stubber.search_s(
+			'ou=other,o=lestwo', ldap.SCOPE_SUBTREE, '(attr1=val1)'
+		)
+		self.assertEqual(len(results), 3)
+
+	def test_should_refuse_existing_dns(self):
+		self.assertRaises(
+			ldap.ALREADY_EXISTS,
+			self.stubber.modrdn_s, 'ou=user,o=lestwo', 'ou=other', True
+		)
+
+	def test_should_refuse_to_move_below_itself(self):
+		self.assertRaises(
+			ldap.UNWILLING_TO_PERFORM, self.stubber.rename_s,
+			'ou=user,o=lestwo', 'ou=user', 'cn=a,ou=user,o=lestwo'
+		)
 
 if __name__ == '__main__':
 	unittest.main()
@@ -1,8 +1,28 @@
 from active_ldap import Base, ForeignKey, ManyToManyField
+from active_ldap import PartialInstanceError, unloaded, encode_value
+from active_ldap import instance_dn
+from signals.deferred import DeferredDelivery
 from ldap_stubber.ldap_stubber import LdapStubber
+from ldap_stubber.ldap_server import LdapServer
+from pool.pool import ConnectionPool
+from session import IdentityMap, UnitOfWork
+from cache.cache import ResultCache
+from instrumentation import Instrumentation, InstrumentedConnection
+from detector import NPlusOneDetector, NPlusOneWarning, NPlusOneError
+import benchmarks
 import unittest
+import warnings
+import linecache
+import pickle
+import threading
 import ldap
 
+try:
+	import _ldap
+	python_ldap = True
+except ImportError:
+	python_ldap = False
+
 Base.connection = LdapStubber()
 
 class TestPhone(Base):
@@ -109,6 +129,62 @@ class SignalTester(Base):
 		self.ev_before_delete = True
 
 
+class RecordingStubber(LdapStubber):
+	"""
+	This stubber records the operations and modifications which are sent to it
+	"""
+	def __init__(self):
+		super(RecordingStubber, self).__init__()
+		self.modifications = []
+		self.calls = []
+		self.searches = []
+
+	def search_s(self, *args):
+		self.calls.append('search_s')
+		self.searches.append(args)
+		return super(RecordingStubber, self).search_s(*args)
+
+	def search_ext(self, *args, **kwds):
+		self.calls.append('search_ext')
+		return super(RecordingStubber, self).search_ext(*args, **kwds)
+
+	def result3(self, *args, **kwds):
+		self.calls.append('result3')
+		return super(RecordingStubber, self).result3(*args, **kwds)
+
+	def add_s(self, dn, attrs):
+		self.calls.append('add_s')
+		super(RecordingStubber, self).add_s(dn, attrs)
+
+	def modify_s(self, dn, attrs):
+		self.calls.append('modify_s')
+		self.modifications.append( ( dn, attrs ) )
+		super(RecordingStubber, self).modify_s(dn, attrs)
+
+	def add_ext(self, *args, **kwds):
+		self.calls.append('add_ext')
+		return super(RecordingStubber, self).add_ext(*args, **kwds)
+
+	def modify_ext(self, *args, **kwds):
+		self.calls.append('modify_ext')
+		return super(RecordingStubber, self).modify_ext(*args, **kwds)
+
+	def delete_ext(self, *args, **kwds):
+		self.calls.append('delete_ext')
+		return super(RecordingStubber, self).delete_ext(*args, **kwds)
+
+	def rename(self, *args, **kwds):
+		self.calls.append('rename')
+		return super(RecordingStubber, self).rename(*args, **kwds)
+
+	def extop_s(self, *args, **kwds):
+		self.calls.append('extop_s')
+		return super(RecordingStubber, self).extop_s(*args, **kwds)
+
+	def modrdn_s(self, dn, rdn, flag):
+		self.calls.append('modrdn_s')
+		super(RecordingStubber, self).modrdn_s(dn, rdn, flag)
+
 def new_user(attrs={}):
 	default = { 
 		'userID': 'user1',
@@ -306,7 +382,1519 @@ class AManyToManyClassWithReferencesWhenModifyingTheDn(unittest.TestCase):
 
 	def test_should_update_the_deviceID_on_user2(self):
 		user = TestMultipleUser.find_by_id('user2')
-		self.assertEqual(user.deviceID, [ 'phone_new_id', 'phone2' ])
+		self.assertEqual(sorted(user.deviceID), [ 'phone2', 'phone_new_id' ])
+
+class PagedIterationOverAllUsers(unittest.TestCase):
+	def setUp(self):
+		Base.connection = LdapStubber()
+		for i in range(5):
+			new_user({ 'userID': 'user%d' % i }).save()
+		self.result = TestUser.iter_find_all(page_size=2)
+
+	def test_should_return_a_generator(self):
+		self.assertFalse(isinstance(self.result, list))
+
+	def test_should_yield_every_user(self):
+		self.assertEqual(
+			sorted([ i.userID for i in self.result ]),
+			[ 'user%d' % i for i in range(5) ]
+		)
+
+	def test_should_not_keep_pending_pages(self):
+		list(self.result)
+		self.assertEqual(Base.connection.pending, {})
+
+class PagedIterationWithAFilter(unittest.TestCase):
+	def setUp(self):
+		Base.connection = LdapStubber()
+		for i in range(5):
+			new_user({
+				'userID': 'user%d' % i,
+				'name': 'name%d' % (i % 2),
+			}).save()
+		self.result = list(TestUser.iter_find('(name=name1)', page_size=1))
+
+	def test_should_yield_only_the_matching_users(self):
+		self.assertEqual(
+			sorted([ i.userID for i in self.result ]),
+			[ 'user1', 'user3' ]
+		)
+
+class ModelsOnAConnectionPool(unittest.TestCase):
+	def setUp(self):
+		stubber = LdapStubber()
+		Base.connection = self.pool = ConnectionPool(lambda: stubber, size=2)
+		new_user().save()
+		new_phone().save()
+		self.user = TestUser.find_by_id('user1')
+
+	def tearDown(self):
+		Base.connection = LdapStubber()
+
+	def test_should_find_the_user(self):
+		self.assertEqual(self.user.userID, 'user1')
+
+	def test_should_load_the_relations(self):
+		self.assertEqual(self.user.device.phoneID, 'phone1')
+
+	def test_should_iterate_over_the_pages(self):
+		self.assertEqual(len(list(TestUser.iter_find_all(page_size=1))), 1)
+
+	def test_should_check_every_connection_in(self):
+		list(TestUser.iter_find_all(page_size=1))
+		self.assertEqual(len(self.pool.idle), self.pool.created)
+
+@unittest.skipUnless(python_ldap, 'python-ldap is not installed')
+class ModelsOnAPythonLdapConnection(unittest.TestCase):
+	def setUp(self):
+		self.stubber = LdapStubber()
+		self.server = LdapServer(
+			self.stubber, credentials={ 'cn=admin': 'secret' }
+		).start()
+		Base.establish_connection({
+			'uri': self.server.uri,
+			'bind_dn': 'cn=admin',
+			'bind_password': 'secret',
+		})
+		for i in range(3):
+			self.assertTrue(new_user({ 'userID': 'user%d' % i }).save())
+
+	def tearDown(self):
+		Base.connection.unbind_s()
+		Base.connection = LdapStubber()
+		self.server.stop()
+
+	def test_should_iterate_over_the_pages(self):
+		self.assertEqual(
+			sorted([ i.userID for i in TestUser.iter_find_all(page_size=2) ]),
+			[ 'user0', 'user1', 'user2' ]
+		)
+
+	def test_should_update_the_entry(self):
+		user = TestUser.find_by_id('user1')
+		user.mail = 'new@example.com'
+		self.assertTrue(user.save())
+		self.assertEqual(TestUser.find_by_id('user1').mail, 'new@example.com')
+
+	def test_should_rename_the_entry(self):
+		user = TestUser.find_by_id('user1')
+		user.userID = 'renamed'
+		self.assertTrue(user.save())
+		self.assertEqual(TestUser.find_by_id('user1'), None)
+		self.assertEqual(TestUser.find_by_id('renamed').mail, user.mail)
+
+	def test_should_delete_the_entry(self):
+		self.assertTrue(TestUser.find_by_id('user1').delete())
+		self.assertEqual(TestUser.find_by_id('user1'), None)
+		self.assertEqual(len(TestUser.find_all()), 2)
+
+class UpdatingALoadedUser(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		new_multiple_user({ 'deviceID': [ 'phone1', 'phone2' ] }).save()
+		self.user = TestMultipleUser.find_by_id('user1')
+
+	def test_should_only_send_the_changed_attribute(self):
+		self.user.mail = 'new@example.com'
+		self.user.update()
+		self.assertEqual(Base.connection.modifications, [
+			( 'userID=user1,ou=user,o=schule', [
+				( ldap.MOD_REPLACE, 'mail', 'new@example.com' )
+			])
+		])
+
+	def test_should_not_send_anything_without_changes(self):
+		self.user.update()
+		self.assertEqual(Base.connection.modifications, [])
+
+	def test_should_add_and_delete_single_values_of_lists(self):
+		self.user.deviceID = [ 'phone2', 'phone3' ]
+		self.user.update()
+		self.assertEqual(Base.connection.modifications[0][1], [
+			( ldap.MOD_DELETE, 'deviceID', [ 'phone1' ] ),
+			( ldap.MOD_ADD, 'deviceID', [ 'phone3' ] ),
+		])
+		user = TestMultipleUser.find_by_id('user1')
+		self.assertEqual(user.deviceID, [ 'phone2', 'phone3' ])
+
+	def test_should_not_send_the_changes_twice(self):
+		self.user.mail = 'new@example.com'
+		self.user.update()
+		self.user.update()
+		self.assertEqual(len(Base.connection.modifications), 1)
+
+	def test_should_pass_the_changes_to_after_collect_attributes(self):
+		collected = []
+		self.user.after_collect_attributes = lambda attrs: \
+			collected.append(attrs) or attrs
+		self.user.mail = 'new@example.com'
+		self.user.update()
+		self.assertEqual(collected, [
+			[ ( ldap.MOD_REPLACE, 'mail', 'new@example.com' ) ]
+		])
+
+class SavingANewUser(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		self.user = new_user()
+		self.result = self.user.save()
+
+	def test_should_only_add_the_entry(self):
+		self.assertTrue(self.result)
+		self.assertEqual(Base.connection.calls, [ 'add_s' ])
+
+	def test_should_update_on_the_next_save(self):
+		self.user.mail = 'new@example.com'
+		self.user.save()
+		self.assertEqual(Base.connection.calls, [ 'add_s', 'modify_s' ])
+		self.assertEqual(Base.connection.modifications[0][1], [
+			( ldap.MOD_REPLACE, 'mail', 'new@example.com' )
+		])
+
+class SavingAnExistingEntryWithoutDn(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		new_user().save()
+		self.user = new_user({ 'mail': 'new@example.com' })
+		self.result = self.user.save()
+
+	def test_should_fall_back_to_an_update(self):
+		self.assertTrue(self.result)
+		self.assertEqual(
+			Base.connection.calls,
+			[ 'add_s', 'add_s', 'modify_s' ]
+		)
+		self.assertEqual(
+			TestUser.find_by_id('user1').mail,
+			'new@example.com'
+		)
+
+	def test_should_only_update_the_entry_afterwards(self):
+		self.assertEqual(self.user.dn, 'userID=user1,ou=user,o=schule')
+		Base.connection.calls = []
+		self.user.mail = 'other@example.com'
+		self.assertTrue(self.user.save())
+		self.assertEqual(Base.connection.calls, [ 'modify_s' ])
+
+class SavingALoadedUser(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		new_user().save()
+		self.user = TestUser.find_by_id('user1')
+		Base.connection.calls = []
+
+	def test_should_not_rename_the_entry_if_the_rdn_is_unchanged(self):
+		self.user.mail = 'new@example.com'
+		self.user.save()
+		self.assertEqual(Base.connection.calls, [ 'modify_s' ])
+
+	def test_should_only_rename_the_entry_if_the_rdn_changed(self):
+		self.user.userID = 'user2'
+		self.user.save()
+		self.assertEqual(Base.connection.calls, [ 'modrdn_s' ])
+		self.assertEqual(self.user.dn, 'userID=user2,ou=user,o=schule')
+		self.assertEqual(TestUser.find_by_id('user2').mail, 'user@example.com')
+
+class LoadingWithinAnIdentityMap(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		new_user().save()
+		new_phone().save()
+		Base.connection.calls = []
+		self.identity_map = IdentityMap()
+		self.identity_map.__enter__()
+		self.user = TestUser.find_by_id('user1')
+
+	def tearDown(self):
+		self.identity_map.__exit__(None, None, None)
+
+	def test_should_answer_find_by_id_from_memory(self):
+		self.assertTrue(TestUser.find_by_id('user1') is self.user)
+		self.assertEqual(Base.connection.calls, [ 'search_s' ])
+
+	def test_should_return_the_same_instance_on_searches(self):
+		self.assertTrue(TestUser.find_all()[0] is self.user)
+
+	def test_should_share_instances_between_relations(self):
+		phone = self.user.device
+		self.assertTrue(phone.testusers[0] is self.user)
+		self.assertTrue(TestPhone.find_by_id('phone1') is phone)
+
+	def test_should_distinguish_the_classes(self):
+		self.assertFalse(TestMultipleUser.find_by_id('user1') is self.user)
+
+	def test_should_forget_deleted_instances(self):
+		self.user.delete()
+		self.assertEqual(TestUser.find_by_id('user1'), None)
+
+	def test_should_register_renamed_instances(self):
+		self.user.userID = 'user2'
+		self.user.save()
+		self.assertTrue(TestUser.find_by_id('user2') is self.user)
+		self.assertEqual(TestUser.find_by_id('user1'), None)
+
+	def test_should_register_created_instances(self):
+		user = new_user({ 'userID': 'user3' })
+		user.save()
+		self.assertTrue(TestUser.find_by_id('user3') is user)
+
+	def test_should_not_be_used_outside_of_the_block(self):
+		self.identity_map.__exit__(None, None, None)
+		self.assertFalse(TestUser.find_by_id('user1') is self.user)
+		self.identity_map.__enter__()
+
+class RenamingWithinAnIdentityMap(unittest.TestCase):
+	def setUp(self):
+		setup_has_many_relations(self)
+		with IdentityMap():
+			phone = TestPhone.find_by_id('phone1')
+			phone.phoneID = 'phone_new_id'
+			phone.save()
+
+	def test_should_update_the_deviceID_on_the_user(self):
+		user = TestUser.find_by_id('user1')
+		self.assertEqual(user.deviceID, 'phone_new_id')
+
+class FindingWithAResultCache(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		TestUser.result_cache = ResultCache(max_size=10, ttl=60)
+		new_user().save()
+		Base.connection.calls = []
+		self.users = TestUser.find('(name=the_user)')
+
+	def tearDown(self):
+		TestUser.result_cache = None
+
+	def test_should_answer_the_same_search_from_the_cache(self):
+		users = TestUser.find('(name=the_user)')
+		self.assertEqual(users[0].userID, 'user1')
+		self.assertEqual(Base.connection.calls, [ 'search_s' ])
+		self.assertEqual(TestUser.result_cache.hits, 1)
+		self.assertEqual(TestUser.result_cache.misses, 1)
+
+	def test_should_search_for_other_filters(self):
+		TestUser.find('(name=other)')
+		self.assertEqual(Base.connection.calls, [ 'search_s', 'search_s' ])
+
+	def test_should_not_be_altered_by_changed_instances(self):
+		self.users[0].name = 'changed'
+		self.assertEqual(TestUser.find('(name=the_user)')[0].name, 'the_user')
+
+	def test_should_be_invalidated_by_saves(self):
+		self.users[0].name = 'changed'
+		self.users[0].save()
+		self.assertEqual(TestUser.find('(name=the_user)'), [])
+
+	def test_should_be_invalidated_by_deletes(self):
+		self.users[0].delete()
+		self.assertEqual(TestUser.find('(name=the_user)'), [])
+
+	def test_should_not_be_used_by_other_classes(self):
+		TestMultipleUser.find('(name=the_user)')
+		self.assertEqual(Base.connection.calls, [ 'search_s', 'search_s' ])
+
+def setup_prefetch_relations(tester, multiple=False):
+	Base.connection = RecordingStubber()
+	for i in range(3):
+		new_phone({ 'phoneID': 'phone%d' % i }).save()
+		if multiple:
+			new_multiple_user({
+				'userID': 'multi%d' % i,
+				'deviceID': sorted(set([ 'phone%d' % i, 'phone2' ])),
+			}).save()
+		else:
+			new_user({
+				'userID': 'user%d' % i,
+				'deviceID': 'phone%d' % i
+			}).save()
+	Base.connection.calls = []
+
+class PrefetchingAForeignKey(unittest.TestCase):
+	def setUp(self):
+		setup_prefetch_relations(self)
+		self.users = TestUser.find_all(prefetch=('device', ))
+
+	def test_should_search_only_twice(self):
+		for user in self.users:
+			user.device
+		self.assertEqual(Base.connection.calls, [ 'search_s', 'search_s' ])
+
+	def test_should_assign_the_right_devices(self):
+		self.assertEqual(
+			sorted([ ( i.userID, i.device.phoneID ) for i in self.users ]),
+			[ ( 'user%d' % i, 'phone%d' % i ) for i in range(3) ]
+		)
+
+	def test_should_be_cleared_by_reload_cache(self):
+		self.users[0].reload_cache()
+		self.assertEqual(self.users[0]._device, None)
+
+class PrefetchingTheReverseForeignKey(unittest.TestCase):
+	def setUp(self):
+		setup_prefetch_relations(self)
+		self.phones = TestPhone.find(
+			'(name=the_phone)',
+			prefetch=('testusers', )
+		)
+
+	def test_should_search_only_twice(self):
+		for phone in self.phones:
+			phone.testusers
+		self.assertEqual(Base.connection.calls, [ 'search_s', 'search_s' ])
+
+	def test_should_assign_the_right_users(self):
+		self.assertEqual(
+			sorted([ ( i.phoneID, [ j.userID for j in i.testusers ] )
+					 for i in self.phones ]),
+			[ ( 'phone%d' % i, [ 'user%d' % i ] ) for i in range(3) ]
+		)
+
+class PrefetchingAManyToManyField(unittest.TestCase):
+	def setUp(self):
+		setup_prefetch_relations(self, multiple=True)
+		self.users = TestMultipleUser.find_all(prefetch=('devices', ))
+		self.phones = TestPhone.find_all(prefetch=('testmultipleusers', ))
+
+	def test_should_search_only_four_times(self):
+		for user in self.users:
+			user.devices
+		for phone in self.phones:
+			phone.testmultipleusers
+		self.assertEqual(len(Base.connection.calls), 4)
+
+	def test_should_assign_the_right_devices(self):
+		self.assertEqual(
+			sorted([ ( i.userID, sorted([ j.phoneID for j in i.devices ]) )
+					 for i in self.users ]),
+			[
+				( 'multi0', [ 'phone0', 'phone2' ] ),
+				( 'multi1', [ 'phone1', 'phone2' ] ),
+				( 'multi2', [ 'phone2' ] ),
+			]
+		)
+
+	def test_should_assign_the_right_users(self):
+		self.assertEqual(
+			sorted([
+				( i.phoneID, sorted([ j.userID for j in i.testmultipleusers ]) )
+				for i in self.phones
+			]),
+			[
+				( 'phone0', [ 'multi0' ] ),
+				( 'phone1', [ 'multi1' ] ),
+				( 'phone2', [ 'multi0', 'multi1', 'multi2' ] ),
+			]
+		)
+
+class PrefetchingAnUnknownRelation(unittest.TestCase):
+	def test_should_raise_an_attribute_error(self):
+		self.assertRaises(
+			AttributeError,
+			TestUser.find_all, prefetch=('unknown', )
+		)
+
+class FetchingManyDevicesInChunks(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		TestPhone.filter_chunk_size = 2
+		for i in range(5):
+			new_phone({ 'phoneID': 'phone%d' % i }).save()
+		new_multiple_user({
+			'deviceID': [ 'phone%d' % i for i in range(5) ] + [ 'phone9' ]
+		}).save()
+		self.user = TestMultipleUser.find_by_id('user1')
+		Base.connection.calls = []
+
+	def tearDown(self):
+		del TestPhone.filter_chunk_size
+
+	def test_should_return_every_device_once(self):
+		self.assertEqual(
+			sorted([ i.phoneID for i in self.user.devices ]),
+			[ 'phone%d' % i for i in range(5) ]
+		)
+
+	def test_should_send_all_chunks_before_reading_the_results(self):
+		self.user.devices
+		calls = [ i for i in Base.connection.calls if i != 'search_s' ]
+		self.assertEqual(calls, [ 'search_ext' ] * 3 + [ 'result3' ] * 3)
+
+	def test_should_work_on_a_pool_with_a_single_connection(self):
+		stubber = Base.connection
+		Base.connection = ConnectionPool(lambda: stubber, size=1)
+		try:
+			self.assertEqual(len(self.user.devices), 5)
+		finally:
+			Base.connection = stubber
+
+	def test_should_check_the_connection_in_if_a_search_fails(self):
+		stubber = Base.connection
+		search_ext = stubber.search_ext
+		def failing_search_ext(prefix, scope, expr, *args, **kwds):
+			if 'phone9' in expr:
+				raise ldap.FILTER_ERROR(expr)
+			return search_ext(prefix, scope, expr, *args, **kwds)
+		stubber.search_ext = failing_search_ext
+		Base.connection = pool = ConnectionPool(
+			lambda: stubber, size=1, checkout_timeout=0.01
+		)
+		try:
+			self.assertRaises(ldap.FILTER_ERROR, lambda: self.user.devices)
+			self.assertEqual(len(pool.idle), pool.created)
+			self.assertEqual(stubber.pending, {})
+		finally:
+			Base.connection = stubber
+
+class FindingUsersByIds(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		for i in range(5):
+			new_user({ 'userID': 'user%d' % i }).save()
+		Base.connection.calls = []
+		self.ids = [ 'user%d' % i for i in range(5) ] + [ 'unknown' ]
+
+	def test_should_map_every_id_to_its_user(self):
+		result = TestUser.find_by_ids(self.ids)
+		self.assertEqual(sorted(result.keys()), sorted(self.ids))
+		for i in range(5):
+			self.assertEqual(result['user%d' % i].userID, 'user%d' % i)
+
+	def test_should_map_unknown_ids_to_none(self):
+		self.assertEqual(TestUser.find_by_ids(self.ids)['unknown'], None)
+
+	def test_should_search_only_once(self):
+		TestUser.find_by_ids(self.ids)
+		self.assertEqual(Base.connection.calls, [ 'search_s' ])
+
+	def test_should_search_in_chunks(self):
+		TestUser.filter_chunk_size = 4
+		try:
+			result = TestUser.find_by_ids(self.ids)
+		finally:
+			del TestUser.filter_chunk_size
+		calls = [ i for i in Base.connection.calls if i != 'search_s' ]
+		self.assertEqual(calls, [ 'search_ext' ] * 2 + [ 'result3' ] * 2)
+		self.assertEqual(result['user4'].userID, 'user4')
+
+	def test_should_compare_the_ids_case_insensitively(self):
+		result = TestUser.find_by_ids([ 'USER1', 'user1' ])
+		self.assertEqual(sorted(result.keys()), [ 'USER1', 'user1' ])
+		self.assertEqual(result['USER1'].userID, 'user1')
+		self.assertTrue(result['USER1'] is result['user1'])
+
+	def test_should_map_ids_which_are_no_strings_to_none(self):
+		self.assertEqual(TestUser.find_by_ids([ 1 ]), { 1: None })
+
+	def test_should_not_search_at_all_without_ids(self):
+		self.assertEqual(TestUser.find_by_ids([]), {})
+		self.assertEqual(Base.connection.calls, [])
+
+	def test_should_use_the_identity_map(self):
+		with IdentityMap():
+			user = TestUser.find_by_id('user1')
+			Base.connection.calls = []
+			result = TestUser.find_by_ids([ 'user1' ])
+		self.assertTrue(result['user1'] is user)
+		self.assertEqual(Base.connection.calls, [])
+
+	def test_should_find_loaded_users_by_ids_in_other_cases(self):
+		with IdentityMap():
+			user = TestUser.find_by_id('user1')
+			Base.connection.calls = []
+			result = TestUser.find_by_ids([ 'USER1' ])
+		self.assertTrue(result['USER1'] is user)
+		self.assertEqual(Base.connection.calls, [])
+
+class SearchingTheDeclaredAttributes(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		Base.connection.add_s('userID=user1,ou=user,o=schule', [
+			( 'objectClass', [ 'user', 'person' ] ),
+			( 'userID', [ 'user1' ] ),
+			( 'mail', [ 'user@example.com' ] ),
+			( 'jpegPhoto', [ 'a big photo' ] ),
+		])
+
+	def test_should_request_only_the_declared_attributes(self):
+		TestUser.find_all()
+		self.assertEqual(
+			Base.connection.searches[0][3],
+			[ 'deviceID', 'mail', 'name', 'userID' ]
+		)
+
+	def test_should_keep_the_order_of_attribute_tuples(self):
+		SignalTester.find_all()
+		self.assertEqual(
+			Base.connection.searches[0][3],
+			[ 'userID', 'deviceID', 'name', 'mail' ]
+		)
+
+	def test_should_not_transfer_other_attributes(self):
+		result = Base.connection.search_s(
+			TestUser.prefix,
+			TestUser.scope,
+			'(userID=user1)',
+			TestUser._attrlist()
+		)
+		self.assertEqual(sorted(result[0][1].keys()), [ 'mail', 'userID' ])
+
+class LoadingOnlySomeAttributes(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		new_user().save()
+		Base.connection.calls = []
+		self.user = TestUser.find_by_id('user1', only=('user_mail', ))
+
+	def test_should_request_the_dn_attribute_and_the_given_attributes(self):
+		self.assertEqual(Base.connection.searches[0][3], [ 'userID', 'mail' ])
+
+	def test_should_load_only_the_given_attributes(self):
+		self.assertEqual(self.user.user_id, 'user1')
+		self.assertEqual(self.user.user_mail, 'user@example.com')
+		self.assertEqual(self.user.user_name, '')
+
+	def test_should_save_changes_of_loaded_attributes(self):
+		self.user.user_mail = 'new@example.com'
+		self.assertTrue(self.user.save())
+		self.assertEqual(Base.connection.modifications[0][1], [
+			( ldap.MOD_REPLACE, 'mail', 'new@example.com' )
+		])
+
+	def test_should_refuse_to_save_attributes_which_werent_loaded(self):
+		self.user.user_name = 'new name'
+		self.assertRaises(PartialInstanceError, self.user.save)
+		self.assertEqual(Base.connection.modifications, [])
+
+	def test_should_refuse_to_create_the_item(self):
+		del self.user.dn
+		self.assertRaises(PartialInstanceError, self.user.create)
+
+	def test_should_raise_on_unknown_attributes(self):
+		self.assertRaises(AttributeError, TestUser.find_all, only=('foo', ))
+
+	def test_should_support_find_and_iter_find(self):
+		user = TestUser.find('(name=the_user)', only=('name', ))[0]
+		self.assertEqual(user.user_name, 'the_user')
+		self.assertEqual(user.user_mail, '')
+		user = list(TestUser.iter_find_all(only=('name', )))[0]
+		self.assertEqual(user.user_mail, '')
+
+class CompletingAPartialInstanceWithinAnIdentityMap(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		new_user().save()
+		self.identity_map = IdentityMap()
+		self.identity_map.__enter__()
+		self.user = TestUser.find_all(only=('mail', ))[0]
+		self.user.mail = 'new@example.com'
+
+	def tearDown(self):
+		self.identity_map.__exit__(None, None, None)
+
+	def test_should_search_again_for_attributes_which_werent_loaded(self):
+		Base.connection.calls = []
+		self.assertTrue(TestUser.find_by_id('user1') is self.user)
+		self.assertEqual(Base.connection.calls, [ 'search_s' ])
+		self.assertEqual(self.user.name, 'the_user')
+
+	def test_should_keep_the_changes_of_loaded_attributes(self):
+		TestUser.find_all()
+		self.assertEqual(self.user.mail, 'new@example.com')
+
+	def test_should_be_able_to_save_the_completed_item(self):
+		TestUser.find_all()
+		self.user.name = 'new name'
+		self.user.save()
+		self.assertEqual(Base.connection.modifications[0][1], [
+			( ldap.MOD_REPLACE, 'mail', 'new@example.com' ),
+			( ldap.MOD_REPLACE, 'name', 'new name' ),
+		])
+
+	def test_should_answer_from_memory_if_the_attributes_were_loaded(self):
+		Base.connection.calls = []
+		user = TestUser.find_by_id('user1', only=('mail', ))
+		self.assertTrue(user is self.user)
+		self.assertEqual(Base.connection.calls, [])
+
+class RunningTheBenchmarks(unittest.TestCase):
+	def setUp(self):
+		self.results = benchmarks.run(sizes=( 60, ), trace_memory=False)
+
+	def test_should_run_every_benchmark(self):
+		self.assertEqual(
+			[ i['benchmark'] for i in self.results['results'] ],
+			[ i[0] for i in benchmarks.benchmarks ]
+		)
+
+	def test_should_record_operations_and_memory(self):
+		for result in self.results['results']:
+			self.assertEqual(result['size'], 60)
+			self.assertTrue(result['ops'] > 0)
+			self.assertEqual(result['peak_memory_bytes'], None)
+		self.assertEqual(self.results['memory'], None)
+
+	def test_should_compare_two_runs(self):
+		lines = benchmarks.compare(self.results, self.results)
+		self.assertEqual(len(lines), len(benchmarks.benchmarks))
+		self.assertTrue(lines[0].endswith('1.00x'))
+
+class InstrumentingTheConnection(unittest.TestCase):
+	def setUp(self):
+		self.instrumentation = Instrumentation()
+		self.operations = []
+		self.instrumentation.register(
+			'operation', lambda event, operation:
+				self.operations.append(operation)
+		)
+		self.stubber = LdapStubber()
+		Base.connection = self.connection = InstrumentedConnection(
+			self.stubber, self.instrumentation
+		)
+		new_user().save()
+		new_phone().save()
+
+	def tearDown(self):
+		Base.connection = LdapStubber()
+
+	def test_should_report_the_writes_with_their_model(self):
+		self.assertEqual(
+			[ ( i.model, i.name ) for i in self.operations ],
+			[ ( TestUser, 'add_s' ), ( TestPhone, 'add_s' ) ]
+		)
+		self.assertEqual(
+			self.operations[0].base, 'userID=user1,ou=user,o=schule'
+		)
+		self.assertTrue(self.operations[0].bytes > 0)
+
+	def test_should_report_searches_with_their_results(self):
+		TestUser.find('(name=the_user)')
+		operation = self.operations[-1]
+		self.assertEqual(operation.name, 'search_s')
+		self.assertEqual(operation.base, TestUser.prefix)
+		self.assertTrue(operation.filter.endswith('(name=the_user))'))
+		self.assertEqual(operation.results, 1)
+		self.assertTrue(operation.bytes > 0)
+		self.assertTrue(operation.seconds >= 0)
+
+	def test_should_report_asynchronous_searches_when_fetched(self):
+		list(TestUser.iter_find_all(page_size=1))
+		searches = [ i for i in self.operations if i.name == 'search_ext' ]
+		self.assertEqual(len(searches), 1)
+		self.assertEqual(searches[0].model, TestUser)
+		self.assertEqual(searches[0].results, 1)
+		self.assertEqual(self.connection.pending, {})
+
+	def test_should_report_failed_operations(self):
+		self.assertRaises(
+			ldap.ALREADY_EXISTS, TestUser.connection.add_s,
+			'userID=user1,ou=user,o=schule', []
+		)
+		self.assertTrue(
+			isinstance(self.operations[-1].error, ldap.ALREADY_EXISTS)
+		)
+
+	def test_should_count_the_operations_per_model(self):
+		TestUser.find_by_id('user1')
+		TestUser.find_by_id('user1')
+		counters = self.instrumentation.metrics.counters()
+		self.assertEqual(counters[( 'TestUser', 'search_s' )]['calls'], 2)
+		self.assertEqual(counters[( 'TestUser', 'search_s' )]['results'], 2)
+		self.assertEqual(counters[( 'TestPhone', 'add_s' )]['calls'], 1)
+
+	def test_should_collect_a_latency_histogram(self):
+		TestUser.find_all()
+		TestPhone.find_all()
+		histogram = self.instrumentation.metrics.histogram('search_s')
+		self.assertEqual(histogram[-1][0], None)
+		self.assertEqual(sum([ i[1] for i in histogram ]), 2)
+		self.assertEqual(sum([
+			i[1] for i in self.instrumentation.metrics.histogram(
+				'search_s', 'TestPhone'
+			)
+		]), 1)
+
+	def test_should_pass_other_attributes_through(self):
+		self.assertTrue(
+			TestUser.connection.root is self.stubber.root
+		)
+		self.assertFalse(hasattr(TestUser.connection, 'unknown_operation'))
+
+class InstrumentingAConnectionPool(unittest.TestCase):
+	def setUp(self):
+		stubber = LdapStubber()
+		self.pool = ConnectionPool(lambda: stubber, size=2)
+		self.instrumentation = Instrumentation()
+		Base.connection = InstrumentedConnection(
+			self.pool, self.instrumentation
+		)
+		new_user().save()
+
+	def tearDown(self):
+		Base.connection = LdapStubber()
+
+	def test_should_iterate_over_the_pages(self):
+		self.assertEqual(len(list(TestUser.iter_find_all(page_size=1))), 1)
+		self.assertEqual(len(self.pool.idle), self.pool.created)
+
+	def test_should_report_the_operations_of_the_pool(self):
+		TestUser.find_by_id('user1')
+		counters = self.instrumentation.metrics.counters()
+		self.assertEqual(counters[( 'TestUser', 'search_s' )]['calls'], 1)
+
+class DetectingNPlusOneSearches(unittest.TestCase):
+	def setUp(self):
+		setup_prefetch_relations(self)
+		self.users = TestUser.find_all()
+
+	def load_devices(self, users, detector):
+		with detector:
+			for user in users:
+				user.device
+		return detector
+
+	def test_should_warn_once_the_threshold_is_exceeded(self):
+		with warnings.catch_warnings(record=True) as caught:
+			warnings.simplefilter('always')
+			self.load_devices(self.users, NPlusOneDetector(threshold=2))
+		self.assertEqual(len(caught), 1)
+		self.assertTrue(issubclass(caught[0].category, NPlusOneWarning))
+		self.assertTrue('TestUser.device' in str(caught[0].message))
+		self.assertEqual(caught[0].filename, __file__.replace('.pyc', '.py'))
+
+	def test_should_raise_if_it_should_fail(self):
+		self.assertRaises(
+			NPlusOneError, self.load_devices, self.users,
+			NPlusOneDetector(threshold=2, fail=True)
+		)
+
+	def test_should_report_the_relation_and_the_calling_site(self):
+		with warnings.catch_warnings(record=True):
+			warnings.simplefilter('always')
+			detector = self.load_devices(
+				self.users, NPlusOneDetector(threshold=2)
+			)
+		relation, filename, lineno, count = detector.report()[0]
+		self.assertEqual(relation, 'TestUser.device')
+		self.assertEqual(count, 3)
+		self.assertEqual(
+			linecache.getline(filename, lineno).strip(), 'user.device'
+		)
+
+	def test_should_tolerate_searches_up_to_the_threshold(self):
+		detector = self.load_devices(self.users, NPlusOneDetector(threshold=3))
+		self.assertEqual(detector.report(), [])
+
+	def test_should_not_count_prefetched_relations(self):
+		detector = self.load_devices(
+			TestUser.find_all(prefetch=('device', )),
+			NPlusOneDetector(threshold=0, fail=True)
+		)
+		self.assertEqual(detector.counts, {})
+
+	def test_should_count_the_many_to_many_fields(self):
+		setup_prefetch_relations(self, True)
+		detector = NPlusOneDetector(threshold=0)
+		with warnings.catch_warnings(record=True):
+			warnings.simplefilter('always')
+			with detector:
+				for user in TestMultipleUser.find_all():
+					user.devices
+				for phone in TestPhone.find_all():
+					phone.testmultipleusers
+		self.assertEqual(
+			sorted([ i[0] for i in detector.report() ]),
+			[ 'TestMultipleUser.devices', 'TestPhone.testmultipleusers' ]
+		)
+
+	def test_should_count_nothing_without_a_detector(self):
+		detector = NPlusOneDetector(threshold=0, fail=True)
+		for user in self.users:
+			user.device
+		self.assertEqual(detector.counts, {})
+
+class TestNamedUser(TestUser):
+	"""
+	This class declares less attributes than its parent and an attribute whose
+	name is already used by a method.
+	"""
+	attributes = (
+		'userID',
+		'name',
+		'save',
+	)
+
+class StoringTheAttributesInSlots(unittest.TestCase):
+	def setUp(self):
+		Base.connection = LdapStubber()
+		new_user().save()
+		self.user = TestUser.find_by_id('user1')
+
+	def test_should_not_store_the_attributes_in_the_dict(self):
+		self.assertEqual(
+			[ i for i in TestUser._slots if i in self.user.__dict__ ], []
+		)
+		self.assertEqual(len(self.user._values), len(TestUser._slots))
+
+	def test_should_read_and_write_the_attributes(self):
+		self.assertEqual(self.user.userID, 'user1')
+		self.user.mail = 'new@example.com'
+		self.assertEqual(self.user.mail, 'new@example.com')
+
+	def test_should_keep_the_property_links_working(self):
+		self.user.user_mail = 'linked@example.com'
+		self.assertEqual(self.user.mail, 'linked@example.com')
+		self.assertEqual(self.user.user_name, 'the_user')
+
+	def test_should_intern_the_attribute_names(self):
+		name = ''.join([ 'user', 'ID' ])
+		self.assertTrue(TestUser.userID.name is intern(name))
+
+	def test_should_save_the_attributes(self):
+		self.user.mail = 'new@example.com'
+		self.user.save()
+		self.assertEqual(
+			TestUser.find_by_id('user1').mail, 'new@example.com'
+		)
+
+class StoringTheAttributesOfASubclass(unittest.TestCase):
+	def setUp(self):
+		self.user = TestNamedUser({
+			'userID': 'user1', 'name': 'the_user', 'save': 'saved',
+		})
+
+	def test_should_hide_the_attributes_of_the_parent(self):
+		self.assertFalse(hasattr(self.user, 'mail'))
+
+	def test_should_store_attributes_named_like_methods_in_the_dict(self):
+		self.assertEqual(self.user.__dict__['save'], 'saved')
+		self.assertTrue(callable(TestNamedUser.save))
+		self.assertEqual(self.user._values, [ 'user1' ])
+
+class PicklingAUser(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		new_multiple_user({ 'deviceID': [ 'phone1', 'phone2' ] }).save()
+
+	def round_trip(self, user, protocol):
+		return pickle.loads(pickle.dumps(user, protocol))
+
+	def test_should_restore_the_attributes_with_every_protocol(self):
+		user = TestMultipleUser.find_by_id('user1')
+		user.user_name = 'renamed'
+		for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+			copy = self.round_trip(user, protocol)
+			self.assertEqual(copy.dn, user.dn)
+			self.assertEqual(copy.deviceID, [ 'phone1', 'phone2' ])
+			self.assertEqual(copy.user_name, 'renamed')
+			self.assertEqual(
+				copy._collect_changed_attrs(), user._collect_changed_attrs()
+			)
+
+	def test_should_restore_lazily_loaded_users(self):
+		user = LazyMultipleUser.find_by_id('user1')
+		for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+			copy = self.round_trip(user, protocol)
+			self.assertEqual(copy.mail, 'user@example.com')
+			self.assertFalse(unloaded in copy._values)
+			copy.update()
+		self.assertEqual(Base.connection.modifications, [])
+
+class LazyMultipleUser(TestMultipleUser):
+	"""
+	This class decodes the attributes of loaded users on access.
+	"""
+	lazy_attributes = True
+
+class LoadingAttributesLazily(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		new_multiple_user({ 'deviceID': [ 'phone1', 'phone2' ] }).save()
+		self.user = LazyMultipleUser.find_by_id('user1')
+
+	def test_should_not_decode_the_attributes_when_loading(self):
+		self.assertEqual(
+			self.user._values, [ unloaded ] * len(LazyMultipleUser._slots)
+		)
+
+	def test_should_decode_only_the_accessed_attributes(self):
+		self.assertEqual(self.user.mail, 'user@example.com')
+		self.assertEqual(
+			self.user._values.count(unloaded),
+			len(LazyMultipleUser._slots) - 1
+		)
+
+	def test_should_decode_like_an_eagerly_loaded_user(self):
+		user = TestMultipleUser.find_by_id('user1')
+		for key in TestMultipleUser.attributes:
+			self.assertEqual(getattr(self.user, key), getattr(user, key))
+		self.assertEqual(self.user.user_name, user.user_name)
+
+	def test_should_only_send_the_changed_attribute(self):
+		self.user.mail = 'new@example.com'
+		self.user.update()
+		self.assertEqual(Base.connection.modifications, [
+			( 'userID=user1,ou=user,o=schule', [
+				( ldap.MOD_REPLACE, 'mail', 'new@example.com' )
+			])
+		])
+
+	def test_should_detect_changes_of_lists_in_place(self):
+		self.user.deviceID.append('phone3')
+		self.user.update()
+		self.assertEqual(Base.connection.modifications[0][1], [
+			( ldap.MOD_ADD, 'deviceID', [ 'phone3' ] ),
+		])
+
+	def test_should_not_send_anything_without_changes(self):
+		self.user.update()
+		self.assertEqual(Base.connection.modifications, [])
+
+class GeneratingTheAttributeMapsOfAClass(unittest.TestCase):
+	def test_should_map_the_links_to_the_ldap_names(self):
+		self.assertEqual(TestUser._links['user_mail'], 'mail')
+		self.assertEqual(TestUser._ldap_name('user_mail'), 'mail')
+
+	def test_should_map_attributes_and_links_to_the_same_slot(self):
+		self.assertEqual(
+			TestUser._positions['user_mail'], TestUser._slots['mail']
+		)
+
+	def test_should_know_every_name_of_the_constructor(self):
+		self.assertEqual(TestUser._names, frozenset([
+			'userID', 'deviceID', 'name', 'mail',
+			'user_id', 'device_id', 'user_name', 'user_mail',
+		]))
+
+	def test_should_assign_links_and_unpack_single_values(self):
+		user = TestUser({ 'user_id': [ 'user1' ], 'unknown': 'ignored' })
+		self.assertEqual(user.userID, 'user1')
+		self.assertFalse(hasattr(user, 'unknown'))
+
+	def test_should_collect_the_attributes_in_their_order(self):
+		user = new_user({ 'name': u'J\xfcrgen' })
+		attrs = user._collect_attrs()
+		self.assertEqual(
+			[ i[1] for i in attrs ],
+			list(TestUser.attributes) + [ 'objectClass' ]
+		)
+		self.assertTrue(
+			( ldap.MOD_REPLACE, 'name', 'J\xc3\xbcrgen' ) in attrs
+		)
+
+class EncodingValues(unittest.TestCase):
+	def test_should_encode_unicode_in_utf8(self):
+		self.assertEqual(encode_value(u'\xe4'), '\xc3\xa4')
+
+	def test_should_encode_booleans(self):
+		self.assertEqual(encode_value(True), 'TRUE')
+		self.assertEqual(encode_value(False), 'FALSE')
+
+	def test_should_encode_the_values_of_lists(self):
+		self.assertEqual(encode_value([ u'a', True ]), [ 'a', 'TRUE' ])
+
+	def test_should_encode_subclasses(self):
+		class Values(list):
+			pass
+		self.assertEqual(encode_value(Values([ u'a' ])), [ 'a' ])
+
+	def test_should_keep_other_values(self):
+		self.assertEqual(encode_value('a'), 'a')
+		self.assertEqual(encode_value(1), 1)
+
+class NumberedUser(TestMultipleUser):
+	"""
+	This class sends the integers of its attributes as strings.
+	"""
+	def _encode_val(self, val):
+		if isinstance(val, int):
+			return str(val)
+		return TestMultipleUser._encode_val(self, val)
+
+class EncodingValuesOfASubclass(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		self.user = NumberedUser({ 'userID': 'user1', 'deviceID': [ 1, 2 ] })
+
+	def test_should_encode_every_value_of_a_list(self):
+		self.assertTrue(
+			( ldap.MOD_REPLACE, 'deviceID', [ '1', '2' ] )
+			in self.user._collect_attrs()
+		)
+
+	def test_should_encode_the_changed_values_of_a_list(self):
+		self.user.save()
+		self.user.deviceID = [ 1, 3 ]
+		self.assertEqual(self.user._collect_changed_attrs(), [
+			( ldap.MOD_DELETE, 'deviceID', [ '2' ] ),
+			( ldap.MOD_ADD, 'deviceID', [ '3' ] ),
+		])
+
+class DeliveringTheEventsOfSavesDeferred(unittest.TestCase):
+	def setUp(self):
+		Base.connection = LdapStubber()
+		self.delivery = DeferredDelivery(workers=3)
+		self.received = []
+		TestPhone.events.register('after_save', self.saved, self.delivery)
+
+	def tearDown(self):
+		TestPhone.events.unregister('after_save', self.saved)
+		self.delivery.close()
+
+	def saved(self, event, instance):
+		self.received.append( ( instance.dn, instance.name ) )
+
+	def test_should_deliver_every_save(self):
+		phones = [ new_phone({ 'phoneID': 'phone%d' % i }) for i in range(3) ]
+		for phone in phones * 2:
+			phone.save()
+		self.assertEqual(self.delivery.drain(), [])
+		self.assertEqual(
+			sorted([ i[0] for i in self.received ]),
+			sorted([ i.dn for i in phones * 2 ])
+		)
+
+	def test_should_order_the_events_by_the_dn(self):
+		phone = new_phone()
+		self.assertEqual(
+			self.delivery.key('after_save', phone),
+			'phoneid=phone1,ou=devices,o=schule'
+		)
+		self.assertEqual(
+			instance_dn('after_save', phone),
+			'phoneid=phone1,ou=devices,o=schule'
+		)
+
+	def test_should_deliver_the_item_as_it_was_saved(self):
+		phone = new_phone()
+		release = threading.Event()
+		self.delivery.put(
+			lambda event, item: release.wait(), 'after_save', ( phone, )
+		)
+		phone.save()
+		phone.name = 'changed'
+		phone.dn = 'phoneID=other,ou=devices,o=schule'
+		release.set()
+		self.delivery.drain()
+		self.assertEqual(self.received, [
+			( 'phoneID=phone1,ou=devices,o=schule', 'the_phone' )
+		])
+
+	def test_should_keep_the_identity_map_up_to_date_synchronously(self):
+		with IdentityMap() as identity_map:
+			phone = new_phone()
+			phone.save()
+			self.assertTrue(
+				identity_map.get(TestPhone, phone.dn) is phone
+			)
+		self.delivery.drain()
+		self.assertEqual(self.received, [ ( phone.dn, phone.name ) ])
+
+class UpdatingAReferencedPhone(unittest.TestCase):
+	def setUp(self):
+		Base.connection = RecordingStubber()
+		new_phone().save()
+		new_user().save()
+		new_multiple_user({
+			'userID': 'user2', 'deviceID': [ 'phone1', 'phone2' ]
+		}).save()
+		self.phone = TestPhone.find_by_id('phone1')
+		Base.connection.calls = []
+		Base.connection.searches = []
+		Base.connection.modifications = []
+
+	def test_should_not_search_if_it_was_not_renamed(self):
+		self.phone.name = 'new name'
+		self.phone.save()
+		self.assertEqual(Base.connection.calls, [ 'modify_s' ])
+
+	def test_should_search_the_referencing_items_once_per_relation(self):
+		self.phone.phoneID = 'phone_new_id'
+		self.phone.save()
+		self.assertEqual(Base.connection.calls.count('search_s'), 2)
+		self.assertEqual(
+			sorted([ i[3] for i in Base.connection.searches ]),
+			[ [ 'userID', 'deviceID' ], [ 'userID', 'deviceID' ] ]
+		)
+
+	def test_should_only_send_the_changed_foreign_keys(self):
+		self.phone.phoneID = 'phone_new_id'
+		self.phone.save()
+		self.assertEqual(sorted(Base.connection.modifications), [
+			( 'userID=user1,ou=user,o=schule', [
+				( ldap.MOD_REPLACE, 'deviceID', 'phone_new_id' )
+			] ),
+			( 'userID=user2,ou=user,o=schule', [
+				( ldap.MOD_DELETE, 'deviceID', [ 'phone1' ] ),
+				( ldap.MOD_ADD, 'deviceID', [ 'phone_new_id' ] ),
+			] ),
+		])
+
+class BulkPhone(Base):
+	object_classes = (
+		'bulkPhone',
+	)
+	attributes = (
+		'phoneID',
+		'name',
+	)
+	dn_attribute = 'phoneID'
+	prefix = 'ou=devices,o=bulk'
+	scope = ldap.SCOPE_ONELEVEL
+
+class BulkUser(Base):
+	"""
+	This class references its phones without cascading signals.
+	"""
+	object_classes = (
+		'bulkUser',
+	)
+	attributes = (
+		'userID',
+		'deviceID',
+	)
+	dn_attribute = 'userID'
+	prefix = 'ou=user,o=bulk'
+	scope = ldap.SCOPE_ONELEVEL
+	devices = ManyToManyField(
+		BulkPhone,
+		my_attr='deviceID',
+		other_attr='phoneID',
+		cascade_signals=False
+	)
+
+def setup_bulk_relations(tester):
+	Base.connection = RecordingStubber()
+	for i in range(3):
+		BulkPhone({ 'phoneID': 'phone%d' % i }).save()
+	for i in range(3):
+		BulkUser({
+			'userID': 'user%d' % i,
+			'deviceID': sorted(set([ 'phone%d' % i, 'phone1' ])),
+		}).save()
+	tester.updated = []
+	BulkUser.events.register('after_update', tester.record_update)
+	Base.connection.calls = []
+	Base.connection.modifications = []
+
+class DeletingAPhoneWithoutCascadingSignals(unittest.TestCase):
+	def setUp(self):
+		setup_bulk_relations(self)
+		BulkPhone.find_by_id('phone1').delete()
+
+	def tearDown(self):
+		BulkUser.events.unregister('after_update', self.record_update)
+
+	def record_update(self, event, instance):
+		self.updated.append(instance)
+
+	def test_should_remove_the_id_from_every_user(self):
+		self.assertEqual(
+			sorted([ ( i.userID, i.deviceID ) for i in BulkUser.find_all() ]),
+			[ ( 'user0', 'phone0' ), ( 'user1', [] ), ( 'user2', 'phone2' ) ]
+		)
+
+	def test_should_pipeline_single_value_deletions(self):
+		calls = [
+			i for i in Base.connection.calls
+			if i in ( 'modify_ext', 'result3' )
+		]
+		self.assertEqual(calls, [ 'modify_ext' ] * 3 + [ 'result3' ] * 3)
+		self.assertEqual(Base.connection.modifications[0][1], [
+			( ldap.MOD_DELETE, 'deviceID', [ 'phone1' ] ),
+		])
+
+	def test_should_not_send_events_for_the_users(self):
+		self.assertEqual(self.updated, [])
+
+class RenamingAPhoneWithoutCascadingSignals(unittest.TestCase):
+	def setUp(self):
+		setup_bulk_relations(self)
+		self.identity_map = IdentityMap()
+		with self.identity_map:
+			self.user = BulkUser.find_by_id('user0')
+			phone = BulkPhone.find_by_id('phone1')
+			phone.phoneID = 'phone_new_id'
+			phone.save()
+
+	def tearDown(self):
+		BulkUser.events.unregister('after_update', self.record_update)
+
+	def record_update(self, event, instance):
+		self.updated.append(instance)
+
+	def test_should_replace_the_id_on_every_user(self):
+		self.assertEqual(
+			dict([ ( i.userID, i.deviceID ) for i in BulkUser.find_all() ]), {
+				'user0': [ 'phone0', 'phone_new_id' ],
+				'user1': 'phone_new_id',
+				'user2': [ 'phone2', 'phone_new_id' ],
+			}
+		)
+
+	def test_should_delete_and_add_the_single_values(self):
+		self.assertEqual(Base.connection.modifications[0][1], [
+			( ldap.MOD_DELETE, 'deviceID', [ 'phone1' ] ),
+			( ldap.MOD_ADD, 'deviceID', [ 'phone_new_id' ] ),
+		])
+
+	def test_should_update_the_users_in_the_identity_map(self):
+		self.assertEqual(self.user.deviceID, [ 'phone0', 'phone_new_id' ])
+		Base.connection.calls = []
+		self.user.update()
+		self.assertEqual(Base.connection.calls, [])
+
+	def test_should_not_send_events_for_the_users(self):
+		self.assertEqual(self.updated, [])
+
+class UnitOrganization(Base):
+	object_classes = (
+		'organizationalUnit',
+	)
+	attributes = (
+		'ou',
+	)
+	dn_attribute = 'ou'
+	prefix = 'o=unit'
+	scope = ldap.SCOPE_ONELEVEL
+
+class UnitPerson(Base):
+	object_classes = (
+		'person',
+	)
+	attributes = (
+		'cn',
+		'sn',
+	)
+	dn_attribute = 'cn'
+	prefix = 'ou=people,o=unit'
+	scope = ldap.SCOPE_ONELEVEL
+
+def setup_unit_of_work(tester):
+	Base.connection = RecordingStubber()
+	tester.phone = new_phone()
+	tester.phone.save()
+	tester.user = new_user()
+	tester.user.save()
+	Base.connection.calls = []
+	Base.connection.modifications = []
+
+def sent_writes():
+	return [ i for i in Base.connection.calls if i in (
+		'add_ext', 'modify_ext', 'delete_ext', 'rename', 'result3', 'extop_s'
+	) ]
+
+class UsingAUnitOfWork(unittest.TestCase):
+	def setUp(self):
+		setup_unit_of_work(self)
+		self.unit_of_work = UnitOfWork(transactions=False)
+
+	def test_should_write_when_the_block_is_left(self):
+		with self.unit_of_work:
+			self.unit_of_work.save(new_user({ 'userID': 'user2' }))
+			self.assertEqual(sent_writes(), [])
+		self.assertEqual(TestUser.find_by_id('user2').userID, 'user2')
+		self.assertEqual(self.unit_of_work.errors, [])
+
+	def test_should_pipeline_the_writes_of_a_batch(self):
+		with self.unit_of_work:
+			for i in range(2, 5):
+				self.unit_of_work.save(new_user({ 'userID': 'user%d' % i }))
+		self.assertEqual(sent_writes(), [ 'add_ext' ] * 3 + [ 'result3' ] * 3)
+
+	def test_should_be_an_identity_map(self):
+		with self.unit_of_work:
+			user = TestUser.find_by_id('user1')
+			self.assertTrue(TestUser.find_by_id('user1') is user)
+
+	def test_should_coalesce_the_changes_of_an_entry(self):
+		other = TestUser.find_by_id('user1')
+		with self.unit_of_work:
+			self.user.name = 'new_name'
+			self.unit_of_work.save(self.user)
+			other.mail = 'new@example.com'
+			self.unit_of_work.save(other)
+			self.unit_of_work.save(self.user)
+		self.assertEqual(sent_writes(), [ 'modify_ext', 'result3' ])
+		user = TestUser.find_by_id('user1')
+		self.assertEqual(
+			( user.name, user.mail ), ( 'new_name', 'new@example.com' )
+		)
+
+	def test_should_rename_before_modifying(self):
+		with self.unit_of_work:
+			self.phone.phoneID = 'phone2'
+			self.phone.name = 'new_name'
+			self.unit_of_work.save(self.phone)
+		self.assertEqual(sent_writes()[:2], [ 'rename', 'result3' ])
+		self.assertEqual(self.phone.dn, 'phoneID=phone2,ou=devices,o=schule')
+		self.assertEqual(TestPhone.find_by_id('phone2').name, 'new_name')
+
+	def test_should_cascade_renames_into_the_unit_of_work(self):
+		with self.unit_of_work:
+			self.phone.phoneID = 'phone2'
+			self.unit_of_work.save(self.phone)
+		self.assertEqual(sent_writes(), [
+			'rename', 'result3', 'modify_ext', 'result3'
+		])
+		self.assertEqual(TestUser.find_by_id('user1').deviceID, 'phone2')
+
+	def test_should_cascade_direct_writes_directly(self):
+		def rename():
+			with self.unit_of_work:
+				self.phone.phoneID = 'phone2'
+				self.phone.save()
+				self.assertEqual(
+					TestUser.find_by_id('user1').deviceID, 'phone2'
+				)
+				raise ValueError()
+		self.assertRaises(ValueError, rename)
+		self.assertEqual(TestUser.find_by_id('user1').deviceID, 'phone2')
+
+	def test_should_delete_after_updating_the_referrers(self):
+		with self.unit_of_work:
+			self.unit_of_work.delete(self.phone)
+		self.assertEqual(sent_writes(), [
+			'modify_ext', 'result3', 'delete_ext', 'result3'
+		])
+		self.assertEqual(self.unit_of_work.errors, [])
+		self.assertEqual(TestUser.find_by_id('user1').deviceID, [])
+		self.assertEqual(TestPhone.find_by_id('phone1'), None)
+
+	def test_should_not_save_deleted_entries(self):
+		with self.unit_of_work:
+			self.user.name = 'new_name'
+			self.unit_of_work.save(self.user)
+			self.unit_of_work.delete(self.user)
+		self.assertEqual(sent_writes(), [ 'delete_ext', 'result3' ])
+
+	def test_should_create_parents_before_children(self):
+		with self.unit_of_work:
+			self.unit_of_work.save(UnitPerson({ 'cn': 'someone', 'sn': 'one' }))
+			self.unit_of_work.save(UnitOrganization({ 'ou': 'people' }))
+		self.assertEqual([ i.dn for i in Base.connection.elements[-2:] ], [
+			'ou=people,o=unit', 'cn=someone,ou=people,o=unit'
+		])
+
+	def test_should_delete_children_before_parents(self):
+		organization = UnitOrganization({ 'ou': 'people' })
+		organization.save()
+		person = UnitPerson({ 'cn': 'someone', 'sn': 'one' })
+		person.save()
+		with self.unit_of_work:
+			self.unit_of_work.delete(organization)
+			self.unit_of_work.delete(person)
+		self.assertEqual(self.unit_of_work.errors, [])
+		self.assertEqual(UnitOrganization.find_all(), [])
+
+	def test_should_update_existing_entries_which_are_created(self):
+		with self.unit_of_work:
+			self.unit_of_work.save(new_user({ 'name': 'other_name' }))
+		self.assertEqual(sent_writes(), [
+			'add_ext', 'result3', 'modify_ext', 'result3'
+		])
+		self.assertEqual(TestUser.find_by_id('user1').name, 'other_name')
+
+	def test_should_send_the_after_events_after_writing(self):
+		tester = SignalTester({ 'userID': 'signals' })
+		with self.unit_of_work:
+			self.unit_of_work.save(tester)
+			self.assertFalse(tester.ev_before_save)
+		self.assertTrue(tester.ev_before_save and tester.ev_before_create)
+		self.assertTrue(tester.ev_after_create and tester.ev_after_save)
+		self.assertFalse(tester.ev_before_update or tester.ev_after_update)
+
+	def test_should_report_failed_writes(self):
+		phone = new_phone({ 'phoneID': 'phone2' })
+		phone.save()
+		with self.unit_of_work:
+			phone.phoneID = 'phone1'
+			self.unit_of_work.save(phone)
+		instance, error = self.unit_of_work.errors[0]
+		self.assertTrue(instance is phone)
+		self.assertTrue(isinstance(error, ldap.ALREADY_EXISTS))
+		self.assertEqual(phone.dn, 'phoneID=phone2,ou=devices,o=schule')
+
+	def test_should_not_write_if_the_block_raises(self):
+		def save():
+			with self.unit_of_work:
+				self.unit_of_work.save(new_user({ 'userID': 'user2' }))
+				raise ValueError()
+		self.assertRaises(ValueError, save)
+		self.assertEqual(sent_writes(), [])
+		self.assertEqual(TestUser.find_by_id('user2'), None)
+
+class CascadingIntoAUnitOfWork(unittest.TestCase):
+	def setUp(self):
+		setup_bulk_relations(self)
+
+	def tearDown(self):
+		BulkUser.events.unregister('after_update', self.record_update)
+
+	def record_update(self, event, instance):
+		self.updated.append(instance)
+
+	def test_should_send_the_modifications_with_the_other_writes(self):
+		with UnitOfWork(transactions=False) as unit_of_work:
+			phone = BulkPhone.find_by_id('phone1')
+			phone.phoneID = 'phone9'
+			unit_of_work.save(phone)
+			self.assertEqual(sent_writes(), [])
+		self.assertEqual(
+			sent_writes(),
+			[ 'rename', 'result3' ] + [ 'modify_ext' ] * 3 + [ 'result3' ] * 3
+		)
+		self.assertEqual(BulkUser.find_by_id('user1').deviceID, 'phone9')
+		self.assertEqual(self.updated, [])
+
+	def test_should_modify_directly_if_the_phone_is_saved_directly(self):
+		with UnitOfWork(transactions=False):
+			phone = BulkPhone.find_by_id('phone1')
+			phone.phoneID = 'phone9'
+			phone.save()
+			self.assertEqual(BulkUser.find_by_id('user1').deviceID, 'phone9')
+
+class SendingAUnitOfWorkInATransaction(unittest.TestCase):
+	def setUp(self):
+		setup_unit_of_work(self)
+		self.unit_of_work = UnitOfWork()
+
+	def test_should_send_all_writes_within_one_transaction(self):
+		with self.unit_of_work:
+			self.unit_of_work.save(new_user({ 'userID': 'user2' }))
+			self.unit_of_work.delete(self.phone)
+		self.assertEqual(sent_writes(), [
+			'extop_s', 'add_ext', 'modify_ext', 'delete_ext',
+			'result3', 'result3', 'result3', 'extop_s',
+		])
+		self.assertEqual(self.unit_of_work.errors, [])
+		self.assertEqual(TestUser.find_by_id('user2').deviceID, 'phone1')
+		self.assertEqual(TestPhone.find_by_id('phone1'), None)
+
+	def test_should_update_existing_entries_which_are_created(self):
+		user = new_user({ 'name': 'other_name' })
+		with self.unit_of_work:
+			self.unit_of_work.save(user)
+			self.unit_of_work.save(new_user({ 'userID': 'user2' }))
+		self.assertEqual(self.unit_of_work.errors, [])
+		self.assertEqual(TestUser.find_by_id('user1').name, 'other_name')
+		self.assertEqual(TestUser.find_by_id('user2').userID, 'user2')
+		self.assertEqual(user.dn, 'userID=user1,ou=user,o=schule')
+		self.assertEqual(sent_writes().count('extop_s'), 4)
+
+	def test_should_write_nothing_if_the_transaction_fails(self):
+		phone = new_phone({ 'phoneID': 'phone2' })
+		phone.save()
+		user = new_user({ 'userID': 'user2' })
+		with self.unit_of_work:
+			self.unit_of_work.save(user)
+			phone.phoneID = 'phone1'
+			self.unit_of_work.save(phone)
+		self.assertEqual(
+			[ i[0] for i in self.unit_of_work.errors ], [ user, phone ]
+		)
+		self.assertEqual(TestUser.find_by_id('user2'), None)
+		self.assertFalse(hasattr(user, 'dn'))
 
 if __name__ == '__main__':
 	unittest.main()
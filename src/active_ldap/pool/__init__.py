@@ -0,0 +1,3 @@
+"""
+This module implements a thread-safe pool of ldap-connections.
+"""
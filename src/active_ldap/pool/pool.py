@@ -0,0 +1,360 @@
+"""
+This module includes the connection pool which can be used instead of a single
+ldap-connection.
+"""
+import ldap
+import threading
+import time
+from contextlib import contextmanager
+
+class PoolTimeout(ldap.TIMEOUT):
+	"""
+	This exception is raised if no connection could be checked out of the pool
+	within the checkout timeout.
+	"""
+
+class PooledConnection(object):
+	"""
+	This class represents a connection within the pool together with the
+	timestamps which are needed for expiring it.
+	"""
+
+	def __init__(self, connection, now):
+		"""
+		Constructor.
+
+		connection -- the bound ldap-connection
+		now -- the current timestamp
+		"""
+		self.connection = connection
+		self.created = now
+		self.last_used = now
+
+class ConnectionPool(object):
+	"""
+	This class holds up to size bound connections which are created by the
+	factory. It offers the same operations as a single ldap-connection, so it
+	can be assigned to Base.connection. Every synchronous operation checks a
+	connection out, runs on it and checks it back in. An asynchronous
+	operation (e.g. search_ext) keeps its connection until its final result
+	was read with result3.
+
+	All operations of a thread are pinned to the same connection while the
+	thread holds a reservation (see reserve) or waits for asynchronous
+	results, so message ids and paged-results cookies stay valid.
+	"""
+
+	synchronous = (
+		'search_s', 'search_st', 'search_ext_s', 'add_s', 'add_ext_s',
+		'modify_s', 'modify_ext_s', 'delete_s', 'delete_ext_s', 'modrdn_s',
+		'rename_s', 'compare_s', 'extop_s', 'whoami_s',
+	)
+	"""
+	The names of the synchronous operations which are offered by the pool.
+	"""
+
+	asynchronous = (
+		'search_ext', 'add_ext', 'modify_ext', 'delete_ext', 'rename', 'extop',
+	)
+	"""
+	The names of the asynchronous operations which are offered by the pool.
+	Their results must be fetched with result3.
+	"""
+
+	partial_results = (
+		ldap.RES_SEARCH_ENTRY, ldap.RES_SEARCH_REFERENCE, ldap.RES_INTERMEDIATE,
+	)
+	"""
+	The types of results which are followed by further results of the same
+	operation.
+	"""
+
+	def __init__(self, factory, size=5, idle_timeout=None, max_lifetime=None,
+				 checkout_timeout=None,
+				 reconnect_errors=(ldap.SERVER_DOWN, ldap.CONNECT_ERROR)):
+		"""
+		Constructor.
+
+		factory -- a callable which returns a new bound connection
+		size -- the maximum number of connections
+		idle_timeout -- the number of seconds after which an unused connection
+						is closed
+		max_lifetime -- the number of seconds after which a connection is
+						closed, regardless of its usage
+		checkout_timeout -- the number of seconds to wait for a free
+							connection before raising PoolTimeout. None waits
+							forever.
+		reconnect_errors -- the exceptions after which the connection is
+							replaced by a newly bound one and the operation is
+							retried once
+		"""
+		self.factory = factory
+		self.size = size
+		self.idle_timeout = idle_timeout
+		self.max_lifetime = max_lifetime
+		self.checkout_timeout = checkout_timeout
+		self.reconnect_errors = reconnect_errors
+		self.idle = []
+		self.created = 0
+		self._condition = threading.Condition()
+		self._local = threading.local()
+
+	def __getattr__(self, name):
+		"""
+		Returns the pooled version of the given ldap-operation.
+
+		name -- the name of the operation, e.g. search_s
+		"""
+		if name in self.synchronous:
+			return lambda *args, **kwds: self._call(name, *args, **kwds)
+		if name in self.asynchronous:
+			return lambda *args, **kwds: self._start(name, *args, **kwds)
+		raise AttributeError(name)
+
+	def checkout(self):
+		"""
+		Returns a PooledConnection. If every connection is in use and the pool
+		is full it waits until another thread checks a connection in.
+		"""
+		deadline = None
+		if self.checkout_timeout is not None:
+			deadline = time.time() + self.checkout_timeout
+		self._condition.acquire()
+		try:
+			while True:
+				while self.idle:
+					entry = self.idle.pop()
+					if not self._is_expired(entry):
+						return entry
+					self._close(entry)
+				if self.created < self.size:
+					self.created += 1
+					break
+				if deadline is None:
+					self._condition.wait()
+					continue
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					raise PoolTimeout("No free connection in the pool")
+				self._condition.wait(remaining)
+		finally:
+			self._condition.release()
+		try:
+			return PooledConnection(self.factory(), time.time())
+		except:
+			self._forget()
+			raise
+
+	def checkin(self, entry):
+		"""
+		Returns the given PooledConnection to the pool.
+
+		entry -- the PooledConnection which was checked out
+		"""
+		entry.last_used = time.time()
+		if self._is_expired(entry):
+			self._close(entry)
+			return
+		self._condition.acquire()
+		try:
+			self.idle.append(entry)
+			self._condition.notify()
+		finally:
+			self._condition.release()
+
+	@contextmanager
+	def reserve(self):
+		"""
+		Pins a connection to the current thread. Every operation of the thread
+		within the with-block uses this connection. Reservations can be
+		nested.
+		"""
+		entry = self._acquire()
+		try:
+			yield entry.connection
+		finally:
+			self._release()
+
+	def result3(self, msgid=ldap.RES_ANY, *args, **kwds):
+		"""
+		Returns the result of an asynchronous operation which was started by
+		the current thread. The connection is given back to the pool when the
+		final result of the operation was read, but not after partial results
+		(e.g. single entries with all=0) or timeouts.
+
+		msgid -- the message id of the operation or ldap.RES_ANY
+		"""
+		entry = getattr(self._local, 'entry', None)
+		if entry is None:
+			raise RuntimeError("No outstanding asynchronous operation")
+		try:
+			result = entry.connection.result3(msgid, *args, **kwds)
+		except ldap.TIMEOUT:
+			raise
+		except ldap.LDAPError, error:
+			if msgid == ldap.RES_ANY and error.args and \
+			   isinstance(error.args[0], dict):
+				msgid = error.args[0].get('msgid', msgid)
+			self._finish(msgid)
+			raise
+		if result[0] is not None and result[0] not in self.partial_results:
+			self._finish(result[2])
+		return result
+
+	def close(self):
+		"""
+		Unbinds all idle connections.
+		"""
+		self._condition.acquire()
+		try:
+			idle, self.idle = self.idle, []
+		finally:
+			self._condition.release()
+		for entry in idle:
+			self._close(entry)
+
+	###########################################################################
+	# Helper methods
+	###########################################################################
+	def _call(self, name, *args, **kwds):
+		"""
+		Runs the synchronous operation on a pooled connection. If the
+		connection broke down and is not pinned by other operations it is
+		replaced and the operation is retried once.
+
+		name -- the name of the operation
+		"""
+		entry = self._acquire()
+		try:
+			try:
+				return getattr(entry.connection, name)(*args, **kwds)
+			except self.reconnect_errors:
+				if self._local.depth > 1:
+					raise
+				self._reconnect(entry)
+				return getattr(entry.connection, name)(*args, **kwds)
+		finally:
+			self._release()
+
+	def _start(self, name, *args, **kwds):
+		"""
+		Starts the asynchronous operation on the connection of the current
+		thread. The connection stays pinned until result3 was called.
+
+		name -- the name of the operation
+		"""
+		entry = self._acquire()
+		try:
+			msgid = getattr(entry.connection, name)(*args, **kwds)
+		except:
+			self._release()
+			raise
+		self._local.msgids.add(msgid)
+		return msgid
+
+	def _finish(self, msgid):
+		"""
+		Releases the connection of the given asynchronous operation after its
+		final result was read.
+
+		msgid -- the message id of the operation
+		"""
+		if msgid in self._local.msgids:
+			self._local.msgids.remove(msgid)
+			self._release()
+
+	def _acquire(self):
+		"""
+		Returns the connection which is pinned to the current thread or checks
+		out a new one.
+		"""
+		entry = getattr(self._local, 'entry', None)
+		if entry is None:
+			entry = self.checkout()
+			self._local.entry = entry
+			self._local.depth = 0
+			self._local.msgids = set()
+		self._local.depth += 1
+		return entry
+
+	def _release(self):
+		"""
+		Releases one use of the pinned connection and checks it in when it is
+		not used by the current thread anymore.
+		"""
+		self._local.depth -= 1
+		if self._local.depth == 0:
+			entry = self._local.entry
+			self._local.entry = None
+			self.checkin(entry)
+
+	def _reconnect(self, entry):
+		"""
+		Replaces the connection of the given entry with a newly bound one.
+
+		entry -- the PooledConnection whose connection is broken
+		"""
+		self._unbind(entry.connection)
+		entry.connection = self.factory()
+		entry.created = entry.last_used = time.time()
+
+	def _is_expired(self, entry):
+		"""
+		Returns true if the given entry was idle for too long or exceeded its
+		maximum lifetime.
+
+		entry -- the PooledConnection
+		"""
+		now = time.time()
+		if self.idle_timeout is not None and \
+		   now - entry.last_used > self.idle_timeout:
+			return True
+		if self.max_lifetime is not None and \
+		   now - entry.created > self.max_lifetime:
+			return True
+		return False
+
+	def _close(self, entry):
+		"""
+		Unbinds the connection of the given entry and frees its place.
+
+		entry -- the PooledConnection which should be closed
+		"""
+		self._unbind(entry.connection)
+		self._forget()
+
+	def _forget(self):
+		"""
+		Frees the place of a connection and wakes up a waiting thread.
+		"""
+		self._condition.acquire()
+		try:
+			self.created -= 1
+			self._condition.notify()
+		finally:
+			self._condition.release()
+
+	def _unbind(self, connection):
+		"""
+		Unbinds the given connection and ignores all errors.
+
+		connection -- the ldap-connection
+		"""
+		try:
+			connection.unbind_s()
+		except Exception:
+			pass
+
+@contextmanager
+def reserved(connection):
+	"""
+	Pins the connection of a pool to the current thread within the with-block.
+	Other connections are used as they are.
+
+	connection -- a ConnectionPool or a single ldap-connection
+	"""
+	if not hasattr(connection, 'reserve'):
+		yield connection
+		return
+	with connection.reserve():
+		yield connection
@@ -0,0 +1,233 @@
+import unittest
+import threading
+import ldap
+from pool import ConnectionPool, PoolTimeout, reserved
+
+class FakeConnection(object):
+	"""
+	This class represents a bound connection which records its calls.
+	"""
+	def __init__(self, number):
+		self.number = number
+		self.calls = []
+		self.unbound = False
+		self.fail = False
+		self.results = []
+
+	def search_s(self, *args):
+		if self.fail:
+			raise ldap.SERVER_DOWN()
+		self.calls.append(('search_s', args))
+		return self.number
+
+	def search_ext(self, *args, **kwds):
+		self.calls.append(('search_ext', args))
+		return len(self.calls)
+
+	def result3(self, msgid, all=1, timeout=None):
+		if self.results:
+			result = self.results.pop(0)
+			if isinstance(result, Exception):
+				raise result
+			return result
+		return ( ldap.RES_SEARCH_RESULT, [], msgid, [] )
+
+	def unbind_s(self):
+		self.unbound = True
+
+class ConnectionFactory(object):
+	def __init__(self):
+		self.connections = []
+
+	def __call__(self):
+		connection = FakeConnection(len(self.connections))
+		self.connections.append(connection)
+		return connection
+
+def new_pool(**kwds):
+	factory = ConnectionFactory()
+	return factory, ConnectionPool(factory, **kwds)
+
+class ANewPool(unittest.TestCase):
+	def setUp(self):
+		self.factory, self.pool = new_pool(size=2)
+
+	def test_should_not_create_connections(self):
+		self.assertEqual(self.factory.connections, [])
+
+	def test_should_create_a_connection_on_the_first_operation(self):
+		self.pool.search_s('o=base', ldap.SCOPE_SUBTREE, '(uid=a)')
+		self.assertEqual(len(self.factory.connections), 1)
+
+	def test_should_reuse_the_connection(self):
+		self.pool.search_s('o=base', ldap.SCOPE_SUBTREE, '(uid=a)')
+		self.pool.search_s('o=base', ldap.SCOPE_SUBTREE, '(uid=b)')
+		self.assertEqual(len(self.factory.connections), 1)
+		self.assertEqual(len(self.factory.connections[0].calls), 2)
+
+	def test_should_raise_on_unknown_operations(self):
+		self.assertRaises(AttributeError, lambda: self.pool.no_operation)
+
+class AFullPool(unittest.TestCase):
+	def setUp(self):
+		self.factory, self.pool = new_pool(size=2, checkout_timeout=0.01)
+		self.entries = [ self.pool.checkout(), self.pool.checkout() ]
+
+	def test_should_raise_a_timeout_on_checkout(self):
+		self.assertRaises(PoolTimeout, self.pool.checkout)
+
+	def test_should_hand_out_a_connection_after_checkin(self):
+		self.pool.checkin(self.entries[0])
+		self.assertEqual(self.pool.checkout(), self.entries[0])
+
+	def test_should_hand_out_connections_to_waiting_threads(self):
+		self.pool.checkout_timeout = None
+		result = []
+		thread = threading.Thread(
+			target=lambda: result.append(self.pool.checkout())
+		)
+		thread.start()
+		self.pool.checkin(self.entries[1])
+		thread.join(1)
+		self.assertEqual(result, [ self.entries[1] ])
+
+class ExpiringConnections(unittest.TestCase):
+	def setUp(self):
+		self.factory, self.pool = new_pool(idle_timeout=10, max_lifetime=60)
+		self.pool.checkin(self.pool.checkout())
+		self.entry = self.pool.idle[0]
+
+	def test_should_reuse_a_fresh_connection(self):
+		self.assertEqual(self.pool.checkout(), self.entry)
+
+	def test_should_close_an_idle_connection(self):
+		self.entry.last_used -= 11
+		self.assertNotEqual(self.pool.checkout(), self.entry)
+		self.assertTrue(self.entry.connection.unbound)
+		self.assertEqual(self.pool.created, 1)
+
+	def test_should_close_an_old_connection(self):
+		self.entry.created -= 61
+		self.assertNotEqual(self.pool.checkout(), self.entry)
+		self.assertTrue(self.entry.connection.unbound)
+
+class ABrokenConnection(unittest.TestCase):
+	def setUp(self):
+		self.factory, self.pool = new_pool()
+		self.pool.search_s('o=base', ldap.SCOPE_SUBTREE, '(uid=a)')
+		self.factory.connections[0].fail = True
+		self.result = self.pool.search_s(
+			'o=base', ldap.SCOPE_SUBTREE, '(uid=b)'
+		)
+
+	def test_should_be_replaced_by_a_newly_bound_one(self):
+		self.assertEqual(len(self.factory.connections), 2)
+		self.assertTrue(self.factory.connections[0].unbound)
+
+	def test_should_retry_the_operation(self):
+		self.assertEqual(self.result, 1)
+
+class AReservedConnection(unittest.TestCase):
+	def setUp(self):
+		self.factory, self.pool = new_pool()
+		self.other = self.pool.checkout()
+		self.pool.checkin(self.other)
+
+	def test_should_use_the_same_connection_for_all_operations(self):
+		with reserved(self.pool) as pool:
+			entry = self.pool.checkout()
+			pool.search_s('o=base', ldap.SCOPE_SUBTREE, '(uid=a)')
+			pool.search_s('o=base', ldap.SCOPE_SUBTREE, '(uid=b)')
+			self.pool.checkin(entry)
+		self.assertEqual(len(self.other.connection.calls), 2)
+
+	def test_should_check_the_connection_in_afterwards(self):
+		with reserved(self.pool):
+			self.assertEqual(self.pool.idle, [])
+		self.assertEqual(self.pool.idle, [ self.other ])
+
+	def test_should_yield_other_connections_unchanged(self):
+		connection = FakeConnection(0)
+		with reserved(connection) as result:
+			self.assertEqual(result, connection)
+
+class AnAsynchronousOperation(unittest.TestCase):
+	def setUp(self):
+		self.factory, self.pool = new_pool()
+		self.msgid = self.pool.search_ext('o=base', ldap.SCOPE_SUBTREE, '(a=b)')
+
+	def test_should_keep_the_connection_until_the_result_was_fetched(self):
+		self.assertEqual(self.pool.idle, [])
+		self.pool.result3(self.msgid)
+		self.assertEqual(len(self.pool.idle), 1)
+
+	def test_should_return_the_result_of_the_connection(self):
+		self.assertEqual(self.pool.result3(self.msgid)[2], self.msgid)
+
+	def test_should_raise_without_outstanding_operations(self):
+		self.pool.result3(self.msgid)
+		self.assertRaises(RuntimeError, self.pool.result3, self.msgid)
+
+	def test_should_keep_the_connection_after_partial_results(self):
+		entry = ( 'uid=a,o=base', {} )
+		self.factory.connections[0].results.append(
+			( ldap.RES_SEARCH_ENTRY, [ entry ], self.msgid, [] )
+		)
+		self.pool.result3(self.msgid, all=0)
+		self.assertEqual(self.pool.idle, [])
+		self.pool.result3(self.msgid, all=0)
+		self.assertEqual(len(self.pool.idle), 1)
+
+	def test_should_keep_the_connection_after_a_timeout(self):
+		self.factory.connections[0].results.append(ldap.TIMEOUT())
+		self.assertRaises(
+			ldap.TIMEOUT, self.pool.result3, self.msgid, timeout=1
+		)
+		self.assertEqual(self.pool.idle, [])
+		self.pool.result3(self.msgid)
+		self.assertEqual(len(self.pool.idle), 1)
+
+	def test_should_give_the_connection_back_after_an_error(self):
+		self.factory.connections[0].results.append(ldap.NO_SUCH_OBJECT())
+		self.assertRaises(ldap.NO_SUCH_OBJECT, self.pool.result3, self.msgid)
+		self.assertEqual(len(self.pool.idle), 1)
+
+	def test_should_wait_for_every_operation_with_res_any(self):
+		other = self.pool.search_ext('o=base', ldap.SCOPE_SUBTREE, '(c=d)')
+		self.factory.connections[0].results.extend([
+			( ldap.RES_SEARCH_RESULT, [], other, [] ),
+			( ldap.RES_SEARCH_RESULT, [], self.msgid, [] ),
+		])
+		self.pool.result3(ldap.RES_ANY)
+		self.assertEqual(self.pool.idle, [])
+		self.pool.result3(ldap.RES_ANY)
+		self.assertEqual(len(self.pool.idle), 1)
+
+class ConcurrentThreads(unittest.TestCase):
+	def setUp(self):
+		self.factory, self.pool = new_pool(size=3)
+		self.reserved = threading.Semaphore(0)
+		self.barrier = threading.Semaphore(0)
+		self.entries = []
+
+	def work(self):
+		with self.pool.reserve() as connection:
+			self.entries.append(connection)
+			self.reserved.release()
+			self.barrier.acquire()
+
+	def test_should_use_different_connections(self):
+		threads = [ threading.Thread(target=self.work) for i in range(3) ]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			self.reserved.acquire()
+		for thread in threads:
+			self.barrier.release()
+		for thread in threads:
+			thread.join(1)
+		self.assertEqual(len(set(map(id, self.entries))), 3)
+		self.assertEqual(len(self.pool.idle), 3)
+
+if __name__ == '__main__':
+	unittest.main()
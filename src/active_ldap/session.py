@@ -0,0 +1,715 @@
+"""
+This module includes the identity map, which makes sure that an entry of the
+directory is represented by only one instance within a unit of work, and the
+unit of work, which collects the writes of many instances and sends them
+together.
+"""
+import ldap
+import re
+import threading
+from collections import OrderedDict
+from ldap.controls import RequestControl
+from ldap.extop import ExtendedRequest
+from pool.pool import reserved
+from ber import encode_end_transaction, TRANSACTION_START
+from ber import TRANSACTION_SPECIFICATION, TRANSACTION_END
+
+_local = threading.local()
+
+def _identity_maps():
+	"""
+	Returns the stack of identity maps of the current thread.
+	"""
+	if not hasattr(_local, 'identity_maps'):
+		_local.identity_maps = []
+	return _local.identity_maps
+
+def current_identity_map():
+	"""
+	Returns the innermost active identity map of the current thread or None if
+	no identity map is active.
+	"""
+	identity_maps = _identity_maps()
+	if identity_maps:
+		return identity_maps[-1]
+	return None
+
+def normalize_id(elem_id):
+	"""
+	Returns the given value of a dn_attribute in the form in which ids are
+	compared. Like the directory the comparison is case-insensitive.
+
+	elem_id -- the value of the dn_attribute
+	"""
+	if isinstance(elem_id, unicode):
+		elem_id = elem_id.encode('utf-8')
+	return str(elem_id).lower()
+
+def _units_of_work():
+	"""
+	Returns the stack of units of work of the current thread.
+	"""
+	if not hasattr(_local, 'units_of_work'):
+		_local.units_of_work = []
+	return _local.units_of_work
+
+def current_unit_of_work():
+	"""
+	Returns the innermost active unit of work of the current thread or None if
+	no unit of work is active.
+	"""
+	units_of_work = _units_of_work()
+	if units_of_work:
+		return units_of_work[-1]
+	return None
+
+def supports_transactions(connection):
+	"""
+	Returns true if the root DSE of the server advertises the LDAP
+	transactions.
+
+	connection -- the ldap-connection
+	"""
+	try:
+		results = connection.search_s(
+			'', ldap.SCOPE_BASE, '(objectClass=*)', [ 'supportedExtension' ]
+		)
+	except ldap.LDAPError:
+		return False
+	for dn, attrs in results:
+		if TRANSACTION_START in attrs.get('supportedExtension', []):
+			return True
+	return False
+
+def entry_exists(connection, dn):
+	"""
+	Returns true if the entry with the given DN exists.
+
+	connection -- the ldap-connection
+	dn -- the distinguished name of the entry
+	"""
+	try:
+		return bool(connection.search_s(
+			dn, ldap.SCOPE_BASE, '(objectClass=*)', [ '1.1' ]
+		))
+	except ldap.NO_SUCH_OBJECT:
+		return False
+
+def dn_depth(dn):
+	"""
+	Returns the number of RDNs of the given DN.
+
+	dn -- the distinguished name
+	"""
+	return len(re.findall(r'(?<!\\),', dn)) + 1
+
+def notify(instance, event):
+	"""
+	Sends the given event of the instance to the listeners of its class.
+
+	instance -- the instance
+	event -- the name of the event, e.g. 'before_save'
+	"""
+	instance.events.notify(event, instance)
+
+class IdentityMap(object):
+	"""
+	This class maps DNs and IDs to the instances which were loaded within the
+	with-block. Loading an entry twice returns the same instance and find_by_id
+	is answered from memory:
+
+		with IdentityMap():
+			user = User.find_by_id('some_user')
+			user.device.users		# contains the same user instance
+			User.find_by_id('some_user') is user	# no search at all
+
+	Instances which were loaded before are returned as they are, so local
+	changes are never overwritten by a search. The identity map is bound to the
+	thread which entered it.
+	"""
+
+	def __init__(self):
+		"""
+		Constructor.
+		"""
+		self.by_dn = {}
+		self.by_id = {}
+		self.keys = {}
+
+	def __enter__(self):
+		_identity_maps().append(self)
+		return self
+
+	def __exit__(self, *exc_info):
+		_identity_maps().remove(self)
+		return False
+
+	def get(self, cls, dn):
+		"""
+		Returns the instance of the given class with the given DN or None.
+
+		cls -- the class of the instance
+		dn -- the distinguished name of the entry
+		"""
+		return self.by_dn.get( ( cls, dn.lower() ) )
+
+	def get_by_id(self, cls, elem_id):
+		"""
+		Returns the instance of the given class with the given value of the
+		dn_attribute or None.
+
+		cls -- the class of the instance
+		elem_id -- the value of the dn_attribute
+		"""
+		return self.by_id.get( ( cls, normalize_id(elem_id) ) )
+
+	def add(self, instance):
+		"""
+		Adds the instance to the identity map. If the instance was renamed its
+		old keys are removed.
+
+		instance -- the instance which has a dn
+		"""
+		self.remove(instance)
+		cls = instance.__class__
+		dn_key = ( cls, instance.dn.lower() )
+		id_key = ( cls, normalize_id(getattr(instance, instance.dn_attribute)) )
+		self.by_dn[dn_key] = instance
+		self.by_id[id_key] = instance
+		self.keys[id(instance)] = ( dn_key, id_key )
+
+	def remove(self, instance):
+		"""
+		Removes the instance from the identity map.
+
+		instance -- the instance which should be removed
+		"""
+		keys = self.keys.pop(id(instance), None)
+		if keys is None:
+			return
+		dn_key, id_key = keys
+		if self.by_dn.get(dn_key) is instance:
+			del self.by_dn[dn_key]
+		if self.by_id.get(id_key) is instance:
+			del self.by_id[id_key]
+
+	def remove_by_id(self, cls, elem_id):
+		"""
+		Removes the instance of the given class with the given ID.
+
+		cls -- the class of the instance
+		elem_id -- the value of the dn_attribute
+		"""
+		instance = self.get_by_id(cls, elem_id)
+		if instance is not None:
+			self.remove(instance)
+
+	def clear(self):
+		"""
+		Removes all instances from the identity map.
+		"""
+		self.by_dn.clear()
+		self.by_id.clear()
+		self.keys.clear()
+
+class Write(object):
+	"""
+	This class represents a single asynchronous operation of a flush.
+	"""
+
+	def __init__(self, model, method, args, instances=()):
+		"""
+		Constructor.
+
+		model -- the class whose connection sends the operation
+		method -- the name of the operation, e.g. 'modify_ext'
+		args -- the arguments of the operation
+		instances -- the instances which are written by the operation
+		"""
+		self.model = model
+		self.method = method
+		self.args = args
+		self.instances = list(instances)
+		self.error = None
+
+class Flush(object):
+	"""
+	This class plans and sends the writes of a single flush of a UnitOfWork.
+	The changes of all instances of an entry are coalesced into one write.
+	"""
+
+	def __init__(self, saves, deletes, modifications):
+		"""
+		Constructor.
+
+		saves -- the instances which should be saved
+		deletes -- the instances which should be deleted
+		modifications -- the (model, dn, changes) tuples of a UnitOfWork
+		"""
+		self.saves = saves
+		self.deletes = deletes
+		self.renames = []
+		self.creates = {}
+		self.modifies = OrderedDict()
+		self.removals = {}
+		self.created = {}
+		self.renamed = set()
+		self.updated = set()
+		self.failed = {}
+		for instance in saves:
+			self.plan_save(instance)
+		for model, dn, changes in modifications:
+			self.modify(model, dn, changes)
+		removed = {}
+		for instance in deletes:
+			self.plan_delete(instance, removed)
+
+	def plan_save(self, instance):
+		"""
+		Plans the writes which save the instance. New entries are created,
+		the first instance of a DN is added and the others modify it.
+		Renamed entries are renamed before they are modified.
+
+		instance -- the instance
+		"""
+		model = instance.__class__
+		if not hasattr(instance, 'dn'):
+			dn = instance._collect_dn()
+			depth = dn_depth(dn)
+			new_dns = [ i.args[0].lower() for i in self.creates.get(depth, ()) ]
+			self.created[id(instance)] = dn
+			if dn.lower() not in new_dns:
+				self.creates.setdefault(depth, []).append(Write(
+					model, 'add_ext', ( dn, instance._collect_new_attrs() ),
+					[ instance ]
+				))
+				return
+			self.modify(model, dn, instance._collect_changed_attrs(), instance)
+			return
+		dn = instance.dn
+		changes = instance._collect_changed_attrs()
+		if instance.has_dn_changed():
+			self.renames.append(Write(
+				model, 'rename', ( dn, instance._new_rdn() ), [ instance ]
+			))
+			self.renamed.add(id(instance))
+			dn = instance._renamed_dn()
+			# the rename replaces the value of the dn_attribute
+			changes = [ i for i in changes if i[1] != instance.dn_attribute ]
+		self.modify(model, dn, changes, instance)
+
+	def plan_delete(self, instance, removed):
+		"""
+		Plans the deletion of the entry of the instance.
+
+		instance -- the instance
+		removed -- the planned deletions by their normalized DN
+		"""
+		dn = instance._collect_dn()
+		write = removed.get(dn.lower())
+		if write is None:
+			write = removed[dn.lower()] = Write(
+				instance.__class__, 'delete_ext', ( dn, )
+			)
+			self.removals.setdefault(dn_depth(dn), []).append(write)
+		write.instances.append(instance)
+
+	def modify(self, model, dn, changes, instance=None):
+		"""
+		Adds changes to the modification of the given entry. Changes which
+		are already part of it, e.g. from two cascades, are sent once.
+
+		model -- the class whose connection sends the modification
+		dn -- the DN of the entry
+		changes -- a list of modifications
+		instance -- the instance which is written by the changes or None
+		"""
+		write = self.modifies.get(dn.lower())
+		if write is None:
+			write = self.modifies[dn.lower()] = Write(
+				model, 'modify_ext', ( dn, [] )
+			)
+		for change in changes:
+			if change not in write.args[1]:
+				write.args[1].append(change)
+		if instance is not None:
+			write.instances.append(instance)
+
+	def batches(self):
+		"""
+		Yields the writes in batches in the order in which they must be sent:
+		renames, creations with parents first, modifications and deletions
+		with children first. The modifications are collected when they are
+		needed, so failed creations can be turned into modifications.
+		"""
+		if self.renames:
+			yield self.renames
+		for depth in sorted(self.creates):
+			yield self.creates[depth]
+		modifies = [ i for i in self.modifies.values() if i.args[1] ]
+		if modifies:
+			yield modifies
+		for depth in sorted(self.removals, reverse=True):
+			yield self.removals[depth]
+
+	def send(self):
+		"""
+		Sends the batches one after another. The writes of a batch are
+		pipelined. Creations of existing entries are turned into
+		modifications like in Base.save.
+		"""
+		for batch in self.batches():
+			self.pipeline(batch)
+			for write in batch:
+				if write.error is None:
+					continue
+				if write.method == 'add_ext' and \
+				   isinstance(write.error, ldap.ALREADY_EXISTS):
+					self.update_existing(write)
+					continue
+				for instance in write.instances:
+					self.fail(instance, write.error)
+
+	def send_transaction(self, connection):
+		"""
+		Sends all writes pipelined within a single LDAP transaction, which is
+		aborted if one of the writes is refused. If creations were refused
+		because their entries exist they are turned into modifications and
+		the transaction is sent once more, like in Base.save. If the
+		transaction fails no instance was written.
+
+		connection -- the reserved connection
+		"""
+		error, errors = self.transact(connection)
+		if isinstance(error, ldap.ALREADY_EXISTS) and \
+		   self.update_existing_entries(connection):
+			error, errors = self.transact(connection)
+		if error is None:
+			return
+		for instance in self.saves + self.deletes:
+			self.fail(instance, errors.get(id(instance), error))
+
+	def transact(self, connection):
+		"""
+		Sends all writes within a transaction and returns the error which
+		aborted it, or None, and the errors of the refused writes by the ids
+		of their instances.
+
+		connection -- the reserved connection
+		"""
+		oid, identifier = connection.extop_s(
+			ExtendedRequest(TRANSACTION_START, None)
+		)
+		writes = []
+		for batch in self.batches():
+			writes.extend(batch)
+		for write in writes:
+			write.error = None
+		self.pipeline(writes, [
+			RequestControl(TRANSACTION_SPECIFICATION, True, identifier)
+		])
+		errors = {}
+		for write in writes:
+			if write.error is not None:
+				for instance in write.instances:
+					errors[id(instance)] = write.error
+		error = errors and errors.values()[0] or None
+		try:
+			connection.extop_s(ExtendedRequest(
+				TRANSACTION_END,
+				encode_end_transaction(identifier, error is None)
+			))
+		except ldap.LDAPError, e:
+			error = error or e
+		return ( error, errors )
+
+	def update_existing_entries(self, connection):
+		"""
+		Turns the planned creations of entries which already exist into
+		modifications. Returns true if there were such creations.
+
+		connection -- the reserved connection
+		"""
+		updated = False
+		for writes in self.creates.values():
+			for write in list(writes):
+				if not entry_exists(connection, write.args[0]):
+					continue
+				writes.remove(write)
+				self.update_existing(write)
+				updated = True
+		return updated
+
+	def pipeline(self, writes, serverctrls=None):
+		"""
+		Sends the writes at once and waits for their results afterwards.
+		The errors are stored in the writes.
+
+		writes -- the Writes
+		serverctrls -- the request controls of every write
+		"""
+		kwds = {}
+		if serverctrls is not None:
+			kwds['serverctrls'] = serverctrls
+		msgids = []
+		for write in writes:
+			method = getattr(write.model.connection, write.method)
+			try:
+				msgids.append(method(*write.args, **kwds))
+			except ldap.LDAPError, error:
+				write.error = error
+				msgids.append(None)
+		for write, msgid in zip(writes, msgids):
+			if msgid is None:
+				continue
+			try:
+				write.model.connection.result3(msgid)
+			except ldap.LDAPError, error:
+				write.error = error
+
+	def update_existing(self, write):
+		"""
+		Turns the failed creation of an existing entry into a modification.
+
+		write -- the failed Write of the creation
+		"""
+		instance = write.instances[0]
+		notify(instance, 'before_update')
+		self.updated.add(id(instance))
+		self.modify(
+			write.model, write.args[0], instance._collect_changed_attrs(),
+			instance
+		)
+
+	def fail(self, instance, error):
+		"""
+		Marks the instance as not written.
+
+		instance -- the instance
+		error -- the exception of the failed write
+		"""
+		self.failed.setdefault(id(instance), ( instance, error ))
+
+	def finish(self):
+		"""
+		Updates the written instances, sends their after_* events and
+		returns the (instance, exception) tuples of the failed ones.
+		"""
+		for instance in self.saves:
+			if id(instance) in self.failed:
+				continue
+			if id(instance) in self.created:
+				instance._created(self.created[id(instance)])
+			else:
+				if id(instance) in self.renamed:
+					instance._renamed()
+				instance._remember_original()
+			if id(instance) in self.created and \
+			   id(instance) not in self.updated:
+				notify(instance, 'after_create')
+			else:
+				notify(instance, 'after_update')
+			notify(instance, 'after_save')
+		for instance in self.deletes:
+			if id(instance) not in self.failed:
+				notify(instance, 'after_delete')
+		return [
+			self.failed[id(i)] for i in self.saves + self.deletes
+			if id(i) in self.failed
+		]
+
+class UnitOfWork(IdentityMap):
+	"""
+	This class collects the writes of many instances and sends them together
+	when the with-block is left or flush is called. Being an identity map,
+	every entry is loaded only once within the with-block:
+
+		with UnitOfWork() as unit_of_work:
+			for attrs in rows:
+				unit_of_work.save(User(attrs))
+			unit_of_work.delete(User.find_by_id('old_user'))
+		unit_of_work.errors		# the (instance, exception) tuples of the
+								# writes which failed
+
+	The changes of all instances of an entry are coalesced into a single
+	modification and deleting an entry wins over saving it. The writes are
+	sent in batches of pipelined asynchronous operations: renames first,
+	then creations with parents first, modifications and deletions with
+	children first. Relations cascade into the same unit of work. If the
+	server supports LDAP transactions (RFC 5805) all writes are sent within
+	a single transaction instead, which is applied all together or not at
+	all. Creations of existing entries are turned into modifications in both
+	cases, in a transaction by sending it once more.
+
+	The before_* events of the instances are sent when the writes are
+	planned, the after_* events only for the instances which were written.
+	If the with-block raises an exception nothing is written. All instances
+	should share the same connection.
+	"""
+
+	def __init__(self, transactions=None):
+		"""
+		Constructor.
+
+		transactions -- True if the writes should be sent in a transaction,
+						False if not and None if a transaction should be
+						used when the server supports it
+		"""
+		IdentityMap.__init__(self)
+		self.transactions = transactions
+		self.errors = []
+		self._planned = None
+		self.discard()
+
+	def __enter__(self):
+		IdentityMap.__enter__(self)
+		_units_of_work().append(self)
+		return self
+
+	def __exit__(self, exc_type, *exc_info):
+		try:
+			if exc_type is None:
+				self.flush()
+			else:
+				self.discard()
+		finally:
+			_units_of_work().remove(self)
+			IdentityMap.__exit__(self, exc_type, *exc_info)
+		return False
+
+	def save(self, instance):
+		"""
+		Schedules the instance to be saved (created or updated) by the next
+		flush. Returns True like Base.save.
+
+		instance -- the instance which should be saved
+		"""
+		self._schedule('save', instance)
+		return True
+
+	def delete(self, instance):
+		"""
+		Schedules the entry of the instance to be deleted by the next flush.
+		Returns True like Base.delete.
+
+		instance -- the instance which should be deleted
+		"""
+		self._schedule('delete', instance)
+		return True
+
+	def modify(self, model, dn, changes):
+		"""
+		Schedules modifications of an entry which are sent together with the
+		changes of the instances of the entry, e.g. the foreign keys which
+		are changed by a cascade.
+
+		model -- the class whose connection sends the modifications
+		dn -- the DN of the entry
+		changes -- a list of modifications
+		"""
+		self._modifications.append( ( model, dn, changes ) )
+
+	def is_planning(self, instance):
+		"""
+		Returns true if the before_* events of the given instance are sent
+		while its write is planned. Cascades of other writes are sent
+		directly.
+
+		instance -- the instance
+		"""
+		return self._planned is instance
+
+	def discard(self):
+		"""
+		Forgets all scheduled writes.
+		"""
+		self._pending = []
+		self._scheduled = set()
+		self._modifications = []
+
+	def flush(self):
+		"""
+		Sends all scheduled writes and returns the (instance, exception)
+		tuples of the instances which weren't written. They are collected in
+		errors, too.
+		"""
+		try:
+			saves, deletes = self._prepare()
+			if not saves and not deletes and not self._modifications:
+				return []
+			flush = Flush(saves, deletes, self._modifications)
+			connection = self._connection(saves + deletes)
+			with reserved(connection) as connection:
+				if self._use_transactions(connection):
+					flush.send_transaction(connection)
+				else:
+					flush.send()
+		finally:
+			self.discard()
+		errors = flush.finish()
+		self.errors.extend(errors)
+		return errors
+
+	def _schedule(self, action, instance):
+		"""
+		Schedules the given action of the instance once.
+
+		action -- 'save' or 'delete'
+		instance -- the instance
+		"""
+		key = ( action, id(instance) )
+		if key in self._scheduled:
+			return
+		self._scheduled.add(key)
+		self._pending.append( ( action, instance ) )
+
+	def _prepare(self):
+		"""
+		Sends the before_* events of the scheduled instances, whose cascades
+		might schedule further writes, and returns the instances which should be
+		saved and deleted.
+		"""
+		index = 0
+		try:
+			while index < len(self._pending):
+				action, instance = self._pending[index]
+				index += 1
+				self._planned = instance
+				if action == 'delete':
+					notify(instance, 'before_delete')
+					continue
+				notify(instance, 'before_save')
+				if hasattr(instance, 'dn'):
+					notify(instance, 'before_update')
+				else:
+					notify(instance, 'before_create')
+		finally:
+			self._planned = None
+		deletes = [ i for kind, i in self._pending if kind == 'delete' ]
+		deleted = set([ i._collect_dn().lower() for i in deletes ])
+		saves = [
+			i for kind, i in self._pending
+			if kind == 'save' and i._collect_dn().lower() not in deleted
+		]
+		return ( saves, deletes )
+
+	def _connection(self, instances):
+		"""
+		Returns the connection which sends the writes.
+
+		instances -- the instances which should be written
+		"""
+		if instances:
+			return instances[0].connection
+		return self._modifications[0][0].connection
+
+	def _use_transactions(self, connection):
+		"""
+		Returns true if the writes should be sent in a transaction. The
+		support of the server is only checked once.
+
+		connection -- the reserved connection
+		"""
+		if self.transactions is None:
+			self.transactions = supports_transactions(connection)
+		return self.transactions
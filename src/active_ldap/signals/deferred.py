@@ -0,0 +1,177 @@
+"""
+This module includes the deferred delivery of events. Callbacks which are
+registered with a DeferredDelivery are called by a pool of worker threads
+instead of the thread which sent the event:
+
+	delivery = DeferredDelivery(workers=4, queue_size=1000)
+	User.events.register('after_save', audit_log, delivery)
+	...
+	delivery.drain()	# waits until all queued events were delivered
+
+Events with the same ordering key are delivered by the same worker in the
+order in which they were sent. The queues are bounded: if a worker falls
+behind, sending an event blocks until there is space again.
+
+The messages are queued as they are when the event is sent. Messages which
+define a _snapshot method are replaced by the copy it returns, since the
+sender might change them before a worker delivers the event. A message can
+define its ordering key with an _ordering_key method, e.g. instances of
+active_ldap.Base are ordered by their DN.
+"""
+import sys
+import threading
+import Queue
+
+stop = object()
+"""
+Tells a worker to stop.
+"""
+
+def first_message(event, *messages):
+	"""
+	Returns the ordering key of the first message of an event, which is the
+	default ordering key: the result of its _ordering_key method or the
+	message itself.
+
+	event -- the name of the event
+	messages -- the messages of the event
+	"""
+	message = messages[0]
+	ordering_key = getattr(message, '_ordering_key', None)
+	if ordering_key is None or isinstance(message, type):
+		return message
+	return ordering_key()
+
+def snapshot(message):
+	"""
+	Returns the message which is queued for the given one: the copy which
+	its _snapshot method returns or the message itself.
+
+	message -- a message of an event
+	"""
+	copy = getattr(message, '_snapshot', None)
+	if copy is None or isinstance(message, type):
+		return message
+	return copy()
+
+class DeferredCallback(object):
+	"""
+	This class wraps a callback which is called by the workers of a
+	DeferredDelivery. It compares equal to the wrapped callback, so it can be
+	unregistered like it.
+	"""
+
+	def __init__(self, delivery, callback):
+		"""
+		Constructor.
+
+		delivery -- the DeferredDelivery
+		callback -- the wrapped callback
+		"""
+		self.delivery = delivery
+		self.callback = callback
+
+	def __call__(self, event, *messages):
+		self.delivery.put(self.callback, event, messages)
+
+	def __eq__(self, other):
+		if isinstance(other, DeferredCallback):
+			other = other.callback
+		return self.callback == other
+
+	def __ne__(self, other):
+		return not self == other
+
+class DeferredDelivery(object):
+	"""
+	This class delivers events with a pool of worker threads. Every worker has
+	its own bounded queue and an event is queued for the worker which belongs
+	to its ordering key.
+	"""
+
+	def __init__(self, workers=2, queue_size=1000, key=first_message,
+				 timeout=None):
+		"""
+		Constructor.
+
+		workers -- the number of worker threads
+		queue_size -- the maximal number of queued events per worker
+		key -- a function which returns the ordering key of an event, it gets
+			   the same arguments as a callback
+		timeout -- the number of seconds to wait for space in a full queue
+				   before Queue.Full is raised, None to wait forever
+		"""
+		self.key = key
+		self.timeout = timeout
+		self.errors = []
+		self.lock = threading.Lock()
+		self.queues = [ Queue.Queue(queue_size) for i in range(workers) ]
+		self.threads = []
+		for queue in self.queues:
+			thread = threading.Thread(target=self._work, args=( queue, ))
+			thread.daemon = True
+			thread.start()
+			self.threads.append(thread)
+
+	def wrap(self, callback):
+		"""
+		Returns a callback which queues its events for the given callback.
+
+		callback -- the callback which should be called by the workers
+		"""
+		return DeferredCallback(self, callback)
+
+	def put(self, callback, event, messages):
+		"""
+		Queues an event for the given callback.
+
+		callback -- the callback which should be called
+		event -- the name of the event
+		messages -- the messages of the event
+		"""
+		messages = tuple([ snapshot(i) for i in messages ])
+		index = hash(self.key(event, *messages)) % len(self.queues)
+		self.queues[index].put(
+			( callback, event, messages ), True, self.timeout
+		)
+
+	def drain(self):
+		"""
+		Waits until every queued event was delivered and returns the
+		exceptions which the callbacks raised since the last drain.
+		"""
+		for queue in self.queues:
+			queue.join()
+		with self.lock:
+			errors, self.errors = self.errors, []
+		return errors
+
+	def close(self):
+		"""
+		Delivers the queued events and stops the workers.
+		"""
+		for queue in self.queues:
+			queue.put(stop)
+		for thread in self.threads:
+			thread.join()
+		self.threads = []
+
+	def _work(self, queue):
+		"""
+		Delivers the events of the given queue until it is stopped.
+
+		queue -- the queue of the worker
+		"""
+		while True:
+			item = queue.get()
+			try:
+				if item is stop:
+					return
+				callback, event, messages = item
+				try:
+					callback(event, *messages)
+				except Exception:
+					with self.lock:
+						self.errors.append(sys.exc_info()[1])
+			finally:
+				queue.task_done()
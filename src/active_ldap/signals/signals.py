@@ -4,7 +4,16 @@ This module includes all necessary classes for the usage of the signals-package
 class Sender(object):
 	"""
 	This class represents a sender which is able to send events to registered
-	callbacks.
+	callbacks. The callbacks of every event are looked up once and cached
+	until callbacks are registered or unregistered, or the Sendable class
+	which owns the sender is changed.
+	"""
+
+	delivery = None
+	"""
+	A DeferredDelivery which calls the callbacks registered afterwards, None
+	if they should be called synchronously. before_* events and the __all__
+	event are always delivered synchronously.
 	"""
 	
 	def get_callbacks(self):
@@ -21,6 +30,7 @@ class Sender(object):
 		Sets the callbacks
 		"""
 		self._callbacks = callbacks
+		self._dispatch = {}
 
 	callbacks = property(get_callbacks, set_callbacks)
 
@@ -39,24 +49,81 @@ class Sender(object):
 		occured.
 		"""
 		self._catchall_callbacks = callbacks
+		self._dispatch = {}
 
 	catchall_callbacks = property(
 		get_catchall_callbacks, set_catchall_callbacks
 	)
-		
+
+	def get_delegates(self):
+		"""
+		Returns the list of delegates, which are asked for a callback once
+		per event.
+		"""
+		if not hasattr(self, '_delegates'):
+			self._delegates = []
+		return self._delegates
+
+	delegates = property(get_delegates)
+
+	def register_delegate(self, delegate):
+		"""
+		Registers a delegate. Its callback_for method gets the name of an
+		event and returns the callback for the event or None. The delegates
+		are called before all other callbacks.
+
+		delegate -- the delegate, e.g. a SenderDelegator
+		"""
+		self.delegates.append(delegate)
+		self._dispatch = {}
 	
-	def register(self, event, callback):
+	def register(self, event, callback, delivery=None):
 		"""
 		Registers a callback for a given event.
 		
 		event -- the event for which the callback should be registered
 		callback -- the callback itself, which should be called if the event
 		occured.
+		delivery -- a DeferredDelivery which should call the callback,
+		defaults to the delivery of the sender. before_* events can't be
+		deferred, as their callbacks might veto or modify the operation.
 		"""
+		synchronous = event == '__all__' or event.startswith('before_')
+		if delivery is None and not synchronous:
+			delivery = self.delivery
+		if delivery is not None:
+			if synchronous:
+				raise ValueError("%s events can't be deferred" % event)
+			callback = delivery.wrap(callback)
+		self._dispatch = {}
 		if event == '__all__':
 			self.catchall_callbacks.append(callback)
 			return
 		self.callbacks.setdefault(event, []).append(callback)
+
+	def listeners(self, event):
+		"""
+		Returns a tuple of all callbacks which are notified for the given
+		event: the callbacks of the delegates, the catch-all callbacks and the
+		callbacks registered for the event.
+
+		event -- the name of the event
+		"""
+		try:
+			return self._dispatch[event]
+		except AttributeError:
+			self._dispatch = {}
+		except KeyError:
+			pass
+		callbacks = []
+		for delegate in self.delegates:
+			callback = delegate.callback_for(event)
+			if callback is not None:
+				callbacks.append(callback)
+		callbacks += self.catchall_callbacks
+		callbacks += self.callbacks.get(event, [])
+		self._dispatch[event] = listeners = tuple(callbacks)
+		return listeners
 		
 	def notify(self, event, *messages):
 		"""
@@ -66,11 +133,7 @@ class Sender(object):
 		event -- the event which occured
 		message -- the message which should be send
 		"""
-		for callback in self.catchall_callbacks:
-			callback(event, *messages)
-		if event not in self.callbacks:
-			return
-		for callback in self.callbacks[event]:
+		for callback in self.listeners(event):
 			callback(event, *messages)
 
 	def unregister(self, event, callback):
@@ -80,6 +143,7 @@ class Sender(object):
 		event -- the event for which the callback should be unregistered
 		callback -- the callback which should be removed
 		"""
+		self._dispatch = {}
 		if event == '__all__':
 			self.catchall_callbacks.remove(callback)
 			return
@@ -93,13 +157,44 @@ class SenderDelegator(object):
 	as the occured events.
 	"""
 	
-	def __init__(self, sender):
+	def __init__(self, sender, cls=None):
 		"""
-		Intializes the delegate mixin
+		Intializes the delegate mixin. If the class of the objects is known
+		the delegator is only notified of the events for which the class
+		defines methods. These must be defined before the first event is
+		sent.
 		
 		sender -- the sender-object which will emit the events
+		cls -- the class of the objects which send the events or None
+		"""
+		self.cls = cls
+		if cls is None:
+			sender.register('__all__', self._event_received)
+		else:
+			sender.register_delegate(self)
+
+	def callback_for(self, event):
+		"""
+		Returns the callback for the given event: if the class defines a
+		method with its name it is called directly, otherwise the callback
+		looks it up on the object which sent the event, since it might have
+		been set on the object itself.
+
+		event -- the name of the event
 		"""
-		sender.register('__all__', self._event_received)
+		if callable(getattr(self.cls, event, None)):
+			return self._delegate
+		return self._event_received
+
+	def _delegate(self, event, *messages):
+		"""
+		Calls the method with the name of the event on the object which sent
+		it, which is the first element of the messages.
+
+		event -- the received event.
+		messages -- the received messages.
+		"""
+		getattr(messages[0], event)(*messages[1:])
 	
 	def _event_received(self, event, *messages):
 		"""
@@ -111,9 +206,9 @@ class SenderDelegator(object):
 		event -- the received event.
 		messages -- the received messages.
 		"""
-		obj = messages[0]
-		if hasattr(obj, event):
-			getattr(obj, event)(*messages[1:])
+		method = getattr(messages[0], event, None)
+		if method is not None:
+			method(*messages[1:])
 
 def send_event(func):
 	"""
@@ -124,13 +219,15 @@ def send_event(func):
 	automatic dispatch-mechanism with the Sendable metaclass will probably 
 	fail.
 	"""
+	before_name = 'before_%s' % func.__name__
+	after_name  = 'after_%s' % func.__name__
 	def new_fun(self, *args, **kwds):
-		before_name = 'before_%s' % func.__name__
-		after_name  = 'after_%s' % func.__name__
-
-		self.events.notify(before_name, self)
+		events = self.events
+		for callback in events.listeners(before_name):
+			callback(before_name, self)
 		result = func(self, *args, **kwds)
-		self.events.notify(after_name, self)
+		for callback in events.listeners(after_name):
+			callback(after_name, self)
 
 		return result
 	return new_fun
@@ -157,4 +254,26 @@ class Sendable(type):
 	def __init__(cls, name, bases, dct):
 		super(Sendable, cls).__init__(name, bases, dct)
 		cls.events = Sender()
-		cls._delegator = SenderDelegator(cls.events)
+		cls._delegator = SenderDelegator(cls.events, cls)
+
+	def __setattr__(cls, name, value):
+		super(Sendable, cls).__setattr__(name, value)
+		cls._methods_changed()
+
+	def __delattr__(cls, name):
+		super(Sendable, cls).__delattr__(name)
+		cls._methods_changed()
+
+	def _methods_changed(cls):
+		"""
+		Resets the cached callbacks of the class and its subclasses after an
+		attribute of the class was set or deleted, since it might be a method
+		which receives events.
+		"""
+		classes = [ cls ]
+		while classes:
+			current = classes.pop()
+			events = current.__dict__.get('events')
+			if events is not None:
+				events._dispatch = {}
+			classes += current.__subclasses__()
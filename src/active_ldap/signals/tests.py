@@ -1,5 +1,8 @@
 import unittest
-from signals import Sender
+import threading
+import Queue
+from signals import Sender, Sendable, send_event
+from deferred import DeferredDelivery
 
 class AnNewSender(unittest.TestCase):
 	def setUp(self):
@@ -117,5 +120,254 @@ class ACallBackWhichRegisteredToThe__all__event(unittest.TestCase):
 		self.sender.notify('event', 'msg1', 'msg2')
 		self.assertTrue(self.called)
 
+class ASenderWhichCachedTheListenersOfAnEvent(unittest.TestCase):
+	def setUp(self):
+		self.sender = Sender()
+		self.sender.register('event', self.callback)
+		self.listeners = self.sender.listeners('event')
+		self.called = []
+
+	def callback(self, event, arg):
+		self.called.append(event)
+
+	def test_should_return_the_cached_tuple(self):
+		self.assertTrue(self.sender.listeners('event') is self.listeners)
+
+	def test_should_notify_callbacks_registered_afterwards(self):
+		self.sender.register('__all__', self.callback)
+		self.sender.notify('event', 'msg')
+		self.assertEqual(self.called, [ 'event', 'event' ])
+
+	def test_should_forget_unregistered_callbacks(self):
+		self.sender.unregister('event', self.callback)
+		self.assertEqual(self.sender.listeners('event'), ())
+
+class Touchable(object):
+	__metaclass__ = Sendable
+
+	def __init__(self):
+		self.received = []
+
+	@send_event
+	def touch(self):
+		self.received.append('touch')
+
+	def before_touch(self):
+		self.received.append('before_touch')
+
+class TouchableChild(Touchable):
+	def after_touch(self):
+		self.received.append('after_touch')
+
+class PlainTouchable(Touchable):
+	pass
+
+class ASendableClassWithEventMethods(unittest.TestCase):
+	def test_should_call_the_methods_of_the_class(self):
+		touchable = Touchable()
+		touchable.touch()
+		self.assertEqual(touchable.received, [ 'before_touch', 'touch' ])
+
+	def test_should_call_the_methods_of_subclasses(self):
+		child = TouchableChild()
+		child.touch()
+		self.assertEqual(
+			child.received, [ 'before_touch', 'touch', 'after_touch' ]
+		)
+
+	def test_should_call_the_methods_directly_if_the_class_has_them(self):
+		self.assertEqual(
+			Touchable.events.listeners('before_touch'),
+			( Touchable._delegator._delegate, )
+		)
+		self.assertEqual(
+			Touchable.events.listeners('after_touch'),
+			( Touchable._delegator._event_received, )
+		)
+		self.assertEqual(
+			TouchableChild.events.listeners('after_touch'),
+			( TouchableChild._delegator._delegate, )
+		)
+
+	def test_should_call_the_methods_of_an_instance(self):
+		touchable = Touchable()
+		touchable.after_touch = lambda: touchable.received.append('after')
+		touchable.touch()
+		self.assertEqual(
+			touchable.received, [ 'before_touch', 'touch', 'after' ]
+		)
+
+class ASendableClassWhichGetsAnEventMethod(unittest.TestCase):
+	def setUp(self):
+		self.touchable = Touchable()
+		self.touchable.touch()
+		PlainTouchable().touch()
+		Touchable.after_touch = lambda self: self.received.append('after')
+
+	def tearDown(self):
+		if 'after_touch' in Touchable.__dict__:
+			del Touchable.after_touch
+
+	def test_should_call_the_new_method(self):
+		self.touchable.touch()
+		self.assertEqual(self.touchable.received[-1], 'after')
+		self.assertEqual(
+			Touchable.events.listeners('after_touch'),
+			( Touchable._delegator._delegate, )
+		)
+
+	def test_should_call_the_new_method_in_subclasses(self):
+		plain = PlainTouchable()
+		plain.touch()
+		self.assertEqual(plain.received[-1], 'after')
+
+	def test_should_call_the_method_of_the_subclass(self):
+		child = TouchableChild()
+		child.touch()
+		self.assertEqual(child.received[-1], 'after_touch')
+
+	def test_should_forget_the_deleted_method(self):
+		del Touchable.after_touch
+		self.touchable.touch()
+		self.assertEqual(self.touchable.received[-1], 'touch')
+
+class ADeferredDelivery(unittest.TestCase):
+	def setUp(self):
+		self.delivery = DeferredDelivery(workers=2, queue_size=2)
+		self.sender = Sender()
+		self.received = []
+		self.sender.register('after_save', self.callback, self.delivery)
+
+	def tearDown(self):
+		self.delivery.close()
+
+	def callback(self, event, key, value):
+		self.received.append( ( key, value, threading.current_thread() ) )
+
+	def test_should_call_the_callbacks_in_a_worker(self):
+		self.sender.notify('after_save', 'a', 1)
+		self.assertEqual(self.delivery.drain(), [])
+		self.assertEqual(self.received[0][:2], ( 'a', 1 ))
+		self.assertFalse(self.received[0][2] is threading.current_thread())
+
+	def test_should_deliver_the_events_of_a_key_in_order(self):
+		for i in range(20):
+			for key in ( 'a', 'b', 'c' ):
+				self.sender.notify('after_save', key, i)
+		self.delivery.drain()
+		for key in ( 'a', 'b', 'c' ):
+			self.assertEqual(
+				[ i[1] for i in self.received if i[0] == key ], range(20)
+			)
+
+	def test_should_return_the_errors_of_the_callbacks(self):
+		self.sender.register('after_delete', lambda event, key, value: 1 / 0,
+							 self.delivery)
+		self.sender.notify('after_delete', 'a', 1)
+		errors = self.delivery.drain()
+		self.assertEqual(len(errors), 1)
+		self.assertTrue(isinstance(errors[0], ZeroDivisionError))
+		self.assertEqual(self.delivery.drain(), [])
+
+	def test_should_unregister_the_callback(self):
+		self.sender.unregister('after_save', self.callback)
+		self.sender.notify('after_save', 'a', 1)
+		self.delivery.drain()
+		self.assertEqual(self.received, [])
+
+	def test_should_keep_before_events_synchronous(self):
+		self.assertRaises(
+			ValueError, self.sender.register, 'before_save', self.callback,
+			self.delivery
+		)
+
+class Entry(object):
+	def __init__(self, name):
+		self.name = name
+
+	def _snapshot(self):
+		return Entry(self.name)
+
+	def _ordering_key(self):
+		return self.name
+
+class ADeferredDeliveryOfEntries(unittest.TestCase):
+	def setUp(self):
+		self.delivery = DeferredDelivery(workers=1)
+		self.release = threading.Event()
+		self.sender = Sender()
+		self.received = []
+		self.sender.register('after_save', self.callback, self.delivery)
+
+	def tearDown(self):
+		self.release.set()
+		self.delivery.close()
+
+	def callback(self, event, entry):
+		self.release.wait()
+		self.received.append(entry)
+
+	def test_should_deliver_the_entries_as_they_were_sent(self):
+		entry = Entry('a')
+		self.sender.notify('after_save', entry)
+		entry.name = 'b'
+		self.release.set()
+		self.delivery.drain()
+		self.assertEqual([ i.name for i in self.received ], [ 'a' ])
+		self.assertFalse(self.received[0] is entry)
+
+	def test_should_order_the_entries_by_their_keys(self):
+		self.assertEqual(self.delivery.key('after_save', Entry('a')), 'a')
+
+	def test_should_order_other_messages_by_themselves(self):
+		self.assertEqual(self.delivery.key('after_save', Entry), Entry)
+
+class ADeferredDeliveryWithAFullQueue(unittest.TestCase):
+	def setUp(self):
+		self.delivery = DeferredDelivery(
+			workers=1, queue_size=1, timeout=0.01
+		)
+		self.release = threading.Event()
+		self.sender = Sender()
+		self.sender.register(
+			'after_save', lambda event, key: self.release.wait(),
+			self.delivery
+		)
+
+	def tearDown(self):
+		self.release.set()
+		self.delivery.close()
+
+	def test_should_block_the_sender_until_the_timeout(self):
+		self.sender.notify('after_save', 'a')
+		self.sender.notify('after_save', 'a')
+		self.assertRaises(Queue.Full, self.sender.notify, 'after_save', 'a')
+
+class ASenderWithADelivery(unittest.TestCase):
+	def setUp(self):
+		self.sender = Sender()
+		self.sender.register('after_save', self.callback)
+		self.sender.delivery = self.delivery = DeferredDelivery()
+		self.sender.register('after_save', self.callback)
+		self.sender.register('before_save', self.callback)
+		self.threads = []
+
+	def tearDown(self):
+		self.delivery.close()
+
+	def callback(self, event, arg):
+		self.threads.append(threading.current_thread())
+
+	def test_should_defer_the_later_registrations(self):
+		self.sender.notify('after_save', 'msg')
+		self.delivery.drain()
+		self.assertEqual(len(self.threads), 2)
+		self.assertTrue(self.threads[0] is threading.current_thread())
+		self.assertFalse(self.threads[1] is threading.current_thread())
+
+	def test_should_keep_before_events_synchronous(self):
+		self.sender.notify('before_save', 'msg')
+		self.assertEqual(self.threads, [ threading.current_thread() ])
+
 if __name__ == '__main__':
 	unittest.main()
@@ -108,7 +108,8 @@ class FindAll(object):
 		self.controller.expectAndReturn(self.search_s_mock(
 			'ou=user,o=schule',
 			ldap.SCOPE_SUBTREE,
-			'(&(objectClass=klass1)(objectClass=klass2))'
+			'(&(objectClass=klass1)(objectClass=klass2))',
+			[ 'attribute1', 'attribute2' ]
 		), [])
 		TestModel.connection = ConnectionStub(search_s=self.search_s_mock)
 		self.controller.replay()
@@ -128,7 +129,8 @@ class FindAll(object):
 		self.controller.expectAndReturn(self.search_s_mock(
 			'ou=user,o=schule',
 			ldap.SCOPE_SUBTREE,
-			'(&(objectClass=klass1))'
+			'(&(objectClass=klass1))',
+			[ 'attribute1', 'attribute2' ]
 		), test_data)
 		TestModel2.connection = ConnectionStub(search_s=self.search_s_mock)
 		self.controller.replay()
@@ -156,7 +158,8 @@ class Find(object):
 		self.controller.expectAndReturn(self.search_s_mock(
 			'ou=user,o=schule',
 			ldap.SCOPE_SUBTREE,
-			'(&(objectClass=klass1)(objectClass=klass2)(attribute2=someid))'
+			'(&(objectClass=klass1)(objectClass=klass2)(attribute2=someid))',
+			[ 'attribute1', 'attribute2' ]
 		), [])
 		TestModel.connection = ConnectionStub(search_s=self.search_s_mock)
 		self.controller.replay()
@@ -175,7 +178,8 @@ class Find(object):
 		self.controller.expectAndReturn(self.search_s_mock(
 			'ou=user,o=schule',
 			ldap.SCOPE_SUBTREE,
-			'(&(objectClass=klass1)(attribute2=someid))'
+			'(&(objectClass=klass1)(attribute2=someid))',
+			[ 'attribute1', 'attribute2' ]
 		), test_data)
 		TestModel2.connection = ConnectionStub(search_s=self.search_s_mock)
 		self.controller.replay()
@@ -195,7 +199,8 @@ class FindById(object):
 		self.controller.expectAndReturn(self.search_s_mock(
 			'ou=user,o=schule',
 			ldap.SCOPE_SUBTREE,
-			'(&(objectClass=klass1)(objectClass=klass2)(attribute1=someid))'
+			'(&(objectClass=klass1)(objectClass=klass2)(attribute1=someid))',
+			[ 'attribute1', 'attribute2' ]
 		), [])
 		TestModel.connection = ConnectionStub(search_s=self.search_s_mock)
 		self.controller.replay()
@@ -215,7 +220,8 @@ class FindById(object):
 		self.controller.expectAndReturn(self.search_s_mock(
 			'ou=user,o=schule',
 			ldap.SCOPE_SUBTREE,
-			'(&(objectClass=klass1)(attribute1=someid))'
+			'(&(objectClass=klass1)(attribute1=someid))',
+			[ 'attribute1', 'attribute2' ]
 		), test_data)
 		self.controller.replay()
 		self.result = TestModel2.find_by_id('someid')
@@ -231,12 +237,6 @@ class Save(object):
 	@pyspec.context(group=1)
 	def a_model_which_dont_exists(self):
 		self.controller = pymock.Controller()
-		self.search_s_mock = self.controller.mock()
-		self.controller.expectAndReturn(self.search_s_mock(
-			'ou=user,o=schule',
-			ldap.SCOPE_SUBTREE,
-			'(&(objectClass=klass1)(objectClass=klass2)(attribute1=testattr1))'
-		), [])
 		self.add_s_mock = self.controller.mock()
 		self.controller.expectAndReturn(self.add_s_mock(
 			'attribute1=testattr1,ou=user,o=schule', [
@@ -244,10 +244,7 @@ class Save(object):
 			('attribute2', 'testattr2'),
 			('objectClass', [ 'klass1', 'klass2' ]),
 		]), None)
-		TestModel.connection = ConnectionStub(
-			search_s=self.search_s_mock,
-			add_s=self.add_s_mock
-		)
+		TestModel.connection = ConnectionStub(add_s=self.add_s_mock)
 		self.model = TestModel({
 			'attribute1': 'testattr1',
 			'attribute2': 'testattr2',
@@ -265,24 +262,14 @@ class Save(object):
 		self.modify_s_mock = self.controller.mock()
 		self.controller.expectAndReturn(self.modify_s_mock(
 			'attribute1=testattr1,ou=user,o=schule', [
-			(ldap.MOD_REPLACE, 'attribute1', 'testattr1'),
-			(ldap.MOD_REPLACE, 'attribute2', 'testattr2'),
-			(ldap.MOD_REPLACE, 'objectClass', [ 'klass1', 'klass2' ]),
+			(ldap.MOD_REPLACE, 'attribute2', 'changedattr2'),
 		]), None)
-		self.modrdn_s_mock = self.controller.mock()
-		self.controller.expectAndReturn(self.modrdn_s_mock(
-			'attribute1=testattr1,ou=user,o=schule', 
-			'attribute1=testattr1',
-			True
-		), None)
-		TestModel.connection = ConnectionStub(
-			modify_s=self.modify_s_mock,
-			modrdn_s=self.modrdn_s_mock,
-		)
+		TestModel.connection = ConnectionStub(modify_s=self.modify_s_mock)
 		self.model = TestModel({
 			'attribute1': 'testattr1',
 			'attribute2': 'testattr2',
 		}, 'attribute1=testattr1,ou=user,o=schule')
+		self.model.attribute2 = 'changedattr2'
 		self.controller.replay()
 		self.result = self.model.save()
 		
@@ -332,12 +319,14 @@ class HasMany(object):
 			self.controller.expectAndReturn(self.search_s_mock(
 				'ou=user,o=schule',
 				ldap.SCOPE_SUBTREE,
-				'(&(objectClass=klass1)(attribute1=tester))'
+				'(&(objectClass=klass1)(attribute1=tester))',
+				[ 'attribute1', 'attribute2' ]
 			), test_data)
 			self.controller.expectAndReturn(self.search_s_mock(
 				'ou=user,o=schule',
 				ldap.SCOPE_SUBTREE,
-				'(&(objectClass=klass4)(attribute1=tester))'
+				'(&(objectClass=klass4)(attribute1=tester))',
+				[ 'attribute1', 'attribute5' ]
 			), test_data[-1:])
 		stub = ConnectionStub(search_s=self.search_s_mock)
 		TestModel2.connection = stub